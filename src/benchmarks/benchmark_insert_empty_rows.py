@@ -0,0 +1,127 @@
+import argparse
+import timeit
+import numpy as np
+import pandas as pd
+from src.utils.reshape_data import insert_empty_rows
+
+
+def insert_empty_rows_loop(df, by):
+    """The original, group-by-group implementation of `insert_empty_rows`.
+    Kept as a reference for the benchmark.
+
+    Args:
+        df: a pandas.DataFrame
+        by: a column of `df` that will be used for the grouping
+
+    Returns:
+        pandas.DataFrame: the same as the input `df` with empty lines inserted
+        between groups
+    """
+
+    df_parts = []
+
+    for level, df_part in df.groupby(by):
+        empty = pd.DataFrame(
+            [[level if colname == by else np.nan for colname in df.columns]],
+            columns=df.columns
+        )
+        df_parts.append(pd.concat([df_part, empty]))
+
+    return pd.concat(df_parts)
+
+
+def generate_shapes(num_shapes, points_per_shape, seed=0):
+    """Generates a random dataset with the layout of shapes.txt.
+
+    Args:
+        num_shapes: the number of distinct shape ids
+        points_per_shape: the number of points of each shape
+        seed: seed of the random number generator
+
+    Returns:
+        pandas.DataFrame: a shuffled dataset of shape points
+    """
+
+    rng = np.random.RandomState(seed)
+    num_rows = num_shapes * points_per_shape
+
+    shapes = pd.DataFrame({
+        "shape_id": np.repeat(
+            ["shape_{}".format(i) for i in range(num_shapes)],
+            points_per_shape
+        ),
+        "shape_pt_lat": 47.3 + rng.random_sample(num_rows) / 10,
+        "shape_pt_lon": 8.5 + rng.random_sample(num_rows) / 10,
+        "shape_pt_sequence": np.tile(np.arange(points_per_shape), num_shapes)
+    })
+
+    return shapes.sample(frac=1, random_state=rng).reset_index(drop=True)
+
+
+def run_benchmark(num_shapes, points_per_shape, repeat):
+    """Compares the running time of the loop-based and the vectorized
+    implementation of `insert_empty_rows` and checks that their output agrees.
+
+    Args:
+        num_shapes: the number of distinct shape ids
+        points_per_shape: the number of points of each shape
+        repeat: the number of timed runs of each implementation
+
+    Returns:
+        None
+    """
+
+    shapes = generate_shapes(num_shapes, points_per_shape)
+
+    expected = insert_empty_rows_loop(shapes, 'shape_id').reset_index(drop=True)
+    result = insert_empty_rows(shapes, 'shape_id')
+    pd.testing.assert_frame_equal(result, expected)
+
+    loop_time = min(timeit.repeat(
+        lambda: insert_empty_rows_loop(shapes, 'shape_id'),
+        number=1, repeat=repeat
+    ))
+    vectorized_time = min(timeit.repeat(
+        lambda: insert_empty_rows(shapes, 'shape_id'),
+        number=1, repeat=repeat
+    ))
+
+    print(
+        f"{num_shapes} shapes x {points_per_shape} points: "
+        f"loop {loop_time:.3f}s, vectorized {vectorized_time:.3f}s, "
+        f"speedup {loop_time / vectorized_time:.1f}x"
+    )
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '-n', '--num-shapes',
+        help="The numbers of shapes to benchmark with",
+        nargs='+',
+        type=int,
+        default=[1000, 10000, 50000]
+    )
+    parser.add_argument(
+        '-p', '--points-per-shape',
+        help="The number of points of each shape",
+        type=int,
+        default=20
+    )
+    parser.add_argument(
+        '-r', '--repeat',
+        help="The number of timed runs of each implementation",
+        type=int,
+        default=3
+    )
+
+    args = parser.parse_args()
+
+    for num_shapes in args.num_shapes:
+        run_benchmark(num_shapes, args.points_per_shape, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+import os
+import json
+import time
+import argparse
+import functools
+import tempfile
+import multiprocessing
+from src.benchmarks.synthetic_gtfs import generate_feed
+from src.figures import plot_colored, plot_fire
+from src.models.estimate_model import estimate_ols
+from src.utils.data_io import read_data, write_data
+from src.utils.gtfs import GTFS_SCHEMAS, read_gtfs_file
+from src.utils.instrumentation import peak_rss_mb
+from src.utils import reshape_data
+
+STAGES = [
+    'calculate_service_days', 'collect_shape_data', 'calculate_trip_times', 'generate_plot_data',
+    'calculate_shape_length', 'plot_fire', 'plot_colored', 'estimate_ols', 'estimate_bootstrap'
+]
+MODEL_SPECS_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'model_specs'
+)
+# the benchmarked specifications are fixed, so that adding a specification
+# does not change the timings of a stage
+BENCHMARK_SPECS = {
+    'estimate_ols': ['model_1.yaml', 'model_2.yaml', 'model_3.yaml', 'model_4.yaml'],
+    'estimate_bootstrap': ['model_5.yaml'],
+}
+
+
+def run_benchmarks(scales, repeat=1, out=None, baseline=None, tolerance=1.5, **feed_options):
+    """Runs the pipeline stages on synthetic feeds of increasing size and
+    reports their running time, throughput and memory use.
+
+    Args:
+        scales: a list of the numbers of routes of the synthetic feeds
+        repeat: the number of timed runs of each stage, the fastest one is
+            reported
+        out: if given, the results are saved here as a JSON file
+        baseline: if given, a results file of an earlier run; stages that got
+            slower by more than `tolerance` are reported
+        tolerance: the allowed ratio of the running time to the baseline
+        feed_options: further arguments of `generate_feed`
+
+    Returns:
+        List[str]: descriptions of the stages that got slower than the baseline
+    """
+
+    results = []
+    for num_routes in scales:
+        with tempfile.TemporaryDirectory() as work_dir:
+            paths = prepare_inputs(work_dir, num_routes, **feed_options)
+            for stage in STAGES:
+                measurements = [run_isolated(stage, paths) for _ in range(repeat)]
+                result = {
+                    "num_routes": num_routes,
+                    "stage": stage,
+                    **min(measurements, key=lambda measurement: measurement["seconds"])
+                }
+                results.append(result)
+                print(
+                    f"{num_routes:>6} routes  {stage:<24} "
+                    f"{result['seconds']:8.3f}s (first run {result['first_run_seconds']:.3f}s)  "
+                    f"{result['rows_per_second']:>12,.0f} rows/s  "
+                    f"{format_memory(result['peak_rss_mb'], result['rss_before_mb'])}"
+                )
+
+    if out is not None:
+        with open(out, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if baseline is None:
+        return []
+
+    return compare_results(results, baseline, tolerance)
+
+
+def prepare_inputs(work_dir, num_routes, **feed_options):
+    """Generates a synthetic feed and the intermediate datasets the later
+    stages read, so that each stage can be timed on its own.
+
+    Args:
+        work_dir: the directory where the files are created
+        num_routes: the number of routes of the feed
+        feed_options: further arguments of `generate_feed`
+
+    Returns:
+        dict: the paths of the feed and the datasets
+    """
+
+    paths = {
+        "gtfs_dir": os.path.join(work_dir, 'gtfs'),
+        "shape_data": os.path.join(work_dir, 'shape_data.csv'),
+        "plot_data": os.path.join(work_dir, 'plot_data.csv'),
+        "regression_data": os.path.join(work_dir, 'regression_data.csv'),
+        "work_dir": work_dir,
+    }
+
+    generate_feed(paths["gtfs_dir"], num_routes, **feed_options)
+    shape_data = reshape_data.collect_shape_data(paths["gtfs_dir"])
+    write_data(shape_data, paths["shape_data"])
+    write_data(
+        reshape_data.generate_plot_data(paths["gtfs_dir"], shape_data),
+        paths["plot_data"]
+    )
+    distance_data = reshape_data.calculate_shape_length(paths["gtfs_dir"])
+    write_data(
+        reshape_data.combine_regression_data(shape_data, distance_data),
+        paths["regression_data"]
+    )
+
+    return paths
+
+
+def run_isolated(stage, paths):
+    """Runs a stage in a fresh process, so that its memory use is measured
+    without the data held by this process.
+
+    Args:
+        stage: the name of the stage, one of `STAGES`
+        paths: the paths created by `prepare_inputs`
+
+    Returns:
+        dict: the running time of the first run (including the compilation of
+        numba functions) and of a second run in seconds, the number of input
+        rows and the throughput, and the peak memory use before and after the
+        stage in MB (None if it cannot be measured)
+    """
+
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1) as pool:
+        return pool.apply(run_stage, (stage, paths))
+
+
+def run_stage(stage, paths):
+    """Runs a single stage on the prepared inputs. Called in a fresh process
+    by `run_isolated`, see there for the return value.
+    """
+
+    gtfs_dir = paths["gtfs_dir"]
+    out_dir = paths["work_dir"]
+
+    if stage == 'calculate_service_days':
+        rows = count_gtfs_rows(gtfs_dir, 'calendar_dates')
+        run = functools.partial(reshape_data.calculate_service_days, gtfs_dir)
+    elif stage == 'collect_shape_data':
+        rows = count_gtfs_rows(gtfs_dir, 'trips')
+        run = functools.partial(reshape_data.collect_shape_data, gtfs_dir)
+    elif stage == 'calculate_trip_times':
+        rows = count_gtfs_rows(gtfs_dir, 'stop_times')
+        run = functools.partial(reshape_data.calculate_trip_times, gtfs_dir)
+    elif stage == 'generate_plot_data':
+        rows = count_gtfs_rows(gtfs_dir, 'shapes')
+        shape_data = read_data(paths["shape_data"])
+        run = functools.partial(reshape_data.generate_plot_data, gtfs_dir, shape_data)
+    elif stage == 'calculate_shape_length':
+        rows = count_gtfs_rows(gtfs_dir, 'shapes')
+        run = functools.partial(reshape_data.calculate_shape_length, gtfs_dir)
+    elif stage in ['plot_fire', 'plot_colored']:
+        rows = len(read_data(paths["plot_data"]))
+        figure = plot_fire if stage == 'plot_fire' else plot_colored
+        out = os.path.join(out_dir, f"{stage}.png")
+        run = functools.partial(figure.create_plot, paths["plot_data"], out, 1600)
+    elif stage in BENCHMARK_SPECS:
+        rows = len(read_data(paths["regression_data"]))
+        specs = [os.path.join(MODEL_SPECS_DIR, spec) for spec in BENCHMARK_SPECS[stage]]
+        missing = [spec for spec in specs if not os.path.exists(spec)]
+        if missing:
+            raise ValueError(f"Model specifications not found: {', '.join(missing)}")
+        outs = [os.path.join(out_dir, f"model_{i}.json") for i in range(len(specs))]
+        run = functools.partial(estimate_ols, paths["regression_data"], specs, outs)
+    else:
+        raise ValueError(f"Unknown stage: {stage}")
+
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    run()
+    first_run_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    run()
+    seconds = time.perf_counter() - start
+
+    return {
+        "seconds": seconds,
+        "first_run_seconds": first_run_seconds,
+        "rows": rows,
+        "rows_per_second": rows / seconds,
+        "rss_before_mb": rss_before,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def count_gtfs_rows(gtfs_dir, name):
+    """Counts the rows of a GTFS file.
+
+    Args:
+        gtfs_dir: the directory where the GTFS file is extracted
+        name: the name of the GTFS file without extension (e.g. 'trips')
+
+    Returns:
+        int: the number of rows
+    """
+
+    return len(read_gtfs_file(gtfs_dir, name, columns=[list(GTFS_SCHEMAS[name])[0]]))
+
+
+def compare_results(results, baseline, tolerance):
+    """Finds the stages that got slower than in an earlier run.
+
+    Args:
+        results: the results of `run_benchmarks`
+        baseline: the path of a results file of an earlier run
+        tolerance: the allowed ratio of the running time to the baseline
+
+    Returns:
+        List[str]: descriptions of the stages that got slower
+    """
+
+    with open(baseline, 'r') as file:
+        baseline_seconds = {
+            (result["num_routes"], result["stage"]): result["seconds"]
+            for result in json.load(file)
+        }
+
+    regressions = []
+    for result in results:
+        key = (result["num_routes"], result["stage"])
+        if key in baseline_seconds and result["seconds"] > tolerance * baseline_seconds[key]:
+            regressions.append(
+                f"{result['stage']} with {result['num_routes']} routes: "
+                f"{result['seconds']:.3f}s, baseline {baseline_seconds[key]:.3f}s"
+            )
+
+    return regressions
+
+
+def format_memory(peak_memory, memory_before):
+    """Formats a memory measurement, which may be missing.
+
+    Args:
+        peak_memory: the peak memory use in MB, or None
+        memory_before: the peak memory use before the stage in MB, or None
+
+    Returns:
+        str: the formatted value
+    """
+
+    if peak_memory is None:
+        return "memory n/a"
+
+    return f"{peak_memory:8.1f} MB peak (+{peak_memory - memory_before:.1f} MB)"
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '-s', '--scales',
+        help="The numbers of routes of the synthetic feeds",
+        nargs='+',
+        type=int,
+        default=[50, 200, 800]
+    )
+    parser.add_argument(
+        '--shapes-per-route',
+        help="The number of shapes of each route",
+        type=int,
+        default=4
+    )
+    parser.add_argument(
+        '--points-per-shape',
+        help="The number of points of each shape",
+        type=int,
+        default=200
+    )
+    parser.add_argument(
+        '-r', '--repeat',
+        help="The number of timed runs of each stage",
+        type=int,
+        default=1
+    )
+    parser.add_argument(
+        '-o', '--out',
+        help="Save the results to this JSON file",
+        type=str
+    )
+    parser.add_argument(
+        '-b', '--baseline',
+        help="A results file of an earlier run to compare with",
+        type=str
+    )
+    parser.add_argument(
+        '-t', '--tolerance',
+        help="Report stages that are slower than the baseline by this factor",
+        type=float,
+        default=1.5
+    )
+
+    args = parser.parse_args()
+
+    regressions = run_benchmarks(
+        args.scales, args.repeat, args.out, args.baseline, args.tolerance,
+        shapes_per_route=args.shapes_per_route, points_per_shape=args.points_per_shape
+    )
+
+    if regressions:
+        print("Slower than the baseline:")
+        for regression in regressions:
+            print(f"  {regression}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
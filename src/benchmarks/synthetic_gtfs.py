@@ -0,0 +1,311 @@
+import os
+import argparse
+import zipfile
+import numpy as np
+import pandas as pd
+from src.utils.gtfs import WEEKDAYS
+
+ROUTE_TYPES = [0, 2, 3, 7]
+ROUTE_COLORS = [
+    'E3000F', '0069B4', '009640', 'F39200', '8E2479',
+    '00A1E0', 'A05A2C', '6F6F6E', 'FFD500', 'E6007E'
+]
+CENTER = (47.37, 8.54)  # shapes start around Zurich
+POINT_SPACING_M = 50
+FEED_START = np.datetime64('2020-01-01')
+FEED_DAYS = 366
+FIRST_DEPARTURE_S = 5 * 3600
+LAST_DEPARTURE_S = 24 * 3600 + 30 * 60  # GTFS times may exceed 24 hours
+
+
+def generate_feed(out, num_routes=50, shapes_per_route=4, points_per_shape=200,
+                  trips_per_shape=20, num_services=10, num_exceptions=100,
+                  stops_per_trip=20, seed=0):
+    """Generates a random GTFS feed with the files used by the pipeline. The
+    shapes are random walks, so they look like lines on a map, and every
+    shape belongs to a single route.
+
+    Args:
+        out: the directory of the feed, or the path of a zip archive if it
+            ends with '.zip'
+        num_routes: the number of routes
+        shapes_per_route: the number of shapes of each route
+        points_per_shape: the number of points of each shape
+        trips_per_shape: the number of trips travelling each shape
+        num_services: the number of services in calendar.txt
+        num_exceptions: the number of rows in calendar_dates.txt
+        stops_per_trip: the number of stops of each trip in stop_times.txt
+        seed: seed of the random number generator
+
+    Returns:
+        None
+    """
+
+    rng = np.random.RandomState(seed)
+    num_shapes = num_routes * shapes_per_route
+
+    feed = {
+        'routes': generate_routes(num_routes, rng),
+        'calendar': generate_calendar(num_services, rng),
+        'calendar_dates': generate_calendar_dates(num_services, num_exceptions, rng),
+        'trips': generate_trips(num_shapes, shapes_per_route, trips_per_shape, num_services, rng),
+        'shapes': generate_shapes(num_shapes, points_per_shape, rng),
+    }
+    feed['stop_times'] = generate_stop_times(feed['trips'], stops_per_trip, rng)
+
+    if out.endswith('.zip'):
+        with zipfile.ZipFile(out, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for name, data in feed.items():
+                archive.writestr(f"{name}.txt", data.to_csv(index=False))
+    else:
+        os.makedirs(out, exist_ok=True)
+        for name, data in feed.items():
+            data.to_csv(os.path.join(out, f"{name}.txt"), index=False)
+
+
+def generate_routes(num_routes, rng):
+    """Generates the contents of routes.txt.
+
+    Args:
+        num_routes: the number of routes
+        rng: a numpy.random.RandomState
+
+    Returns:
+        pandas.DataFrame: the routes
+    """
+
+    return pd.DataFrame({
+        'route_id': [f"route_{i}" for i in range(num_routes)],
+        'agency_id': 'synthetic',
+        'route_short_name': [str(i + 1) for i in range(num_routes)],
+        'route_type': rng.choice(ROUTE_TYPES, num_routes),
+        'route_color': rng.choice(ROUTE_COLORS, num_routes),
+    })
+
+
+def generate_calendar(num_services, rng):
+    """Generates the contents of calendar.txt. Each service runs on random
+    weekdays within a random part of the year.
+
+    Args:
+        num_services: the number of services
+        rng: a numpy.random.RandomState
+
+    Returns:
+        pandas.DataFrame: the services
+    """
+
+    start_days = rng.randint(0, FEED_DAYS // 2, num_services)
+    end_days = start_days + rng.randint(FEED_DAYS // 4, FEED_DAYS // 2, num_services)
+
+    return pd.DataFrame({
+        'service_id': [f"service_{i}" for i in range(num_services)],
+        **{weekday: rng.randint(0, 2, num_services) for weekday in WEEKDAYS},
+        'start_date': format_dates(FEED_START + start_days),
+        'end_date': format_dates(FEED_START + end_days),
+    })
+
+
+def generate_calendar_dates(num_services, num_exceptions, rng):
+    """Generates the contents of calendar_dates.txt, with random dates added
+    to or removed from the services.
+
+    Args:
+        num_services: the number of services
+        num_exceptions: the number of exceptions
+        rng: a numpy.random.RandomState
+
+    Returns:
+        pandas.DataFrame: the exceptions
+    """
+
+    return pd.DataFrame({
+        'service_id': [f"service_{i}" for i in rng.randint(0, num_services, num_exceptions)],
+        'date': format_dates(FEED_START + rng.randint(0, FEED_DAYS, num_exceptions)),
+        'exception_type': rng.randint(1, 3, num_exceptions),
+    }).drop_duplicates(subset=['service_id', 'date'])
+
+
+def generate_trips(num_shapes, shapes_per_route, trips_per_shape, num_services, rng):
+    """Generates the contents of trips.txt.
+
+    Args:
+        num_shapes: the number of shapes
+        shapes_per_route: the number of shapes of each route
+        trips_per_shape: the number of trips travelling each shape
+        num_services: the number of services
+        rng: a numpy.random.RandomState
+
+    Returns:
+        pandas.DataFrame: the trips
+    """
+
+    shapes = np.repeat(np.arange(num_shapes), trips_per_shape)
+
+    return pd.DataFrame({
+        'route_id': [f"route_{i}" for i in shapes // shapes_per_route],
+        'service_id': [f"service_{i}" for i in rng.randint(0, num_services, len(shapes))],
+        'trip_id': [f"trip_{i}" for i in range(len(shapes))],
+        'shape_id': [f"shape_{i}" for i in shapes],
+    })
+
+
+def generate_shapes(num_shapes, points_per_shape, rng):
+    """Generates the contents of shapes.txt. Each shape is a random walk with
+    a slowly changing direction, the points of each shape are in consecutive
+    rows.
+
+    Args:
+        num_shapes: the number of shapes
+        points_per_shape: the number of points of each shape
+        rng: a numpy.random.RandomState
+
+    Returns:
+        pandas.DataFrame: the shape points
+    """
+
+    step = POINT_SPACING_M / 111320
+    headings = rng.uniform(0, 2 * np.pi, (num_shapes, 1)) \
+        + np.cumsum(rng.normal(0, 0.1, (num_shapes, points_per_shape)), axis=1)
+    starts = np.array(CENTER) + rng.normal(0, 0.03, (num_shapes, 2))
+
+    lat = starts[:, [0]] + np.cumsum(step * np.sin(headings), axis=1)
+    lon = starts[:, [1]] + np.cumsum(step * np.cos(headings), axis=1) / np.cos(np.radians(CENTER[0]))
+
+    return pd.DataFrame({
+        'shape_id': np.repeat([f"shape_{i}" for i in range(num_shapes)], points_per_shape),
+        'shape_pt_lat': lat.ravel().round(6),
+        'shape_pt_lon': lon.ravel().round(6),
+        'shape_pt_sequence': np.tile(np.arange(1, points_per_shape + 1), num_shapes),
+    })
+
+
+def generate_stop_times(trips, stops_per_trip, rng):
+    """Generates the contents of stop_times.txt. Each trip departs at a random
+    time of the day and stops every one to three minutes.
+
+    Args:
+        trips: a pandas.DataFrame with the trips, see `generate_trips`
+        stops_per_trip: the number of stops of each trip
+        rng: a numpy.random.RandomState
+
+    Returns:
+        pandas.DataFrame: the stop times
+    """
+
+    num_trips = len(trips)
+    departures = rng.randint(FIRST_DEPARTURE_S, LAST_DEPARTURE_S, (num_trips, 1)) \
+        + np.cumsum(rng.randint(60, 180, (num_trips, stops_per_trip)), axis=1)
+    dwell_times = rng.randint(0, 30, (num_trips, stops_per_trip))
+    shape_ids = trips.shape_id.str.replace('shape_', 'stop_', regex=False).values
+
+    return pd.DataFrame({
+        'trip_id': np.repeat(trips.trip_id.values, stops_per_trip),
+        'arrival_time': format_times(departures.ravel() - dwell_times.ravel()),
+        'departure_time': format_times(departures.ravel()),
+        'stop_id': pd.Series(np.repeat(shape_ids, stops_per_trip)) + '_' \
+            + pd.Series(np.tile(np.arange(stops_per_trip), num_trips)).astype(str),
+        'stop_sequence': np.tile(np.arange(1, stops_per_trip + 1), num_trips),
+    })
+
+
+def format_times(seconds):
+    """Converts seconds after midnight to GTFS times (HH:MM:SS).
+
+    Args:
+        seconds: a numpy.ndarray of integers
+
+    Returns:
+        pandas.Series: the GTFS times
+    """
+
+    parts = [seconds // 3600, seconds // 60 % 60, seconds % 60]
+
+    return pd.Series(parts[0]).astype(str).str.zfill(2) \
+        + ':' + pd.Series(parts[1]).astype(str).str.zfill(2) \
+        + ':' + pd.Series(parts[2]).astype(str).str.zfill(2)
+
+
+def format_dates(dates):
+    """Converts numpy dates to GTFS dates (integers of the form YYYYMMDD).
+
+    Args:
+        dates: a numpy.ndarray of numpy.datetime64[D]
+
+    Returns:
+        numpy.ndarray: the GTFS dates
+    """
+
+    return pd.to_datetime(dates).strftime('%Y%m%d').astype(int).values
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '-o', '--out',
+        help="The directory of the feed, or the path of a zip archive",
+        type=str,
+        required=True
+    )
+    parser.add_argument(
+        '--num-routes',
+        help="The number of routes",
+        type=int,
+        default=50
+    )
+    parser.add_argument(
+        '--shapes-per-route',
+        help="The number of shapes of each route",
+        type=int,
+        default=4
+    )
+    parser.add_argument(
+        '--points-per-shape',
+        help="The number of points of each shape",
+        type=int,
+        default=200
+    )
+    parser.add_argument(
+        '--trips-per-shape',
+        help="The number of trips travelling each shape",
+        type=int,
+        default=20
+    )
+    parser.add_argument(
+        '--num-services',
+        help="The number of services in calendar.txt",
+        type=int,
+        default=10
+    )
+    parser.add_argument(
+        '--num-exceptions',
+        help="The number of rows in calendar_dates.txt",
+        type=int,
+        default=100
+    )
+    parser.add_argument(
+        '--stops-per-trip',
+        help="The number of stops of each trip in stop_times.txt",
+        type=int,
+        default=20
+    )
+    parser.add_argument(
+        '--seed',
+        help="Seed of the random number generator",
+        type=int,
+        default=0
+    )
+
+    args = parser.parse_args()
+
+    generate_feed(
+        args.out, args.num_routes, args.shapes_per_route, args.points_per_shape,
+        args.trips_per_shape, args.num_services, args.num_exceptions,
+        args.stops_per_trip, args.seed
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+import os
+import json
+import hashlib
+import threading
+import numpy as np
+import xarray as xr
+import datashader as ds
+from src.utils.data_io import read_data, file_checksum
+from src.utils.instrumentation import instrument
+
+CACHE_FORMAT_VERSION = 2
+CACHE_SIZE_MB = 512  # the least recently used aggregates are evicted above this size
+
+
+@instrument
+def aggregate_cached(data, width, aggregate, aggregation, cache_dir=None,
+                     x_range=None, y_range=None, plot_data=None, data_checksum=None):
+    """Aggregates plot data on a canvas covering the network. If `cache_dir` is
+    given, the aggregate is saved there, and later calls with the same data
+    file contents, width, ranges and aggregation load it instead of reading
+    and rasterizing the data again. The cache is kept below `CACHE_SIZE_MB`
+    by evicting the least recently used aggregates. Several threads or
+    processes may use the same cache; an aggregate evicted by another one
+    while it is loaded counts as a cache miss.
+
+    Args:
+        data: a data file containing data usable for line plots
+        width: the width of the canvas in pixels
+        aggregate: a function taking a datashader.Canvas and the plot data,
+            and returning an aggregate (e.g. `plot_fire.aggregate`)
+        aggregation: a string identifying what `aggregate` computes (e.g. the
+            aggregated column), used in the cache key
+        cache_dir: the directory of the cached aggregates, no caching if None
+        x_range: the range of longitudes, the extent of the data if None
+        y_range: the range of latitudes, the extent of the data if None
+        plot_data: the contents of `data`, if it has already been loaded
+        data_checksum: the checksum of `data` (see `file_checksum`), if it
+            has already been calculated
+
+    Returns:
+        xarray.DataArray: the aggregate
+    """
+
+    if cache_dir is not None:
+        if data_checksum is None:
+            data_checksum = file_checksum(data)
+        key = cache_key(data_checksum, width, aggregation, x_range, y_range)
+        cache_file = os.path.join(cache_dir, f"{key}.npz")
+        try:
+            # the modification time marks the last use, see `evict_aggregates`
+            os.utime(cache_file)
+            return load_aggregate(cache_file)
+        except FileNotFoundError:
+            pass
+
+    if plot_data is None:
+        plot_data = read_data(data)
+    cvs = data_canvas(plot_data, width, x_range, y_range)
+    agg = aggregate(cvs, plot_data)
+
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        save_aggregate(agg, cache_file)
+        evict_aggregates(cache_dir, CACHE_SIZE_MB)
+
+    return agg
+
+
+def data_canvas(plot_data, width, x_range=None, y_range=None):
+    """Creates a canvas of a given width. The height is chosen so that the
+    aspect ratio of the ranges is kept.
+
+    Args:
+        plot_data: a pandas.DataFrame usable for line plots
+        width: the width of the canvas in pixels
+        x_range: the range of longitudes, the extent of the data if None
+        y_range: the range of latitudes, the extent of the data if None
+
+    Returns:
+        datashader.Canvas: the canvas
+    """
+
+    if x_range is None:
+        x_range = (plot_data.shape_pt_lon.min(), plot_data.shape_pt_lon.max())
+    if y_range is None:
+        y_range = (plot_data.shape_pt_lat.min(), plot_data.shape_pt_lat.max())
+
+    height = int(round(width * (y_range[1] - y_range[0]) / (x_range[1] - x_range[0])))
+
+    return ds.Canvas(
+        plot_width=width,
+        plot_height=height,
+        x_range=x_range,
+        y_range=y_range
+    )
+
+
+def cache_key(data_checksum, width, aggregation, x_range, y_range):
+    """Creates the cache key of an aggregate.
+
+    Args:
+        data_checksum: the checksum of the plot data file
+        width: the width of the canvas in pixels
+        aggregation: a string identifying the aggregation
+        x_range: the range of longitudes, or None
+        y_range: the range of latitudes, or None
+
+    Returns:
+        str: the hex digest identifying the aggregate
+    """
+
+    key = json.dumps({
+        "format_version": CACHE_FORMAT_VERSION,
+        "data": data_checksum,
+        "width": width,
+        "aggregation": aggregation,
+        "x_range": None if x_range is None else [float(x) for x in x_range],
+        "y_range": None if y_range is None else [float(y) for y in y_range],
+    }, sort_keys=True)
+
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def save_aggregate(agg, path):
+    """Saves an aggregate with its coordinates and attributes as a compressed
+    numpy archive. The values are stored as float32 if that is lossless (e.g.
+    for sums of trips). The file is written under a temporary name of its own
+    first, so that an interrupted run does not leave a broken cache entry
+    behind, and concurrent writers do not mix their files.
+
+    Args:
+        agg: an xarray.DataArray
+        path: the path of the file to be created
+
+    Returns:
+        None
+    """
+
+    coords = {}
+    for dim in agg.dims:
+        values = np.asarray(agg.coords[dim].values)
+        # labels (e.g. route colors) would have to be pickled otherwise
+        if values.dtype.kind not in 'biufU':
+            values = np.array([str(value) for value in values])
+        coords[f"coord_{dim}"] = values
+    attrs = {
+        name: list(value) if isinstance(value, tuple) else value
+        for name, value in agg.attrs.items()
+    }
+
+    values = agg.values
+    if values.dtype == np.float64:
+        values_32 = values.astype(np.float32)
+        if ((values_32 == values) | np.isnan(values)).all():
+            values = values_32
+
+    partial_file = f"{path}.{os.getpid()}-{threading.get_ident()}.part"
+    with open(partial_file, 'wb') as file:
+        np.savez_compressed(
+            file,
+            values=values,
+            dtype=np.array(agg.values.dtype.str),
+            dims=np.array(agg.dims),
+            attrs=np.array(json.dumps(attrs, default=float)),
+            **coords
+        )
+    os.replace(partial_file, path)
+
+
+def evict_aggregates(cache_dir, max_size):
+    """Removes the least recently used aggregates until the cache is smaller
+    than `max_size`. Aggregates removed meanwhile by another thread or process
+    are skipped.
+
+    Args:
+        cache_dir: the directory of the cached aggregates
+        max_size: the maximum size of the cache in MB
+
+    Returns:
+        None
+    """
+
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.is_file() and entry.name.endswith('.npz'):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    entries.sort()
+    total_size = sum(size for _, size, _ in entries)
+
+    for _, size, path in entries:
+        if total_size <= max_size * 2 ** 20:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_size -= size
+
+
+def load_aggregate(path):
+    """Loads an aggregate saved by `save_aggregate`.
+
+    Args:
+        path: the path of the cached aggregate
+
+    Returns:
+        xarray.DataArray: the aggregate
+    """
+
+    with np.load(path) as cached:
+        dims = [str(dim) for dim in cached['dims']]
+        attrs = {
+            name: tuple(value) if isinstance(value, list) else value
+            for name, value in json.loads(str(cached['attrs'])).items()
+        }
+        return xr.DataArray(
+            cached['values'].astype(str(cached['dtype'])),
+            coords=[(dim, cached[f"coord_{dim}"]) for dim in dims],
+            attrs=attrs
+        )
@@ -0,0 +1,304 @@
+import os
+import argparse
+import concurrent.futures
+import numpy as np
+import datashader as ds
+from src.figures import plot_colored, plot_fire
+from src.utils.data_io import read_data
+from src.utils.instrumentation import instrument
+
+EARTH_RADIUS_M = 6378137
+TILE_SIZE = 256
+MAX_LATITUDE = 85.0511287798
+TILE_SHADING = 'log'
+MAX_SPAN_CANVAS = 4096  # the largest side of the canvas used to find the span of a zoom level
+STYLES = {'fire': plot_fire, 'colored': plot_colored}
+
+worker_data = None
+
+
+@instrument
+def export_tiles(data, out_dir, min_zoom, max_zoom, style='fire', workers=1):
+    """Renders the network as a Web Mercator XYZ tile pyramid. The tiles are
+    saved as `out_dir/{z}/{x}/{y}.png`, tiles without any lines are skipped.
+    All tiles of a zoom level are shaded with the same span (see
+    `zoom_span`), so that colors match across tile borders.
+
+    Args:
+        data: a data file containing data usable for line plots
+        out_dir: the directory of the tile pyramid
+        min_zoom: the lowest zoom level to render
+        max_zoom: the highest zoom level to render
+        style: 'fire' or 'colored', the style of the corresponding figure
+        workers: the number of processes rendering tiles in parallel
+
+    Returns:
+        int: the number of tiles written
+    """
+
+    plot_data = load_tile_data(data)
+    x_range = (plot_data.x_merc.min(), plot_data.x_merc.max())
+    y_range = (plot_data.y_merc.min(), plot_data.y_merc.max())
+
+    tiles = []
+    for zoom in range(min_zoom, max_zoom + 1):
+        span = zoom_span(plot_data, zoom, style, x_range, y_range)
+        tiles.extend(
+            (zoom, tile_x, tile_y, style, out_dir, span)
+            for tile_x, tile_y in covering_tiles(zoom, x_range, y_range)
+        )
+
+    if workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers, initializer=init_worker, initargs=(data,)) as executor:
+            written = list(executor.map(render_tile, *zip(*tiles), chunksize=16))
+    else:
+        global worker_data
+        worker_data = plot_data
+        written = [render_tile(*tile) for tile in tiles]
+
+    num_written = sum(written)
+    print(f"Wrote {num_written} of {len(tiles)} tiles to {out_dir}")
+
+    return num_written
+
+
+def load_tile_data(data):
+    """Reads the plot data and adds Web Mercator coordinates (in meters), as
+    well as the bounding box of the shape each row belongs to.
+
+    Args:
+        data: a data file containing data usable for line plots
+
+    Returns:
+        pandas.DataFrame: the plot data with x_merc, y_merc and shape bounding
+        box columns
+    """
+
+    plot_data = read_data(data)
+    lat = np.radians(np.clip(plot_data.shape_pt_lat.values, -MAX_LATITUDE, MAX_LATITUDE))
+    lon = np.radians(plot_data.shape_pt_lon.values)
+
+    plot_data = plot_data.assign(
+        x_merc=EARTH_RADIUS_M * lon,
+        y_merc=EARTH_RADIUS_M * np.log(np.tan(np.pi / 4 + lat / 2))
+    )
+    shapes = plot_data.groupby('shape_id', observed=True)
+
+    return plot_data.assign(
+        x_min=shapes.x_merc.transform('min'),
+        x_max=shapes.x_merc.transform('max'),
+        y_min=shapes.y_merc.transform('min'),
+        y_max=shapes.y_merc.transform('max')
+    )
+
+
+@instrument
+def zoom_span(plot_data, zoom, style, x_range, y_range):
+    """Finds the range of the aggregated values of a zoom level, by
+    aggregating the whole network at the resolution of the zoom level. Above
+    `MAX_SPAN_CANVAS` pixels, a coarser resolution is used, where lines
+    overlap more, so the span is slightly wider than that of the tiles.
+
+    Args:
+        plot_data: the data created by `load_tile_data`
+        zoom: the zoom level
+        style: 'fire' or 'colored'
+        x_range: the range of Web Mercator x coordinates of the network
+        y_range: the range of Web Mercator y coordinates of the network
+
+    Returns:
+        Tuple[float, float]: the smallest and largest positive value, or None
+        if nothing is drawn
+    """
+
+    tile_extent = 2 * np.pi * EARTH_RADIUS_M / 2 ** zoom
+    width, height = (
+        int(np.clip(np.ceil((extent[1] - extent[0]) / tile_extent * TILE_SIZE), 1, MAX_SPAN_CANVAS))
+        for extent in [x_range, y_range]
+    )
+    cvs = ds.Canvas(plot_width=width, plot_height=height, x_range=x_range, y_range=y_range)
+
+    values = STYLES[style].aggregate(cvs, plot_data, x='x_merc', y='y_merc').values
+    values = values[np.isfinite(values) & (values > 0)]
+    if values.size == 0:
+        return None
+
+    return float(values.min()), float(values.max())
+
+
+def covering_tiles(zoom, x_range, y_range):
+    """Lists the tiles of a zoom level that intersect a bounding box.
+
+    Args:
+        zoom: the zoom level
+        x_range: the range of Web Mercator x coordinates
+        y_range: the range of Web Mercator y coordinates
+
+    Returns:
+        List[Tuple[int, int]]: the x and y indices of the tiles
+    """
+
+    num_tiles = 2 ** zoom
+    tile_x_range = tile_indices(x_range, zoom)
+    # tile rows are counted from the north
+    tile_y_range = tile_indices((-y_range[1], -y_range[0]), zoom)
+
+    return [
+        (tile_x, tile_y)
+        for tile_x in range(max(tile_x_range[0], 0), min(tile_x_range[1], num_tiles - 1) + 1)
+        for tile_y in range(max(tile_y_range[0], 0), min(tile_y_range[1], num_tiles - 1) + 1)
+    ]
+
+
+def tile_indices(coordinate_range, zoom):
+    """Converts a range of Web Mercator coordinates to a range of tile indices.
+
+    Args:
+        coordinate_range: the minimum and maximum coordinate
+        zoom: the zoom level
+
+    Returns:
+        Tuple[int, int]: the first and last tile index
+    """
+
+    tile_extent = 2 * np.pi * EARTH_RADIUS_M / 2 ** zoom
+    origin = np.pi * EARTH_RADIUS_M
+
+    return tuple(
+        int(np.floor((coordinate + origin) / tile_extent))
+        for coordinate in coordinate_range
+    )
+
+
+def tile_bounds(zoom, tile_x, tile_y):
+    """Calculates the Web Mercator extent of a tile.
+
+    Args:
+        zoom: the zoom level
+        tile_x: the column of the tile (counted from the west)
+        tile_y: the row of the tile (counted from the north)
+
+    Returns:
+        Tuple[Tuple[float, float], Tuple[float, float]]: the x and y range
+    """
+
+    tile_extent = 2 * np.pi * EARTH_RADIUS_M / 2 ** zoom
+    origin = np.pi * EARTH_RADIUS_M
+
+    x_min = tile_x * tile_extent - origin
+    y_max = origin - tile_y * tile_extent
+
+    return (x_min, x_min + tile_extent), (y_max - tile_extent, y_max)
+
+
+def init_worker(data):
+    """Loads the plot data once in each worker process.
+
+    Args:
+        data: a data file containing data usable for line plots
+
+    Returns:
+        None
+    """
+
+    global worker_data
+    worker_data = load_tile_data(data)
+
+
+@instrument
+def render_tile(zoom, tile_x, tile_y, style, out_dir, span=None):
+    """Renders a single tile from the data loaded in the current process and
+    saves it, unless the tile is empty.
+
+    Args:
+        zoom: the zoom level
+        tile_x: the column of the tile
+        tile_y: the row of the tile
+        style: 'fire' or 'colored'
+        out_dir: the directory of the tile pyramid
+        span: the span of the zoom level, see `zoom_span`
+
+    Returns:
+        bool: whether the tile was written
+    """
+
+    x_range, y_range = tile_bounds(zoom, tile_x, tile_y)
+    tile_data = worker_data[
+        (worker_data.x_max >= x_range[0]) & (worker_data.x_min <= x_range[1])
+        & (worker_data.y_max >= y_range[0]) & (worker_data.y_min <= y_range[1])
+    ]
+    if tile_data.empty:
+        return False
+
+    cvs = ds.Canvas(
+        plot_width=TILE_SIZE,
+        plot_height=TILE_SIZE,
+        x_range=x_range,
+        y_range=y_range
+    )
+
+    figure = STYLES[style]
+    agg = figure.aggregate(cvs, tile_data, x='x_merc', y='y_merc')
+    if agg.isnull().all():
+        return False
+
+    image = figure.shade(agg, how=TILE_SHADING, span=span)
+
+    tile_dir = os.path.join(out_dir, str(zoom), str(tile_x))
+    os.makedirs(tile_dir, exist_ok=True)
+    image.to_pil().save(os.path.join(tile_dir, f"{tile_y}.png"))
+
+    return True
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '-d', '--data',
+        help="A line-plot-compatible data file",
+        type=str,
+        required=True
+    )
+    parser.add_argument(
+        '-o', '--out-dir',
+        help="The directory of the tile pyramid",
+        type=str,
+        required=True
+    )
+    parser.add_argument(
+        '--min-zoom',
+        help="The lowest zoom level to render",
+        type=int,
+        default=10
+    )
+    parser.add_argument(
+        '--max-zoom',
+        help="The highest zoom level to render",
+        type=int,
+        default=14
+    )
+    parser.add_argument(
+        '-s', '--style',
+        help="The style of the tiles",
+        choices=list(STYLES),
+        default='fire'
+    )
+    parser.add_argument(
+        '-w', '--workers',
+        help="The number of processes rendering tiles in parallel",
+        type=int,
+        default=1
+    )
+
+    args = parser.parse_args()
+
+    export_tiles(
+        args.data, args.out_dir, args.min_zoom, args.max_zoom, args.style, args.workers
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,49 +1,114 @@
 import argparse
 import pandas as pd
+import xarray as xr
 import datashader as ds
 import datashader.transfer_functions as tf
 from datashader.utils import export_image
+from src.figures.aggregation_cache import aggregate_cached
+from src.figures.plot_fire import SHADING_METHODS
+from src.utils.instrumentation import instrument
 
 
-def create_plot(data, out, width):
+RENDER_MODES = ['categorical', 'layered']
+
+
+def create_plot(data, out, width, mode='categorical', how='eq_hist', cache_dir=None,
+                plot_data=None, data_checksum=None):
     """Creates a figure of the ZVV transit network using ZVV's color scheme.
 
     Args:
-        data: a csv file containing data usable for line plots
+        data: a data file containing data usable for line plots
         out: the generated imnage is saved here
+        width: the width of the image in pixels
+        mode: 'categorical' aggregates all colors in a single pass over the
+            data, 'layered' aggregates each color separately
+        how: the datashader shading method (e.g. 'eq_hist', 'log')
+        cache_dir: if given, the aggregated trips are cached here, so that
+            the figure can be shaded differently without aggregating again
+        plot_data: the contents of `data`, if it has already been loaded
+        data_checksum: the checksum of `data`, if it has already been
+            calculated (see `aggregate_cached`)
 
     Returns:
         None
     """
 
-    plot_data = pd.read_csv(data, low_memory=False)
+    agg = aggregate_cached(
+        data, width,
+        lambda cvs, plot_data: aggregate(cvs, plot_data, mode),
+        f'by(route_color, sum(times_taken)), {mode}',
+        cache_dir,
+        plot_data=plot_data,
+        data_checksum=data_checksum
+    )
+    image = shade(agg, how)
 
-    x_range = (plot_data.shape_pt_lon.min(), plot_data.shape_pt_lon.max())
-    y_range = (plot_data.shape_pt_lat.min(), plot_data.shape_pt_lat.max())
+    if out.endswith('.png'):
+        out = out[:-4]
+    export_image(image, filename=out, background='black')
 
-    height = int(round(width * (y_range[1] - y_range[0]) / (x_range[1] - x_range[0])))
 
-    cvs = ds.Canvas(
-        plot_width=width,
-        plot_height=height,
-        x_range=x_range,
-        y_range=y_range
-    )
+@instrument
+def aggregate(cvs, plot_data, mode='categorical', x='shape_pt_lon', y='shape_pt_lat'):
+    """Sums the trips along the lines of the network separately for each route
+    color.
 
-    layers = []
-    for color, data_part in plot_data.groupby('route_color'):
-        agg = cvs.line(
-            data_part, 'shape_pt_lon', 'shape_pt_lat',
-            agg=ds.sum('times_taken')
+    Args:
+        cvs: a datashader.Canvas
+        plot_data: a pandas.DataFrame usable for line plots, with a categorical
+            route_color column
+        mode: 'categorical' aggregates all colors in a single pass over the
+            data, 'layered' aggregates each color separately
+        x: the column containing the x coordinates
+        y: the column containing the y coordinates
+
+    Returns:
+        xarray.DataArray: the aggregated trips per pixel and route color
+    """
+
+    # see `plot_fire.aggregate`
+    plot_data = plot_data[[x, y, 'times_taken', 'route_color']]
+
+    if mode == 'categorical':
+        return cvs.line(
+            plot_data, x, y,
+            agg=ds.by('route_color', ds.sum('times_taken'))
         )
-        image_part = tf.shade(agg, cmap=['#000000', '#' + color], how='eq_hist')
-        layers.append(image_part)
+    elif mode == 'layered':
+        colors = []
+        layers = []
+        for color, data_part in plot_data.groupby('route_color', observed=True):
+            colors.append(color)
+            layers.append(cvs.line(data_part, x, y, agg=ds.sum('times_taken')))
+        return xr.concat(layers, dim=pd.Index(colors, name='route_color'))
+    else:
+        raise ValueError(f"Unknown render mode: {mode}")
+
+
+@instrument
+def shade(agg, how='eq_hist', span=None):
+    """Shades the aggregated trips of each route color with its own color and
+    adds up the resulting images.
 
-    image = tf.stack(*layers, how='add')
+    Args:
+        agg: an xarray.DataArray created by `aggregate`
+        how: the datashader shading method
+        span: if given, the minimum and maximum value mapped to the ends of
+            the colormap, so that several images are shaded alike
 
-    if out.endswith('.png'):
-        out = out[:-4]
-    export_image(image, filename=out, background='black')
+    Returns:
+        datashader.transfer_functions.Image: the shaded image
+    """
+
+    layers = []
+    for color in sorted(agg.coords['route_color'].values):
+        agg_part = agg.sel(route_color=color)
+        if agg_part.isnull().all():
+            continue
+        image_part = tf.shade(agg_part, cmap=['#000000', '#' + color], how=how, span=span)
+        layers.append(image_part)
+
+    return tf.stack(*layers, how='add')
 
 
 def main():
@@ -68,10 +133,27 @@ def main():
         type=int,
         default=1600
     )
+    parser.add_argument(
+        '-m', '--mode',
+        help="Aggregate all route colors at once, or each color separately",
+        choices=RENDER_MODES,
+        default='categorical'
+    )
+    parser.add_argument(
+        '--how',
+        help="The shading method",
+        choices=SHADING_METHODS,
+        default='eq_hist'
+    )
+    parser.add_argument(
+        '-c', '--cache-dir',
+        help="A directory where aggregated trips are cached",
+        type=str
+    )
 
     args = parser.parse_args()
 
-    create_plot(args.data, args.out, args.width)
+    create_plot(args.data, args.out, args.width, args.mode, args.how, args.cache_dir)
 
 
 if __name__ == "__main__":
@@ -1,46 +1,80 @@
 import argparse
-import pandas as pd
 import colorcet as cc
 import datashader as ds
 import datashader.transfer_functions as tf
 from datashader.utils import export_image
+from src.figures.aggregation_cache import aggregate_cached
+from src.utils.instrumentation import instrument
 
+SHADING_METHODS = ['eq_hist', 'cbrt', 'log', 'linear']
 
-def create_plot(data, out, width):
+
+def create_plot(data, out, width, how='eq_hist', cache_dir=None, plot_data=None,
+                data_checksum=None):
     """Creates a figure of the ZVV transit network without any grouping.
 
     Args:
-        data: a csv file containing data usable for line plots
+        data: a data file containing data usable for line plots
         out: the generated imnage is saved here
+        width: the width of the image in pixels
+        how: the datashader shading method (e.g. 'eq_hist', 'log')
+        cache_dir: if given, the aggregated trips are cached here, so that
+            the figure can be shaded differently without aggregating again
+        plot_data: the contents of `data`, if it has already been loaded
+        data_checksum: the checksum of `data`, if it has already been
+            calculated (see `aggregate_cached`)
 
     Returns:
         None
     """
 
-    plot_data = pd.read_csv(data, low_memory=False)
-
-    x_range = (plot_data.shape_pt_lon.min(), plot_data.shape_pt_lon.max())
-    y_range = (plot_data.shape_pt_lat.min(), plot_data.shape_pt_lat.max())
-
-    height = int(round(width * (y_range[1] - y_range[0]) / (x_range[1] - x_range[0])))
-
-    cvs = ds.Canvas(
-        plot_width=width,
-        plot_height=height,
-        x_range=x_range,
-        y_range=y_range
+    agg = aggregate_cached(
+        data, width, aggregate, 'sum(times_taken)', cache_dir,
+        plot_data=plot_data, data_checksum=data_checksum
     )
-    agg = cvs.line(
-        plot_data, 'shape_pt_lon', 'shape_pt_lat',
-        agg=ds.sum('times_taken')
-    )
-    image = tf.shade(agg, cmap=cc.fire, how='eq_hist')
+    image = shade(agg, how)
 
     if out.endswith('.png'):
         out = out[:-4]
     export_image(image, filename=out, background='black')
 
 
+@instrument
+def aggregate(cvs, plot_data, x='shape_pt_lon', y='shape_pt_lat'):
+    """Sums the trips along the lines of the network.
+
+    Args:
+        cvs: a datashader.Canvas
+        plot_data: a pandas.DataFrame usable for line plots
+        x: the column containing the x coordinates
+        y: the column containing the y coordinates
+
+    Returns:
+        xarray.DataArray: the aggregated trips per pixel
+    """
+
+    # only passing the used columns keeps datashader from compiling its
+    # aggregation again for every set of additional columns
+    return cvs.line(plot_data[[x, y, 'times_taken']], x, y, agg=ds.sum('times_taken'))
+
+
+@instrument
+def shade(agg, how='eq_hist', span=None):
+    """Shades the aggregated trips using the fire colormap.
+
+    Args:
+        agg: an xarray.DataArray created by `aggregate`
+        how: the datashader shading method
+        span: if given, the minimum and maximum value mapped to the ends of
+            the colormap, so that several images are shaded alike
+
+    Returns:
+        datashader.transfer_functions.Image: the shaded image
+    """
+
+    return tf.shade(agg, cmap=cc.fire, how=how, span=span)
+
+
 def main():
 
     parser = argparse.ArgumentParser()
@@ -63,10 +97,21 @@ def main():
         type=int,
         default=1600
     )
+    parser.add_argument(
+        '--how',
+        help="The shading method",
+        choices=SHADING_METHODS,
+        default='eq_hist'
+    )
+    parser.add_argument(
+        '-c', '--cache-dir',
+        help="A directory where aggregated trips are cached",
+        type=str
+    )
 
     args = parser.parse_args()
 
-    create_plot(args.data, args.out, args.width)
+    create_plot(args.data, args.out, args.width, args.how, args.cache_dir)
 
 
 if __name__ == "__main__":
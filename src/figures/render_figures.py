@@ -0,0 +1,112 @@
+import argparse
+import concurrent.futures
+from src.figures import plot_colored, plot_fire
+from src.utils.data_io import read_data, file_checksum
+from src.utils.instrumentation import instrument
+
+FIGURES = {'plot_fire': plot_fire, 'plot_colored': plot_colored}
+
+
+@instrument
+def render_figures(data, figures, outs, widths, workers=1, cache_dir=None):
+    """Creates several figures from the same plot data. The data is loaded
+    once and shared by all figures.
+
+    Args:
+        data: a data file containing data usable for line plots
+        figures: a list of figure names (keys of `FIGURES`)
+        outs: a list of paths, the figures are saved here (in the same order
+            as `figures`)
+        widths: the width of the images in pixels, either a single width for
+            all figures or one width for each figure
+        workers: the number of threads rendering figures in parallel
+        cache_dir: if given, the aggregated trips are cached here
+
+    Returns:
+        None
+    """
+
+    if len(figures) != len(outs):
+        raise ValueError("The number of figures and output files must match")
+    if len(widths) == 1:
+        widths = widths * len(figures)
+    if len(widths) != len(figures):
+        raise ValueError("Either give a single width, or one width for each figure")
+
+    plot_data = read_data(data)
+    # the cache key of every figure includes the checksum of the data
+    data_checksum = None if cache_dir is None else file_checksum(data)
+
+    # the datashader aggregations release the GIL, so threads suffice and
+    # the figures can share the loaded data
+    jobs = [
+        (FIGURES[figure].create_plot, out, width)
+        for figure, out, width in zip(figures, outs, widths)
+    ]
+
+    def render(create_plot, out, width):
+        create_plot(
+            data, out, width, cache_dir=cache_dir, plot_data=plot_data,
+            data_checksum=data_checksum
+        )
+
+    if workers > 1:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(render, *zip(*jobs)))
+    else:
+        for job in jobs:
+            render(*job)
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '-d', '--data',
+        help="A line-plot-compatible data file",
+        type=str,
+        required=True
+    )
+    parser.add_argument(
+        '-f', '--figures',
+        help="The figures to create",
+        nargs='+',
+        choices=list(FIGURES),
+        required=True
+    )
+    parser.add_argument(
+        '-o', '--out',
+        help="The paths of the output files, one for each figure",
+        nargs='+',
+        type=str,
+        required=True
+    )
+    parser.add_argument(
+        '-w', '--width',
+        help="The width of the images in pixels, one for all or one for each figure",
+        nargs='+',
+        type=int,
+        default=[1600]
+    )
+    parser.add_argument(
+        '-j', '--workers',
+        help="The number of threads rendering figures in parallel",
+        type=int,
+        default=1
+    )
+    parser.add_argument(
+        '-c', '--cache-dir',
+        help="A directory where aggregated trips are cached",
+        type=str
+    )
+
+    args = parser.parse_args()
+
+    render_figures(
+        args.data, args.figures, args.out, args.width, args.workers, args.cache_dir
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+
+BOOTSTRAP_METHODS = ['pairs', 'cluster']
+BATCH_SIZE = 250  # replications solved together (and sent to a process) at once
+SINGULAR_TOLERANCE = 1e-12  # smallest eigenvalue of the scaled normal equations
+MAX_UNIDENTIFIED_SHARE = 0.01  # share of resamples that may be dropped
+
+
+def bootstrap_params(endog, exog, groups=None, replications=1000, seed=0,
+                     batch_size=BATCH_SIZE, map_batches=map):
+    """Estimates the parameters of a linear model on bootstrap resamples of
+    the data. If `groups` is given, whole groups of rows are resampled
+    (cluster bootstrap), otherwise single rows (pairs bootstrap).
+
+    A resample is described by how often each group is drawn, so the normal
+    equations of a resample are a weighted sum of the cross products of the
+    groups. These are calculated once, and the normal equations of a batch of
+    resamples are then built with a single matrix product and solved
+    together. The columns are scaled to unit length first, which keeps the
+    normal equations well conditioned.
+
+    Each batch draws from its own random stream derived from `seed`, so the
+    results do not depend on how the batches are distributed.
+
+    Args:
+        endog: a numpy.ndarray containing the dependent variable
+        exog: a 2D numpy.ndarray containing the design matrix
+        groups: the group of each row for the cluster bootstrap, or None
+        replications: the number of bootstrap resamples
+        seed: the seed of the random number generator
+        batch_size: the number of resamples solved at once
+        map_batches: a function like `map` used to solve the batches, e.g.
+            the `map` method of an executor
+
+    Returns:
+        numpy.ndarray: the parameters of each resample (one row each); rows
+        of resamples where the model is not identified (e.g. a category is
+        never drawn) are NaN
+    """
+
+    endog = np.asarray(endog, dtype=np.float64)
+    exog = np.asarray(exog, dtype=np.float64)
+    num_params = exog.shape[1]
+
+    scale = np.sqrt(np.square(exog).sum(axis=0))
+    scale[scale == 0] = 1
+    exog = exog / scale
+
+    products = (exog[:, :, None] * exog[:, None, :]).reshape(len(exog), -1)
+    moments = exog * endog[:, None]
+    if groups is not None:
+        codes, _ = pd.factorize(np.asarray(groups), sort=True)
+        order = np.argsort(codes, kind='mergesort')
+        group_starts = np.flatnonzero(np.append(True, np.diff(codes[order]) != 0))
+        products = np.add.reduceat(products[order], group_starts)
+        moments = np.add.reduceat(moments[order], group_starts)
+
+    batch_sizes = [
+        min(batch_size, replications - start) for start in range(0, replications, batch_size)
+    ]
+    seeds = np.random.SeedSequence(seed).spawn(len(batch_sizes))
+    batches = map_batches(
+        solve_batch,
+        [products] * len(batch_sizes), [moments] * len(batch_sizes), seeds, batch_sizes
+    )
+
+    params = np.concatenate(list(batches)).reshape(-1, num_params)
+
+    return params / scale
+
+
+def solve_batch(products, moments, seed, size):
+    """Draws a batch of bootstrap resamples and solves their normal equations.
+
+    Args:
+        products: the flattened cross products of the design matrix of each
+            group (one row each)
+        moments: the cross products of the design matrix and the dependent
+            variable of each group
+        seed: a numpy.random.SeedSequence for the draws of this batch
+        size: the number of resamples
+
+    Returns:
+        numpy.ndarray: the parameters of each resample, NaN where the model
+        is not identified
+    """
+
+    num_groups, num_params = moments.shape
+    rng = np.random.default_rng(seed)
+    # how often each group is drawn, counted for all resamples at once
+    draws = rng.integers(0, num_groups, size=(size, num_groups))
+    draws += np.arange(size)[:, None] * num_groups
+    counts = np.bincount(draws.ravel(), minlength=size * num_groups) \
+        .reshape(size, num_groups).astype(np.float64)
+
+    gram = (counts @ products).reshape(size, num_params, num_params)
+    cross = counts @ moments
+
+    # the model is not identified in a resample if its normal equations are
+    # (numerically) singular, e.g. if a dummy column is zero; this is checked
+    # on the normal equations scaled to a unit diagonal
+    diagonal = np.diagonal(gram, axis1=1, axis2=2)
+    singular = (diagonal <= 0).any(axis=1)
+    diagonal = np.sqrt(np.where(singular[:, None], 1, diagonal))
+    scaled = gram / (diagonal[:, :, None] * diagonal[:, None, :])
+    singular |= np.linalg.eigvalsh(scaled)[:, 0] < SINGULAR_TOLERANCE
+
+    gram[singular] = np.eye(num_params)
+    params = np.linalg.solve(gram, cross[:, :, None])[:, :, 0]
+    params[singular] = np.nan
+
+    return params
@@ -1,40 +1,312 @@
 import argparse
-import pandas as pd
-import statsmodels.formula.api as smf
-import pickle
+import warnings
+import contextlib
+import concurrent.futures
+import patsy
+import statsmodels.api as sm
 import yaml
-import numpy as np  # noqa: F401
+import numpy as np
+import pandas as pd
+from src.utils.data_io import read_data
+from src.models.bootstrap import BOOTSTRAP_METHODS, MAX_UNIDENTIFIED_SHARE, bootstrap_params
+from src.models.results import replace_covariance, summarize_results, write_results
+from src.utils.instrumentation import instrument
 
 
-def estimate_ols(data, specs, out):
-    """Estimates a linear model.
+@instrument
+def estimate_ols(data, specs, outs, workers=1):
+    """Estimates linear models. The data is loaded once, and the numerical
+    terms of all models are evaluated once, see `model_design`. Models with a
+    `bootstrap` specification get bootstrap standard errors, see
+    `bootstrap_ols`.
 
     Args:
-        data: a csv file containing the data used for the estimation
-        specs: A YAML file containing model specifications
-        out: the pickledmodel object is saved here
+        data: a data file containing the data used for the estimation
+        specs: a list of YAML files containing model specifications
+        outs: a list of paths, the summaries of the results are saved here as
+            JSON files (in the same order as `specs`)
+        workers: the number of processes fitting the models (and the batches
+            of bootstrap replications) in parallel
 
     Returns:
         None
     """
 
-    dataset = pd.read_csv(data, low_memory=False)
+    if len(specs) != len(outs):
+        raise ValueError("The number of model specifications and output files must match")
+
+    dataset = read_data(data)
+    specs_dicts = [load_specs(spec) for spec in specs]
+    endog, exog = build_design_matrices(dataset, specs_dicts)
+
+    jobs = [
+        (endog[specs_dict["dep_var_name"]], model_design(exog, dataset, specs_dict), specs_dict)
+        for specs_dict in specs_dicts
+    ]
+
+    if workers > 1:
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+    else:
+        pool = contextlib.nullcontext()
+
+    with pool as executor:
+        map_jobs = map if executor is None else executor.map
+        model_results = list(map_jobs(fit_ols, *zip(*jobs)))
+        for i, (endog_model, exog_model, specs_dict) in enumerate(jobs):
+            if "bootstrap" in specs_dict:
+                model_results[i] = bootstrap_ols(
+                    model_results[i], endog_model, exog_model, dataset,
+                    specs_dict["bootstrap"], map_jobs
+                )
+
+    for model_result, out in zip(model_results, outs):
+        write_results(model_result, out)
+
+
+@instrument
+def fit_ols(endog, exog, specs_dict):
+    """Fits a linear model on the columns of the design matrix it uses. Rows
+    with missing values in any of these columns are dropped.
+
+    Args:
+        endog: a pandas.Series containing the dependent variable
+        exog: a pandas.DataFrame containing the design matrix of the model
+        specs_dict: the model specifications
+
+    Returns:
+        dict: the summary of the fitted model, see `summarize_results`
+    """
+
+    model = sm.OLS(endog, exog, missing='drop')
+    model_result = model.fit(cov_type=specs_dict["cov_type"])
+
+    return summarize_results(
+        model_result,
+        model_name=specs_dict["name"],
+        var_names={**specs_dict["dep_var"], **specs_dict["indep_vars"]},
+        cov_type=specs_dict["cov_type"]
+    )
+
+
+@instrument
+def bootstrap_ols(summary, endog, exog, dataset, bootstrap_specs, map_batches=map):
+    """Replaces the standard errors of a fitted linear model by bootstrap
+    standard errors, see `bootstrap_params`. The bootstrap is specified in
+    the `bootstrap` entry of the model specifications, e.g.
+
+        bootstrap:
+          method: "cluster"  # or "pairs"
+          cluster: "route_id"
+          replications: 1000
+          seed: 0
+
+    Args:
+        summary: the summary of the fitted model, see `summarize_results`
+        endog: a pandas.Series containing the dependent variable
+        exog: a pandas.DataFrame containing the design matrix of the model
+        dataset: a pandas.DataFrame containing the data used for the
+            estimation, with the cluster variable
+        bootstrap_specs: the bootstrap specifications
+        map_batches: a function like `map` used to solve the batches of
+            replications
+
+    Returns:
+        dict: the updated summary
+    """
+
+    method = bootstrap_specs.get("method", "pairs")
+    replications = bootstrap_specs.get("replications", 1000)
+    if method not in BOOTSTRAP_METHODS:
+        raise ValueError(f"Unknown bootstrap method: {method}")
+
+    # the rows used to fit the model
+    rows = endog.notna().values & exog.notna().all(axis=1).values
+    groups = None
+    description = "pairs bootstrap"
+    if method == 'cluster':
+        cluster = bootstrap_specs.get("cluster", "route_id")
+        groups = dataset[cluster].values[rows]
+        if pd.isna(groups).any():
+            raise ValueError(f"The cluster variable {cluster} has missing values")
+        description = f"cluster bootstrap over {cluster}"
+
+    params = bootstrap_params(
+        endog.values[rows], exog.values[rows], groups, replications,
+        bootstrap_specs.get("seed", 0), map_batches=map_batches
+    )
+
+    # dropping resamples conditions the estimate on the identified ones, which
+    # biases it unless only a few are dropped
+    identified = ~np.isnan(params).any(axis=1)
+    unidentified = replications - identified.sum()
+    if unidentified > MAX_UNIDENTIFIED_SHARE * replications or identified.sum() < 2:
+        raise ValueError(
+            f"The model {summary['model_name']} is not identified in {unidentified} of "
+            f"{replications} bootstrap replications; use regressors that vary within "
+            "the resampled clusters, or a different cluster variable"
+        )
+    details = f"{replications} replications"
+    if unidentified:
+        warnings.warn(
+            f"Dropped {unidentified} of {replications} bootstrap replications of the model "
+            f"{summary['model_name']} in which it is not identified"
+        )
+        details += f", {unidentified} not identified"
+
+    return replace_covariance(
+        summary, np.atleast_2d(np.cov(params[identified], rowvar=False)),
+        f"{description} ({details})"
+    )
+
+
+@instrument
+def build_design_matrices(dataset, specs_dicts):
+    """Builds the dependent variables and a design matrix containing the terms
+    of all models. Missing values are kept, so that each model can drop the
+    rows it cannot use.
+
+    Args:
+        dataset: a pandas.DataFrame containing the data used for the estimation
+        specs_dicts: a list of model specifications
+
+    Returns:
+        Tuple[pandas.DataFrame, pandas.DataFrame]: the dependent variables and
+        the design matrix
+    """
+
+    dep_vars = list(dict.fromkeys(
+        specs_dict["dep_var_name"] for specs_dict in specs_dicts
+    ))
+    indep_vars = list(dict.fromkeys(
+        indep_var
+        for specs_dict in specs_dicts
+        for indep_var in specs_dict["indep_vars"]
+    ))
+
+    keep_missing = patsy.NAAction(NA_types=[])
+    endog = patsy.dmatrix(
+        "0 + " + " + ".join(dep_vars), dataset,
+        NA_action=keep_missing, return_type='dataframe'
+    )
+    exog = patsy.dmatrix(
+        " + ".join(indep_vars), dataset,
+        NA_action=keep_missing, return_type='dataframe'
+    )
+
+    return endog, exog
+
+
+@instrument
+def model_design(exog, dataset, specs_dict):
+    """Selects the design matrix of a single model. The columns of terms with
+    only numerical factors do not depend on the other terms of a formula, so
+    models with only such terms take their columns from the shared design
+    matrix. The coding of categorical factors does depend on the other terms
+    (e.g. an interaction without its main effect gets a full-rank coding), so
+    models with categorical factors get their own design matrix. Shared
+    columns are checked against the columns of the model's own formula, and
+    the model gets its own design matrix if they differ.
+
+    Args:
+        exog: the shared design matrix, see `build_design_matrices`
+        dataset: a pandas.DataFrame containing the data used for the estimation
+        specs_dict: the model specifications
+
+    Returns:
+        pandas.DataFrame: the design matrix of the model, with missing values
+    """
+
+    formula = build_formula(specs_dict)
+    keep_missing = patsy.NAAction(NA_types=[])
+    model_desc = patsy.ModelDesc.from_formula(formula)
+    factor_infos = exog.design_info.factor_infos
+
+    if all(
+        factor in factor_infos and factor_infos[factor].type == 'numerical'
+        for term in model_desc.rhs_termlist
+        for factor in term.factors
+    ):
+        columns = [
+            column
+            for term in order_terms(model_desc.rhs_termlist, exog.design_info)
+            if term.name() in exog.design_info.term_name_slices
+            for column in exog.columns[exog.design_info.term_name_slices[term.name()]]
+        ]
+        # numerical columns do not depend on the data, so a single row is
+        # enough to find the columns of the model's own formula
+        _, own_exog = patsy.dmatrices(formula, dataset.head(1), NA_action=keep_missing)
+        if columns == own_exog.design_info.column_names:
+            return exog[columns]
+
+    _, own_exog = patsy.dmatrices(
+        formula, dataset, NA_action=keep_missing, return_type='dataframe'
+    )
+
+    return own_exog
+
+
+def order_terms(terms, design_info):
+    """Orders the terms of a model the way patsy would order them in its design
+    matrix: terms without numerical factors come first, the rest are grouped
+    by their numerical factors, and sorted by degree within each group.
+
+    Args:
+        terms: a list of patsy.Term objects
+        design_info: the patsy.DesignInfo of a design matrix containing the terms
+
+    Returns:
+        List[patsy.Term]: the ordered terms
+    """
+
+    term_buckets = {}
+    for term in terms:
+        numerical_factors = frozenset(
+            factor for factor in term.factors
+            if design_info.factor_infos[factor].type == 'numerical'
+        )
+        term_buckets.setdefault(numerical_factors, []).append(term)
+
+    bucket_ordering = sorted(term_buckets, key=lambda bucket: len(bucket) > 0)
+
+    return [
+        term
+        for bucket in bucket_ordering
+        for term in sorted(term_buckets[bucket], key=lambda term: len(term.factors))
+    ]
+
+
+def load_specs(specs):
+    """Loads a model specification.
+
+    Args:
+        specs: A YAML file containing model specifications
+
+    Returns:
+        dict: the model specifications
+    """
+
     with open(specs, 'r') as specs_yaml:
         specs_dict = yaml.load(specs_yaml, Loader=yaml.FullLoader)
 
-    formula = "{dep_var} ~ {indep_vars}".format(
-        dep_var=list(specs_dict["dep_var"].keys())[0],
-        indep_vars=" + ".join(specs_dict["indep_vars"].keys())
-    )
+    specs_dict["dep_var_name"] = list(specs_dict["dep_var"].keys())[0]
+
+    return specs_dict
 
-    model = smf.ols(formula, dataset)
-    model_result = model.fit(cov_type=specs_dict["cov_type"])
 
-    model_result.model_name = specs_dict["name"]
-    model_result.var_names = {**specs_dict["dep_var"], **specs_dict["indep_vars"]}
+def build_formula(specs_dict):
+    """Creates the patsy formula of a model.
 
-    with open(out, 'wb') as out_file:
-        pickle.dump(model_result, out_file)
+    Args:
+        specs_dict: the model specifications
+
+    Returns:
+        str: the formula
+    """
+
+    return "{dep_var} ~ {indep_vars}".format(
+        dep_var=specs_dict["dep_var_name"],
+        indep_vars=" + ".join(specs_dict["indep_vars"].keys())
+    )
 
 
 def main():
@@ -43,26 +315,34 @@ def main():
 
     parser.add_argument(
         '-d', '--data',
-        help="A csv file containing regression data",
+        help="A data file containing regression data",
         type=str,
         required=True
     )
     parser.add_argument(
         '-s', '--specs',
-        help="A YAML file containing model specifications",
+        help="YAML files containing model specifications",
+        nargs='+',
         type=str,
         required=True
     )
     parser.add_argument(
         '-o', '--out',
-        help="The path of the output file",
+        help="The paths of the output files, one for each model specification",
+        nargs='+',
         type=str,
         required=True
     )
+    parser.add_argument(
+        '-w', '--workers',
+        help="The number of processes fitting the models in parallel",
+        type=int,
+        default=1
+    )
 
     args = parser.parse_args()
 
-    estimate_ols(args.data, args.specs, args.out)
+    estimate_ols(args.data, args.specs, args.out, args.workers)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,184 @@
+import json
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+FORMAT_VERSION = 1
+RANK_TOLERANCE = 1e-10  # relative tolerance for singular covariance matrices
+FIT_STATISTICS = [
+    'nobs', 'rsquared', 'rsquared_adj', 'scale',
+    'fvalue', 'f_pvalue', 'df_model', 'df_resid'
+]
+
+
+class RegressionSummary:
+    """The estimates and fit statistics of a linear model, as stored in a
+    result file. Exposes the same attributes as a statsmodels regression
+    result for the parts used in the regression tables.
+
+    Args:
+        summary: a dict created by `summarize_results`
+    """
+
+    def __init__(self, summary):
+        param_names = summary["param_names"]
+
+        self.model_name = summary["model_name"]
+        self.var_names = summary["var_names"]
+        self.endog_name = summary["endog_name"]
+        self.cov_type = summary["cov_type"]
+        self.params = pd.Series(summary["params"], index=param_names)
+        self.bse = pd.Series(summary["bse"], index=param_names)
+        self.pvalues = pd.Series(summary["pvalues"], index=param_names)
+        self.conf_int_values = pd.DataFrame(
+            summary["conf_int"], index=param_names, columns=[0, 1]
+        )
+        self.cov_params = pd.DataFrame(
+            summary["cov_params"], index=param_names, columns=param_names
+        )
+        for statistic in FIT_STATISTICS:
+            setattr(self, statistic, summary[statistic])
+
+    def conf_int(self):
+        """The 95% confidence intervals of the parameters.
+
+        Returns:
+            pandas.DataFrame: the lower (column 0) and upper (column 1) bounds
+        """
+
+        return self.conf_int_values
+
+
+def summarize_results(model_result, model_name, var_names, cov_type):
+    """Extracts the parts of a fitted statsmodels regression that are needed
+    for reporting it.
+
+    Args:
+        model_result: a fitted statsmodels regression result
+        model_name: the name of the model displayed in tables
+        var_names: a dict mapping variable names to display names
+        cov_type: the type of the covariance matrix estimator
+
+    Returns:
+        dict: the summary of the results, see `RegressionSummary`
+    """
+
+    return {
+        "format_version": FORMAT_VERSION,
+        "model_name": model_name,
+        "var_names": var_names,
+        "endog_name": model_result.model.endog_names,
+        "cov_type": cov_type,
+        "param_names": list(model_result.params.index),
+        "params": list(model_result.params.values),
+        "bse": list(model_result.bse.values),
+        "pvalues": list(model_result.pvalues.values),
+        "conf_int": np.asarray(model_result.conf_int()).tolist(),
+        "cov_params": np.asarray(model_result.cov_params()).tolist(),
+        **{
+            statistic: float(getattr(model_result, statistic))
+            for statistic in FIT_STATISTICS
+        }
+    }
+
+
+def replace_covariance(summary, cov_params, cov_type):
+    """Replaces the covariance matrix of the estimates in a summary, e.g. by
+    a bootstrap estimate, and updates the standard errors, p-values,
+    confidence intervals and the F-test accordingly (using the normal
+    distribution, as statsmodels does for robust covariance matrices).
+
+    Args:
+        summary: a dict created by `summarize_results`
+        cov_params: the new covariance matrix of the parameters
+        cov_type: a description of the new covariance matrix
+
+    Returns:
+        dict: the updated summary
+    """
+
+    params = np.asarray(summary["params"])
+    cov_params = np.asarray(cov_params)
+    bse = np.sqrt(np.diag(cov_params))
+    margin = stats.norm.ppf(0.975) * bse
+
+    # the F-test of all parameters except the constant
+    tested = [name != 'Intercept' for name in summary["param_names"]]
+    fvalue = wald_fvalue(params[tested], cov_params[np.ix_(tested, tested)])
+
+    return {
+        **summary,
+        "cov_type": cov_type,
+        "bse": list(bse),
+        "pvalues": list(2 * stats.norm.sf(np.abs(params / bse))),
+        "conf_int": np.column_stack([params - margin, params + margin]).tolist(),
+        "cov_params": cov_params.tolist(),
+        "fvalue": float(fvalue),
+        "f_pvalue": float(stats.f.sf(fvalue, sum(tested), summary["df_resid"])),
+    }
+
+
+def wald_fvalue(params, cov_params):
+    """Calculates the F statistic of the Wald test that all given parameters
+    are zero. The test is only defined if the covariance matrix of the
+    parameters has full rank, which is checked on the correlation matrix so
+    that the scale of the parameters does not matter.
+
+    Args:
+        params: the tested parameters
+        cov_params: their covariance matrix
+
+    Returns:
+        float: the F statistic, or NaN if the covariance matrix is
+        (numerically) singular
+    """
+
+    num_params = len(params)
+    bse = np.sqrt(np.diag(cov_params))
+    if num_params == 0 or not np.all(bse > 0):
+        return np.nan
+
+    correlation = cov_params / np.outer(bse, bse)
+    if np.linalg.matrix_rank(correlation, tol=RANK_TOLERANCE, hermitian=True) < num_params:
+        return np.nan
+
+    t_values = params / bse
+    wald = t_values @ np.linalg.pinv(correlation, rcond=RANK_TOLERANCE, hermitian=True) @ t_values
+
+    return wald / num_params
+
+
+def write_results(summary, path):
+    """Saves a summary of regression results as a JSON file.
+
+    Args:
+        summary: a dict created by `summarize_results`
+        path: the path of the file to be created
+
+    Returns:
+        None
+    """
+
+    with open(path, 'w') as file:
+        json.dump(summary, file, indent=2)
+
+
+def read_results(path):
+    """Loads a summary of regression results saved by `write_results`.
+
+    Args:
+        path: the path of the result file
+
+    Returns:
+        RegressionSummary: the regression results
+    """
+
+    with open(path, 'r') as file:
+        summary = json.load(file)
+
+    if summary.get("format_version") != FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported result format version in {path}: {summary.get('format_version')}"
+        )
+
+    return RegressionSummary(summary)
@@ -1,22 +1,24 @@
 import argparse
 import numpy as np
-import pandas as pd
+from src.utils.data_io import read_data
+from src.utils.instrumentation import instrument
 
 
+@instrument
 def create_table(shape_data, distance_data, out, num_rows):
     """Creates a table of the n longest routes (shapes) and saves it as a tex file.
 
     Args:
-        shape_data: a csv file containing shape data
-        distance_data: a csv file containing distance data
+        shape_data: a data file containing shape data
+        distance_data: a data file containing distance data
         out: the generated table is saved here
 
     Returns:
         None
     """
 
-    shape_data = pd.read_csv(shape_data, low_memory=False)
-    distance_data = pd.read_csv(distance_data, low_memory=False)
+    shape_data = read_data(shape_data)
+    distance_data = read_data(distance_data)
 
     table = shape_data \
         .merge(distance_data, on="shape_id") \
@@ -40,13 +42,13 @@ def main():
 
     parser.add_argument(
         '-s', '--shape-data',
-        help="A csv file containing shape data",
+        help="A data file containing shape data",
         type=str,
         required=True
     )
     parser.add_argument(
         '-d', '--distance-data',
-        help="A csv file containing distance data",
+        help="A data file containing distance data",
         type=str,
         required=True
     )
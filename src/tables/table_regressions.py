@@ -1,14 +1,31 @@
 import argparse
-import pickle
 import re
+import numpy as np
 from stargazer.stargazer import Stargazer
+from src.models.results import read_results
+from src.utils.instrumentation import instrument
 
 
+class SummaryStargazer(Stargazer):
+    """A Stargazer table built from regression summaries (see
+    `src.models.results`) instead of statsmodels result objects.
+    """
+
+    def validate_input(self):
+        targets = [model.endog_name for model in self.models]
+
+        if targets.count(targets[0]) != len(targets):
+            raise ValueError('Please make sure OLS targets are identical')
+
+        self.dependent_variable = targets[0]
+
+
+@instrument
 def create_table(models, out):
     """Creates a table of regression results.
 
     Args:
-        models: regression results
+        models: regression result files written by `estimate_model.py`
         out: the generated table is saved here
 
     Returns:
@@ -20,16 +37,22 @@ def create_table(models, out):
     covariate_names = {}
 
     for model in models:
-        with open(model, 'rb') as file:
-            result = (pickle.load(file))
+        result = read_results(model)
         results.append(result)
         model_names.append(result.model_name)
         covariate_names.update(result.var_names)
 
-    table = Stargazer(results)
-    table.dependent_variable_name(covariate_names[results[0].model.endog_names])
+    table = SummaryStargazer(results)
+    table.dependent_variable_name(covariate_names[results[0].endog_name])
     table.custom_columns(model_names, [1] * len(model_names))
     table.rename_covariates(covariate_names)
+    if any(np.isnan(result.fvalue) for result in results):
+        # e.g. a bootstrap covariance matrix that is singular
+        table.show_f_statistic = False
+    table.add_custom_notes([
+        f"{result.model_name}: standard errors from a {result.cov_type}".replace('_', r'\_')
+        for result in results if 'bootstrap' in result.cov_type
+    ])
 
     latex_table = table.render_latex()
     latex_table = re.sub(r"l(c+)\}", r"lc\1}", latex_table)
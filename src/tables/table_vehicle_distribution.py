@@ -1,20 +1,23 @@
 import argparse
 import pandas as pd
+from src.utils.data_io import read_data
+from src.utils.instrumentation import instrument
 
 
+@instrument
 def create_table(shape_data, out):
     """Creates a table of the n longest routes (shapes) and saves it as a tex file.
 
     Args:
-        shape_data: a csv file containing shape data
-        distance_data: a csv file containing distance data
+        shape_data: a data file containing shape data
+        distance_data: a data file containing distance data
         out: the generated table is saved here
 
     Returns:
         None
     """
 
-    shape_data = pd.read_csv(shape_data, low_memory=False)
+    shape_data = read_data(shape_data)
     vehicle_key = pd.DataFrame({
         "route_type": [0, 2, 3, 7],
         "vehicle_type": ["Tram", "S-Bahn", "Bus", "Other"]
@@ -42,7 +45,7 @@ def main():
 
     parser.add_argument(
         '-s', '--shape-data',
-        help="A csv file containing shape data",
+        help="A data file containing shape data",
         type=str,
         required=True
     )
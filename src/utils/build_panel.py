@@ -0,0 +1,229 @@
+import os
+import argparse
+import concurrent.futures
+import pandas as pd
+from src.utils.data_io import CHUNKED_FORMATS, DATA_FORMATS, read_data, write_data
+from src.utils.obtain_data import download_cached
+from src.utils.reshape_data import DISTANCE_METHODS, compile_datasets
+from src.utils.instrumentation import instrument
+
+PANEL_DATASETS = ['shape_data', 'distance_data', 'regression_data']
+
+
+@instrument
+def build_panel(feeds, out_dir, data_format='csv', method='planar', workers=1,
+                download_cache=None, shape_cache=None, max_memory=None, stop_times=False):
+    """Compiles the datasets of several GTFS feeds (e.g. the timetables of
+    different years) in parallel, and stacks their shape, distance and
+    regression data into panels identified by a `feed` column.
+
+    The datasets of each feed are written to a subdirectory of `out_dir`
+    named after its label, the panels to `out_dir/panel_<dataset>.<format>`.
+
+    Args:
+        feeds: a dict mapping the label of each feed to its URL or to the path
+            of a local GTFS zip archive (or extracted directory)
+        out_dir: the directory where the datasets are created
+        data_format: the format of the datasets, one of `DATA_FORMATS`
+        method: either 'planar' or 'haversine', see `calculate_segment_lengths`
+        workers: the number of feeds processed in parallel
+        download_cache: the directory of the download cache, required if any
+            of the feeds is a URL
+        shape_cache: if given, the directory of a shape cache shared by the
+            feeds, so shapes unchanged between feeds are only computed once,
+            see `process_shapes_cached`
+        max_memory: if given, shapes.txt is processed in chunks using about
+            this much memory (in MB); requires one of `CHUNKED_FORMATS`
+        stop_times: if True, the service hours and headways calculated from
+            stop_times.txt are added to the shape data
+
+    Returns:
+        None
+    """
+
+    if max_memory is not None and data_format not in CHUNKED_FORMATS:
+        raise ValueError(f"Chunked processing (max_memory) is not supported for {data_format} files")
+
+    jobs = [
+        (
+            label, source, os.path.join(out_dir, label), data_format, method,
+            download_cache, shape_cache, max_memory, stop_times
+        )
+        for label, source in feeds.items()
+    ]
+
+    if workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(compile_feed, *zip(*jobs)))
+    else:
+        for job in jobs:
+            compile_feed(*job)
+
+    for dataset in PANEL_DATASETS:
+        panel = stack_feeds({
+            label: read_data(os.path.join(out_dir, label, f"{dataset}.{data_format}"))
+            for label in feeds
+        })
+        write_data(panel, os.path.join(out_dir, f"panel_{dataset}.{data_format}"))
+
+
+def compile_feed(label, source, out_dir, data_format='csv', method='planar',
+                 download_cache=None, shape_cache=None, max_memory=None, stop_times=False):
+    """Obtains a single feed and compiles its datasets, see `compile_datasets`.
+
+    Args:
+        label: the label of the feed
+        source: the URL of the feed, or the path of a local GTFS zip archive
+            (or extracted directory)
+        out_dir: the directory where the datasets of the feed are created
+        data_format: the format of the datasets, one of `DATA_FORMATS`
+        method: either 'planar' or 'haversine', see `calculate_segment_lengths`
+        download_cache: the directory of the download cache, required if
+            `source` is a URL
+        shape_cache: the directory of the shape cache, or None
+        max_memory: if given, shapes.txt is processed in chunks using about
+            this much memory (in MB)
+        stop_times: if True, stop_times.txt is read as well
+
+    Returns:
+        None
+    """
+
+    if is_url(source):
+        if download_cache is None:
+            raise ValueError(f"Feed {label} is a URL, so a download cache is required")
+        # the downloaded archive is read directly, without extracting it
+        source = download_cached(source, download_cache)
+
+    os.makedirs(out_dir, exist_ok=True)
+    compile_datasets(
+        source,
+        *[
+            os.path.join(out_dir, f"{dataset}.{data_format}")
+            for dataset in ['shape_data', 'plot_data', 'distance_data', 'regression_data']
+        ],
+        method=method, max_memory=max_memory, shape_cache=shape_cache, stop_times=stop_times
+    )
+
+
+def stack_feeds(datasets):
+    """Stacks the same dataset of several feeds.
+
+    Args:
+        datasets: a dict mapping the label of each feed to a pandas.DataFrame
+
+    Returns:
+        pandas.DataFrame: the stacked datasets, with the label of the feed in
+        the first column (`feed`)
+    """
+
+    panel = pd.concat(
+        [df.assign(feed=label) for label, df in datasets.items()],
+        ignore_index=True
+    )
+
+    return panel[['feed', *[column for column in panel.columns if column != 'feed']]]
+
+
+def is_url(source):
+    """Checks whether the source of a feed is a URL rather than a local path.
+
+    Args:
+        source: the URL or path of a feed
+
+    Returns:
+        bool: True if `source` is a URL
+    """
+
+    return source.startswith(('http://', 'https://', 'ftp://'))
+
+
+def parse_feed(feed):
+    """Parses a feed given on the command line as 'label=source'.
+
+    Args:
+        feed: the label and source of the feed, separated by '='
+
+    Returns:
+        Tuple[str, str]: the label and the source
+    """
+
+    label, separator, source = feed.partition('=')
+    if not separator or not label or not source:
+        raise argparse.ArgumentTypeError(f"Feeds must be given as label=source, got {feed}")
+
+    return label, source
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '-f', '--feeds',
+        help="The feeds as label=source, where source is a URL or a local GTFS zip archive",
+        nargs='+',
+        type=parse_feed,
+        required=True
+    )
+    parser.add_argument(
+        '-o', '--out-dir',
+        help="The directory where the datasets are created",
+        type=str,
+        required=True
+    )
+    parser.add_argument(
+        '--data-format',
+        help="The format of the datasets",
+        choices=DATA_FORMATS,
+        default='csv'
+    )
+    parser.add_argument(
+        '-m', '--method',
+        help="The method used to calculate distances between shape points",
+        choices=DISTANCE_METHODS,
+        default='planar'
+    )
+    parser.add_argument(
+        '-w', '--workers',
+        help="The number of feeds processed in parallel",
+        type=int,
+        default=1
+    )
+    parser.add_argument(
+        '-c', '--cache-dir',
+        help="Cache downloads in this directory and skip unchanged files",
+        type=str
+    )
+    parser.add_argument(
+        '--shape-cache',
+        help="Cache the results of each shape here, shared by the feeds, and only recompute changed shapes",
+        type=str
+    )
+    parser.add_argument(
+        '--max-memory',
+        help="Process shapes.txt in chunks, using about this much memory (in MB)",
+        type=int
+    )
+    parser.add_argument(
+        '--stop-times',
+        help="Add the service hours and headways of each shape from stop_times.txt",
+        action='store_true'
+    )
+
+    args = parser.parse_args()
+
+    feeds = dict(args.feeds)
+    if len(feeds) != len(args.feeds):
+        parser.error("the labels of the feeds must be unique")
+    if args.max_memory is not None and args.data_format not in CHUNKED_FORMATS:
+        parser.error(f"--max-memory requires one of the data formats {', '.join(CHUNKED_FORMATS)}")
+
+    build_panel(
+        feeds, args.out_dir, args.data_format, args.method, args.workers,
+        args.cache_dir, args.shape_cache, args.max_memory, args.stop_times
+    )
+
+
+if __name__ == "__main__":
+    main()
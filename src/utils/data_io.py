@@ -0,0 +1,207 @@
+import hashlib
+import pathlib
+import pandas as pd
+from src.utils.instrumentation import instrument
+
+DATA_FORMATS = ['csv', 'parquet', 'feather']
+CHUNKED_FORMATS = ['csv', 'parquet']  # formats `ChunkedDataWriter` can write
+CATEGORICAL_COLUMNS = ['feed', 'shape_id', 'route_id', 'route_short_name', 'route_color']
+
+
+@instrument
+def read_data(path):
+    """Reads an intermediate dataset. The format is determined by the file
+    extension (one of `DATA_FORMATS`). The id and color columns are read as
+    categoricals.
+
+    Args:
+        path: the path of the file to be read
+
+    Returns:
+        pandas.DataFrame: the contents of the file
+    """
+
+    data_format = get_data_format(path)
+
+    if data_format == 'csv':
+        header = pd.read_csv(path, nrows=0).columns
+        return pd.read_csv(
+            path,
+            dtype={
+                column: 'category'
+                for column in CATEGORICAL_COLUMNS
+                if column in header
+            },
+            low_memory=False
+        )
+    elif data_format == 'parquet':
+        return as_categoricals(pd.read_parquet(path))
+    elif data_format == 'feather':
+        return as_categoricals(pd.read_feather(path))
+
+
+@instrument
+def write_data(df, path):
+    """Writes an intermediate dataset. The format is determined by the file
+    extension (one of `DATA_FORMATS`). In the columnar formats the id and color
+    columns are stored as categoricals, so their dtypes survive the round trip.
+
+    Args:
+        df: a pandas.DataFrame
+        path: the path of the file to be created
+
+    Returns:
+        None
+    """
+
+    data_format = get_data_format(path)
+
+    if data_format == 'csv':
+        df.to_csv(path, index=False)
+        return
+
+    df = as_categoricals(df.reset_index(drop=True))
+
+    if data_format == 'parquet':
+        df.to_parquet(path, index=False)
+    elif data_format == 'feather':
+        df.to_feather(path)
+
+
+class ChunkedDataWriter:
+    """Writes an intermediate dataset chunk by chunk, so that it never has to be
+    held in memory as a whole. Supports the csv and parquet formats. In the
+    parquet format the id and color columns are stored as strings, as their
+    categories may differ between chunks; `read_data` turns them back into
+    categoricals.
+
+    Args:
+        path: the path of the file to be created
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.data_format = check_chunked_format(path)
+        self.parquet_writer = None
+        self.num_chunks = 0
+
+    def write(self, df):
+        """Appends a chunk to the dataset.
+
+        Args:
+            df: a pandas.DataFrame with the same columns as the previous chunks
+
+        Returns:
+            None
+        """
+
+        if self.data_format == 'csv':
+            df.to_csv(
+                self.path, index=False,
+                mode='w' if self.num_chunks == 0 else 'a',
+                header=self.num_chunks == 0
+            )
+        elif self.data_format == 'parquet':
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            df = df.astype({
+                column: object
+                for column in CATEGORICAL_COLUMNS
+                if column in df.columns
+            })
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self.parquet_writer is None:
+                self.parquet_writer = pq.ParquetWriter(self.path, table.schema)
+            self.parquet_writer.write_table(table.cast(self.parquet_writer.schema))
+
+        self.num_chunks += 1
+
+    def close(self):
+        """Finishes writing the dataset.
+
+        Returns:
+            None
+        """
+
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def as_categoricals(df):
+    """Converts the id and color columns of a dataset to categoricals.
+
+    Args:
+        df: a pandas.DataFrame
+
+    Returns:
+        pandas.DataFrame: the same as `df` with categorical id and color columns
+    """
+
+    return df.astype({
+        column: 'category'
+        for column in CATEGORICAL_COLUMNS
+        if column in df.columns
+    })
+
+
+def get_data_format(path):
+    """Determines the format of a dataset from its file extension.
+
+    Args:
+        path: the path of a data file
+
+    Returns:
+        str: one of `DATA_FORMATS`
+    """
+
+    data_format = pathlib.Path(path).suffix.lstrip('.')
+    if data_format not in DATA_FORMATS:
+        raise ValueError(f"Unsupported data format: {path}")
+
+    return data_format
+
+
+def check_chunked_format(path):
+    """Makes sure that a dataset can be written chunk by chunk, see
+    `ChunkedDataWriter`. Feather files are written as a whole.
+
+    Args:
+        path: the path of a data file
+
+    Returns:
+        str: the format of the file, one of `CHUNKED_FORMATS`
+    """
+
+    data_format = get_data_format(path)
+    if data_format not in CHUNKED_FORMATS:
+        raise ValueError(
+            f"Chunked writing (max_memory) is not supported for {data_format} files, "
+            f"use one of {', '.join(CHUNKED_FORMATS)}"
+        )
+
+    return data_format
+
+
+def file_checksum(path):
+    """Calculates the SHA-256 checksum of a file.
+
+    Args:
+        path: the path of the file
+
+    Returns:
+        str: the hex digest of the checksum
+    """
+
+    checksum = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(2 ** 20), b''):
+            checksum.update(block)
+
+    return checksum.hexdigest()
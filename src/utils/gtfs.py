@@ -0,0 +1,165 @@
+import io
+import pathlib
+import zipfile
+import pandas as pd
+from src.utils.instrumentation import instrument
+
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+GTFS_SCHEMAS = {
+    'trips': {
+        'route_id': 'category',
+        'service_id': 'category',
+        'trip_id': str,
+        'shape_id': 'category',
+    },
+    'routes': {
+        'route_id': str,
+        'route_short_name': str,
+        'route_type': 'int16',
+        'route_color': str,
+    },
+    'calendar': {
+        'service_id': str,
+        **{weekday: 'int8' for weekday in WEEKDAYS},
+        'start_date': 'int32',
+        'end_date': 'int32',
+    },
+    'calendar_dates': {
+        'service_id': str,
+        'date': 'int32',
+        'exception_type': 'int8',
+    },
+    'shapes': {
+        'shape_id': 'category',
+        # float32 would shift shape lengths by up to about 4e-4 relative
+        'shape_pt_lat': 'float64',
+        'shape_pt_lon': 'float64',
+        'shape_pt_sequence': 'int32',
+    },
+    'stop_times': {
+        'trip_id': str,
+        'arrival_time': str,
+        'departure_time': str,
+        'stop_id': str,
+        'stop_sequence': 'int32',
+    },
+}
+
+
+@instrument
+def read_gtfs_file(gtfs_dir, name, columns=None, index_col=None, chunksize=None):
+    """Reads a file of a GTFS feed using the dtypes given in `GTFS_SCHEMAS`.
+    Only the requested columns are parsed, and they are looked up by name, so
+    the column order of the file does not matter.
+
+    Args:
+        gtfs_dir: the directory where the GTFS file is extracted, or the path
+            of the GTFS zip archive
+        name: the name of the GTFS file without extension (e.g. 'trips')
+        columns: the columns to read, all columns of the schema if None
+        index_col: the name of the column to be used as the index
+        chunksize: if given, the file is read in chunks of this many rows
+
+    Returns:
+        pandas.DataFrame: the requested columns of the GTFS file, or an
+        iterator of such DataFrames if `chunksize` is given
+    """
+
+    schema = GTFS_SCHEMAS[name]
+    if columns is None:
+        columns = list(schema)
+    if index_col is not None and index_col not in columns:
+        columns = [index_col, *columns]
+
+    unknown_columns = [column for column in columns if column not in schema]
+    if unknown_columns:
+        raise ValueError(f"Unknown columns requested from {name}.txt: {unknown_columns}")
+
+    read_options = {
+        'usecols': lambda column: column in columns,
+        'dtype': {column: schema[column] for column in columns},
+    }
+    gtfs_file = pathlib.Path(gtfs_dir) / f"{name}.txt"
+
+    if chunksize is not None:
+        return iter_gtfs_chunks(
+            gtfs_dir, name, columns, index_col, chunksize, read_options
+        )
+
+    with open_gtfs_file(gtfs_dir, name) as file:
+        data = pd.read_csv(file, **read_options)
+
+    return select_columns(data, columns, index_col, gtfs_file)
+
+
+def iter_gtfs_chunks(gtfs_dir, name, columns, index_col, chunksize, read_options):
+    """Reads a file of a GTFS feed in chunks. The file stays open until all
+    chunks have been read. See `read_gtfs_file` for the arguments.
+
+    Yields:
+        pandas.DataFrame: the requested columns of the next chunk of rows
+    """
+
+    gtfs_file = pathlib.Path(gtfs_dir) / f"{name}.txt"
+
+    with open_gtfs_file(gtfs_dir, name) as file:
+        for chunk in pd.read_csv(file, chunksize=chunksize, **read_options):
+            yield select_columns(chunk, columns, index_col, gtfs_file)
+
+
+def open_gtfs_file(gtfs_dir, name):
+    """Opens a file of a GTFS feed for reading. If `gtfs_dir` is a zip archive,
+    the file is decompressed on the fly, without extracting it to disk.
+
+    Args:
+        gtfs_dir: the directory where the GTFS file is extracted, or the path
+            of the GTFS zip archive
+        name: the name of the GTFS file without extension (e.g. 'trips')
+
+    Returns:
+        io.TextIOWrapper: the open file
+    """
+
+    gtfs_dir = pathlib.Path(gtfs_dir)
+    file_name = f"{name}.txt"
+
+    if not zipfile.is_zipfile(gtfs_dir):
+        return open(gtfs_dir / file_name, 'r', encoding='utf-8-sig')
+
+    with zipfile.ZipFile(gtfs_dir) as archive:
+        members = [
+            member for member in archive.namelist()
+            if pathlib.PurePosixPath(member).name == file_name
+        ]
+        if not members:
+            raise FileNotFoundError(f"{file_name} not found in {gtfs_dir}")
+        # the member stays readable after the archive object is closed
+        member = archive.open(members[0])
+
+    return io.TextIOWrapper(member, encoding='utf-8-sig')
+
+
+def select_columns(data, columns, index_col, gtfs_file):
+    """Checks that all requested columns were found in a GTFS file and puts
+    them in the requested order.
+
+    Args:
+        data: a pandas.DataFrame read from `gtfs_file`
+        columns: the requested columns
+        index_col: the name of the column to be used as the index
+        gtfs_file: the path of the GTFS file, used in error messages
+
+    Returns:
+        pandas.DataFrame: the requested columns of `data`
+    """
+
+    missing_columns = [column for column in columns if column not in data.columns]
+    if missing_columns:
+        raise ValueError(f"Missing columns in {gtfs_file}: {missing_columns}")
+
+    data = data.loc[:, columns]
+    if index_col is not None:
+        data = data.set_index(index_col)
+
+    return data
@@ -0,0 +1,251 @@
+import os
+import sys
+import json
+import time
+import atexit
+import contextlib
+import functools
+import datetime
+import threading
+import multiprocessing
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+PROFILE_VARIABLE = 'PIPELINE_PROFILE'
+SAMPLE_INTERVAL = 0.01  # seconds between memory samples during a stage
+
+profile_path = os.environ.get(PROFILE_VARIABLE) or None
+stages = {}
+stages_lock = threading.Lock()
+# the memory measurements of the calls in progress, updated by the sampler
+active_calls = []
+sampler = None  # the process id and the sampling thread
+
+
+def instrument(func):
+    """Records the wall time, CPU time, memory use and row counts of each call
+    of a function. The memory use of a stage is the largest increase of the
+    resident memory over its value at the start of a call, see `track_memory`.
+    Instrumentation is opt-in: unless the environment variable
+    `PIPELINE_PROFILE` is set to the path of a JSON report when the module is
+    imported, the function is returned unchanged.
+
+    Args:
+        func: the function to be instrumented
+
+    Returns:
+        function: the instrumented function
+    """
+
+    if profile_path is None:
+        return func
+
+    name = f"{module_name(func)}.{func.__qualname__}"
+
+    @functools.wraps(func)
+    def instrumented(*args, **kwargs):
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        with track_memory() as memory:
+            result = func(*args, **kwargs)
+        wall_time = time.perf_counter() - wall_start
+        # the CPU time of the whole process, so it includes concurrent threads
+        cpu_time = time.process_time() - cpu_start
+
+        with stages_lock:
+            stage = stages.setdefault(name, {
+                "calls": 0, "wall_time": 0.0, "cpu_time": 0.0,
+                "rss_increase_mb": None, "rows_in": None, "rows_out": None
+            })
+            stage["calls"] += 1
+            stage["wall_time"] += wall_time
+            stage["cpu_time"] += cpu_time
+            if memory["increase"] is not None:
+                stage["rss_increase_mb"] = max(stage["rss_increase_mb"] or 0.0, memory["increase"])
+            stage["rows_in"] = add_rows(stage["rows_in"], count_rows(*args))
+            stage["rows_out"] = add_rows(stage["rows_out"], count_rows(result))
+
+        return result
+
+    return instrumented
+
+
+@contextlib.contextmanager
+def track_memory():
+    """Measures how much the resident memory grows while the block runs. The
+    memory is sampled every `SAMPLE_INTERVAL` seconds by a background thread,
+    so very short peaks may be missed. Where the current memory use cannot be
+    read (only on Linux), the increase of the peak memory of the process is
+    used instead, which is zero for blocks staying below an earlier peak.
+
+    Yields:
+        dict: its `increase` is set to the increase in MB (or None if memory
+        cannot be measured) when the block is finished
+    """
+
+    global sampler
+
+    start = current_rss_mb()
+    if start is None:
+        peak_start = peak_rss_mb()
+        memory = {"increase": None}
+        yield memory
+        if peak_start is not None:
+            memory["increase"] = peak_rss_mb() - peak_start
+        return
+
+    memory = {"start": start, "peak": start, "increase": None}
+    with stages_lock:
+        active_calls.append(memory)
+        # forked processes do not inherit the thread
+        if sampler is None or sampler[0] != os.getpid():
+            thread = threading.Thread(target=sample_memory, daemon=True)
+            thread.start()
+            sampler = (os.getpid(), thread)
+    try:
+        yield memory
+    finally:
+        end = current_rss_mb()
+        with stages_lock:
+            active_calls.remove(memory)
+        memory["increase"] = max(memory["peak"], end) - start
+
+
+def sample_memory():
+    """Records the resident memory of the calls in progress, forever. Run in a
+    daemon thread started by `track_memory`.
+
+    Returns:
+        None
+    """
+
+    while True:
+        rss = current_rss_mb()
+        with stages_lock:
+            for memory in active_calls:
+                memory["peak"] = max(memory["peak"], rss)
+        time.sleep(SAMPLE_INTERVAL)
+
+
+def current_rss_mb():
+    """The current resident memory of this process.
+
+    Returns:
+        float: the memory use in MB, or None if it cannot be measured
+    """
+
+    try:
+        with open('/proc/self/statm', 'r') as file:
+            resident_pages = int(file.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+
+    return resident_pages * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+
+def module_name(func):
+    """The name of the module defining a function. Scripts run with
+    `python -m` are named by their import path instead of `__main__`.
+
+    Args:
+        func: a function
+
+    Returns:
+        str: the name of the module
+    """
+
+    if func.__module__ == '__main__':
+        spec = getattr(sys.modules['__main__'], '__spec__', None)
+        if spec is not None:
+            return spec.name
+
+    return func.__module__
+
+
+def count_rows(*values):
+    """Counts the rows of the first table-like value (a DataFrame, Series or
+    array).
+
+    Args:
+        values: any values, e.g. the arguments or the result of a function
+
+    Returns:
+        int: the number of rows, or None if there is no table-like value
+    """
+
+    for value in values:
+        if hasattr(value, 'shape') and len(getattr(value, 'shape')) > 0:
+            return int(value.shape[0])
+
+    return None
+
+
+def add_rows(total, rows):
+    """Adds up row counts that may be missing.
+
+    Args:
+        total: the row count so far, or None
+        rows: the row count of a call, or None
+
+    Returns:
+        int: the sum, or None if both are missing
+    """
+
+    if rows is None:
+        return total
+
+    return rows if total is None else total + rows
+
+
+def peak_rss_mb():
+    """The peak resident memory of the current process so far.
+
+    Returns:
+        float: the peak memory use in MB, or None if it cannot be measured
+    """
+
+    if resource is None:
+        return None
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    bytes_per_unit = 1 if sys.platform == 'darwin' else 1024
+
+    return peak_rss * bytes_per_unit / 2 ** 20
+
+
+def write_report(path):
+    """Saves the measurements of the current run as a JSON file.
+
+    Args:
+        path: the path of the report
+
+    Returns:
+        None
+    """
+
+    report = {
+        "command": sys.argv,
+        "finished": datetime.datetime.now().isoformat(timespec='seconds'),
+        "wall_time": time.perf_counter() - run_wall_start,
+        "cpu_time": time.process_time() - run_cpu_start,
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": stages,
+    }
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as file:
+        json.dump(report, file, indent=2)
+
+
+# the totals of the run are measured from the first import of this module
+run_wall_start = time.perf_counter()
+run_cpu_start = time.process_time()
+# worker processes measure their own calls, but only the main process reports
+if profile_path is not None and multiprocessing.parent_process() is None:
+    atexit.register(write_report, profile_path)
@@ -1,9 +1,13 @@
 import os
+import json
 import shutil
+import hashlib
 import requests
 import argparse
 import zipfile
 import tempfile
+from src.utils.data_io import file_checksum
+from src.utils.instrumentation import instrument
 
 
 def download_file(url, file):
@@ -25,6 +29,175 @@ def download_file(url, file):
     print(f"Succesfully downloaded file from {url}")
 
 
+@instrument
+def download_cached(url, cache_dir, sha256=None):
+    """Downloads the file located at `url` into a local cache, unless the cached
+    copy is still up to date. Freshness is checked with a conditional request
+    using the ETag and Last-Modified headers of the previous download.
+    Interrupted downloads are resumed with a range request, if the partial
+    download has a validator that makes sure the remote file did not change
+    in between. A download is only cached once its length matches the length
+    announced by the server, and its checksum matches `sha256` if given; a
+    download with a different checksum is discarded.
+
+    Args:
+        url: the URL of the file to download
+        cache_dir: the directory of the download cache. Will be created if it
+            does not exist.
+        sha256: the expected SHA-256 checksum of the file (optional)
+
+    Returns:
+        str: the path of the cached file
+    """
+
+    os.makedirs(cache_dir, exist_ok=True)
+    key = hashlib.sha256(url.encode()).hexdigest()
+    cached_file = os.path.join(cache_dir, key)
+    partial_file = cached_file + '.part'
+
+    metadata = read_metadata(cached_file)
+    if metadata is not None and file_checksum(cached_file) != metadata['sha256']:
+        print(f"Cached copy of {url} is corrupt, downloading it again")
+        metadata = None
+    elif metadata is not None and sha256 is not None and metadata['sha256'] != sha256.lower():
+        print(f"Cached copy of {url} does not have the expected checksum, downloading it again")
+        metadata = None
+
+    headers = {}
+    if metadata is not None:
+        headers.update(validator_headers(metadata, 'If-None-Match', 'If-Modified-Since'))
+    else:
+        partial_metadata = read_metadata(partial_file)
+        if partial_metadata is not None and os.path.exists(partial_file):
+            # without a validator, a changed remote file could not be noticed,
+            # and both versions would be spliced together
+            resume_headers = validator_headers(partial_metadata, 'If-Range', 'If-Range')
+            if resume_headers:
+                headers.update(resume_headers)
+                headers['Range'] = f"bytes={os.path.getsize(partial_file)}-"
+
+    with requests.get(url, headers=headers, stream=True) as req:
+        if req.status_code == 416:
+            # the partial download cannot be resumed, start from scratch
+            os.remove(partial_file)
+            return download_cached(url, cache_dir, sha256)
+        elif req.status_code == 304:
+            print(f"Cached copy of {url} is up to date")
+        else:
+            req.raise_for_status()
+            validators = {
+                'etag': req.headers.get('ETag'),
+                'last_modified': req.headers.get('Last-Modified')
+            }
+            resumed = req.status_code == 206
+            if resumed:
+                start, expected_size = content_range(req.headers.get('Content-Range'))
+                if start != os.path.getsize(partial_file):
+                    # not the requested range, start from scratch
+                    os.remove(partial_file)
+                    return download_cached(url, cache_dir, sha256)
+            else:
+                expected_size = req.headers.get('Content-Length')
+                expected_size = None if expected_size is None else int(expected_size)
+                write_metadata(partial_file, validators)
+            with open(partial_file, 'ab' if resumed else 'wb') as file:
+                shutil.copyfileobj(req.raw, file)
+
+            size = os.path.getsize(partial_file)
+            if expected_size is not None and size != expected_size:
+                # the partial file is kept, so the next run resumes it
+                raise IOError(
+                    f"Incomplete download of {url}: got {size} of {expected_size} bytes"
+                )
+            print(f"Succesfully downloaded file from {url}")
+
+            metadata = {**validators, 'sha256': file_checksum(partial_file)}
+            if sha256 is not None and metadata['sha256'] != sha256.lower():
+                # a wrong download is not cached, so the next run fetches it again
+                os.remove(partial_file)
+                os.remove(partial_file + '.json')
+                raise ValueError(f"Checksum mismatch for {url}: got {metadata['sha256']}")
+            os.replace(partial_file, cached_file)
+            os.remove(partial_file + '.json')
+            write_metadata(cached_file, metadata)
+
+    return cached_file
+
+
+def content_range(header):
+    """Parses the Content-Range header of a partial response.
+
+    Args:
+        header: the value of the header, e.g. 'bytes 100-199/1000'
+
+    Returns:
+        Tuple[int, int]: the position of the first byte of the response, and
+        the size of the whole file (None if the server does not know it)
+    """
+
+    if header is None or not header.startswith('bytes '):
+        raise IOError(f"Invalid Content-Range of a partial response: {header}")
+
+    byte_range, _, size = header[len('bytes '):].partition('/')
+    start = int(byte_range.partition('-')[0])
+
+    return start, None if size == '*' else int(size)
+
+
+def validator_headers(metadata, etag_header, date_header):
+    """Creates the headers of a conditional request from the validators stored
+    in the metadata of a cached file. The ETag is preferred if available.
+
+    Args:
+        metadata: the metadata dict of a cached file
+        etag_header: the header used for the ETag
+        date_header: the header used for the Last-Modified date
+
+    Returns:
+        dict: the headers of the conditional request
+    """
+
+    if metadata.get('etag'):
+        return {etag_header: metadata['etag']}
+    elif metadata.get('last_modified'):
+        return {date_header: metadata['last_modified']}
+    else:
+        return {}
+
+
+def read_metadata(path):
+    """Reads the metadata stored next to a cached file.
+
+    Args:
+        path: the path of the cached file
+
+    Returns:
+        dict: the metadata, or None if there is none
+    """
+
+    try:
+        with open(path + '.json', 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def write_metadata(path, metadata):
+    """Stores the metadata of a cached file next to it.
+
+    Args:
+        path: the path of the cached file
+        metadata: a JSON-serializable dict
+
+    Returns:
+        None
+    """
+
+    with open(path + '.json', 'w') as file:
+        json.dump(metadata, file)
+
+
+@instrument
 def extract_file(file, out_dir):
     """Extract the contents of a zip file to a directory
 
@@ -60,15 +233,50 @@ def main():
     parser.add_argument(
         '-o', '--out-dir',
         help="The diractory where the GTFS file is extracted",
-        type=str,
-        required=True
+        type=str
+    )
+    parser.add_argument(
+        '-a', '--archive',
+        help="Keep the downloaded GTFS zip archive at this path",
+        type=str
+    )
+    parser.add_argument(
+        '-c', '--cache-dir',
+        help="Cache downloads in this directory and skip unchanged files",
+        type=str
+    )
+    parser.add_argument(
+        '--sha256',
+        help="The expected SHA-256 checksum of the GTFS file",
+        type=str
     )
 
     args = parser.parse_args()
 
-    with tempfile.TemporaryFile('w+b') as file:
-        download_file(args.url, file)
-        extract_file(file, args.out_dir)
+    if args.out_dir is None and args.archive is None:
+        parser.error("at least one of --out-dir and --archive is required")
+
+    if args.archive is not None:
+        archive_dir = os.path.dirname(args.archive)
+        if archive_dir and not os.path.exists(archive_dir):
+            os.makedirs(archive_dir)
+
+    if args.cache_dir is not None:
+        cached_file = download_cached(args.url, args.cache_dir, args.sha256)
+        if args.archive is not None:
+            shutil.copyfile(cached_file, args.archive)
+        if args.out_dir is not None:
+            with open(cached_file, 'rb') as file:
+                extract_file(file, args.out_dir)
+    elif args.archive is None:
+        with tempfile.TemporaryFile('w+b') as file:
+            download_file(args.url, file)
+            extract_file(file, args.out_dir)
+    else:
+        with open(args.archive, 'w+b') as file:
+            download_file(args.url, file)
+            if args.out_dir is not None:
+                extract_file(file, args.out_dir)
 
 
 if __name__ == "__main__":
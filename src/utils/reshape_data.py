@@ -1,57 +1,249 @@
-import pathlib
+import time
 import argparse
-import datetime
 import numpy as np
 import pandas as pd
+from src.utils.data_io import read_data, write_data, check_chunked_format, ChunkedDataWriter
+from src.utils.gtfs import read_gtfs_file
+from src.utils.service_calendar import ServiceCalendar
+from src.utils.simplify import simplify_shapes, pixel_tolerance
+from src.utils.shape_cache import entry_keys, hash_shapes, load_shape_cache, save_shape_cache
+from src.utils.spatial_index import ShapeIndex, INDEX_CELL_SIZE
+from src.utils.instrumentation import instrument
+
+EARTH_CIRCUMFERENCE_KM = 40075
+EARTH_RADIUS_KM = 6371.0088
+DISTANCE_METHODS = ['planar', 'haversine']
+SHAPE_ROW_BYTES = 500  # rough memory use of a shape point during processing
+SHAPE_COLUMNS = ['shape_id', 'shape_pt_lat', 'shape_pt_lon']
+PLOT_COORDINATE_DTYPE = 'float32'  # enough for the figures, and half the size
+PLOT_COLUMNS = ['shape_id', 'route_color', 'times_taken']  # the shape data used by the figures
+STOP_TIME_ROW_BYTES = 300  # rough memory use of a stop time during processing
+STOP_TIMES_MEMORY = 256  # default memory limit (in MB) of reading stop_times.txt
+SERVICE_COLUMNS = [
+    'first_departure', 'last_departure', 'mean_trip_duration', 'vehicle_hours',
+    'mean_headway', 'median_headway'
+]
 
 
 def create_regression_data(shape_data, distance_data):
     """Combines the shape and distance data into a single file for regressions.
 
     Args:
-        shape_data: a csv file containing shape data
-        distance_data: a csv file containing distance data
+        shape_data: a data file containing shape data
+        distance_data: a data file containing distance data
 
     Returns:
         pandas.DataFrame: contains shape data
     """
 
-    shape_data = pd.read_csv(shape_data, low_memory=True)
-    distance_data = pd.read_csv(distance_data, low_memory=True)
+    shape_data = read_data(shape_data)
+    distance_data = read_data(distance_data)
+
+    return combine_regression_data(shape_data, distance_data)
+
+
+@instrument
+def combine_regression_data(shape_data, distance_data):
+    """Merges the shape and distance data and keeps the columns used in the
+    regressions.
+
+    Args:
+        shape_data: a pandas.DataFrame containing shape data
+        distance_data: a pandas.DataFrame containing distance data
+
+    Returns:
+        pandas.DataFrame: contains regression data
+    """
+
+    service_columns = [column for column in SERVICE_COLUMNS if column in shape_data.columns]
 
     regression_data = shape_data \
         .merge(distance_data, on="shape_id") \
-        .loc[:, ["shape_id", "route_id", "route_type", "route_color", "times_taken", "distance"]]
+        .loc[:, [
+            "shape_id", "route_id", "route_type", "route_color", "times_taken", "distance",
+            *service_columns
+        ]]
 
     return regression_data
 
 
-def collect_shape_data(gtfs_dir):
+@instrument
+def compile_datasets(gtfs_dir, shape_out, plot_out, distance_out, regression_out,
+                     method='planar', max_memory=None, start_date=None, end_date=None,
+                     simplify_width=None, shape_cache=None, stop_times=False):
+    """Creates the shape, plot, distance and regression data in a single pass,
+    reading each GTFS file only once and keeping the intermediate datasets in
+    memory.
+
+    Args:
+        gtfs_dir: the directory where the GTFS file is extracted, or the GTFS
+            zip archive
+        shape_out: the path of the shape data file to be created
+        plot_out: the path of the plot data file to be created
+        distance_out: the path of the distance data file to be created
+        regression_out: the path of the regression data file to be created
+        method: either 'planar' or 'haversine', see `calculate_segment_lengths`
+        max_memory: if given, shapes.txt is processed in chunks using about
+            this much memory (in MB); the plot data is then written in chunks,
+            so it cannot be a feather file
+        start_date: only count trips from this date on (inclusive)
+        end_date: only count trips up to this date (inclusive)
+        simplify_width: if given, the plot data is simplified for images of
+            this width (in pixels), see `combine_plot_data`
+        shape_cache: if given, the distances and plotted points of each shape
+            are cached in this directory, and only shapes that changed since
+            the last run are recomputed (see `process_shapes_cached`); cannot
+            be combined with `max_memory`
+        stop_times: if True, the service hours and headways calculated from
+            stop_times.txt are added to the shape data, see `collect_shape_data`
+
+    Returns:
+        None
+    """
+
+    if shape_cache is not None and max_memory is not None:
+        raise ValueError("The shape cache cannot be combined with chunked processing")
+    if max_memory is not None:
+        check_chunked_format(plot_out)
+
+    shape_data = collect_shape_data(gtfs_dir, start_date, end_date, stop_times, max_memory)
+    write_data(shape_data, shape_out)
+
+    if max_memory is None:
+        shapes = read_gtfs_file(gtfs_dir, 'shapes', SHAPE_COLUMNS)
+        tolerance = simplify_tolerance([shapes], simplify_width)
+        if shape_cache is None:
+            write_data(combine_plot_data(shapes, shape_data, tolerance), plot_out)
+            distance_data = sum_segment_lengths(shapes, method)
+        else:
+            plot_shapes, distance_data = process_shapes_cached(
+                shapes, shape_cache, method, tolerance
+            )
+            write_data(combine_plot_data(plot_shapes, shape_data), plot_out)
+        del shapes
+    else:
+        chunksize = max_memory * 2 ** 20 // SHAPE_ROW_BYTES
+        tolerance = simplify_tolerance(
+            read_gtfs_file(gtfs_dir, 'shapes', ['shape_pt_lon'], chunksize=chunksize),
+            simplify_width
+        )
+        shape_lengths = []
+        with ChunkedDataWriter(plot_out) as writer:
+            for shapes in iter_complete_shapes(gtfs_dir, chunksize):
+                writer.write(combine_plot_data(shapes, shape_data, tolerance))
+                shape_lengths.append(sum_segment_lengths(shapes, method))
+        distance_data = pd.concat(shape_lengths, ignore_index=True) \
+            .sort_values('shape_id') \
+            .reset_index(drop=True)
+
+    write_data(distance_data, distance_out)
+    write_data(combine_regression_data(shape_data, distance_data), regression_out)
+
+
+@instrument
+def process_shapes_cached(shapes, cache_dir, method='planar', tolerance=None):
+    """Calculates the length and the plotted points of each shape, reusing the
+    results of earlier runs for shapes whose points have not changed. A
+    content hash of each shape's point sequence is stored in the cache next to
+    its results, so the cache can be shared by several feeds (e.g. the
+    versions of a panel); new and changed shapes are recomputed.
+
+    With simplification, the points defining the extent of the data are only
+    kept among the recomputed shapes (see `simplify_shapes`), so the plot data
+    may differ from a full run by less than `tolerance`.
+
+    Args:
+        shapes: a pandas.DataFrame with the points of the shapes
+        cache_dir: the directory of the cache
+        method: either 'planar' or 'haversine', see `calculate_segment_lengths`
+        tolerance: if given, the shapes are simplified, see `combine_plot_data`
+
+    Returns:
+        Tuple[pandas.DataFrame, pandas.DataFrame]: the points of the (possibly
+        simplified) shapes, and the length of each shape in km
+    """
+
+    shapes = shapes.sort_values('shape_id', kind='mergesort')
+    shape_hashes = hash_shapes(shapes)
+    cached_index, cached_points = load_shape_cache(cache_dir, method, tolerance)
+
+    unchanged = shape_hashes.merge(
+        cached_index.astype({'shape_id': str}), on=['shape_id', 'shape_hash']
+    )
+    changed_shapes = shapes[~shapes.shape_id.astype(str).isin(unchanged.shape_id).values]
+
+    if tolerance is not None:
+        new_points = simplify_shapes(changed_shapes, tolerance)
+    else:
+        new_points = changed_shapes
+
+    points = pd.concat(
+        [
+            cached_points[entry_keys(cached_points).isin(entry_keys(unchanged))],
+            new_points[SHAPE_COLUMNS].astype({'shape_id': str})
+            .merge(shape_hashes, on='shape_id', how='left', sort=False)
+        ],
+        ignore_index=True
+    ) \
+        .astype({'shape_pt_lat': shapes.shape_pt_lat.dtype, 'shape_pt_lon': shapes.shape_pt_lon.dtype})
+    distance_data = pd.concat(
+        [
+            unchanged[['shape_id', 'distance']],
+            sum_segment_lengths(changed_shapes, method).astype({'shape_id': str})
+        ],
+        ignore_index=True
+    ) \
+        .sort_values('shape_id') \
+        .reset_index(drop=True)
+
+    save_shape_cache(
+        cache_dir, shape_hashes.merge(distance_data, on='shape_id'), points, method, tolerance
+    )
+    print(f"Reused {len(unchanged)} of {len(shape_hashes)} shapes from {cache_dir}")
+
+    return points[SHAPE_COLUMNS], distance_data
+
+
+@instrument
+def collect_shape_data(gtfs_dir, start_date=None, end_date=None, stop_times=False,
+                       max_memory=None):
     """Calculate the number of times a shape (line on a map) is travelled.
     Appends some additional information about the route that the shape belongs to.
 
     Args:
-        gtfs_dir: the directory where the GTFS file is extracted
+        gtfs_dir: the directory where the GTFS file is extracted, or the GTFS
+            zip archive
+        start_date: only count trips from this date on (inclusive)
+        end_date: only count trips up to this date (inclusive)
+        stop_times: if True, the service hours and headways of each shape
+            (`SERVICE_COLUMNS`, see `summarize_service_hours`) are calculated
+            from stop_times.txt
+        max_memory: the approximate memory limit (in MB) of reading
+            stop_times.txt, `STOP_TIMES_MEMORY` if None
 
     Returns:
         pandas.DataFrame: contains shape data
     """
 
-    gtfs_dir = pathlib.Path(gtfs_dir)
-
-    service_days = calculate_service_days(gtfs_dir)
-    trips = pd.read_csv(gtfs_dir / 'trips.txt', index_col=2)
-    routes = pd.read_csv(gtfs_dir / 'routes.txt', index_col=0)
+    service_days = calculate_service_days(gtfs_dir, start_date, end_date)
+    trip_columns = ['route_id', 'service_id', 'shape_id', *(['trip_id'] if stop_times else [])]
+    trips = read_gtfs_file(gtfs_dir, 'trips', trip_columns)
+    routes = read_gtfs_file(
+        gtfs_dir, 'routes',
+        ['route_short_name', 'route_type', 'route_color'],
+        index_col='route_id'
+    )
 
-    route_id_diffs = trips \
-        .groupby('shape_id') \
-        .aggregate({'route_id': [min, max]})
-    if any(route_id_diffs[('route_id', 'min')] != route_id_diffs[('route_id', 'max')]):
+    route_ids_per_shape = trips \
+        .groupby('shape_id', observed=True) \
+        .route_id \
+        .nunique()
+    if any(route_ids_per_shape > 1):
         raise ValueError("Shape ids must uniquely identify route_ids")
 
     route_info = trips \
         .join(service_days, on="service_id", how="left") \
-        .groupby(["shape_id"]) \
+        .groupby(["shape_id"], observed=True) \
         .aggregate({'days': sum, 'route_id': 'first'}) \
         .rename(columns={'days': 'times_taken'}) \
         .join(
@@ -60,100 +252,337 @@ def collect_shape_data(gtfs_dir):
         ) \
         .reset_index()
 
+    if stop_times:
+        trip_times = calculate_trip_times(gtfs_dir, max_memory or STOP_TIMES_MEMORY)
+        route_info = route_info.merge(
+            summarize_service_hours(trips, trip_times, service_days),
+            on='shape_id', how='left'
+        )
+
     return route_info
 
 
-def calculate_service_days(gtfs_dir):
-    """Calculate the number of active days for each service.
+@instrument
+def calculate_trip_times(gtfs_dir, max_memory=STOP_TIMES_MEMORY):
+    """Calculates the first departure, last arrival and duration of each trip
+    from stop_times.txt. The file is read in chunks, and each chunk is reduced
+    to one row per trip right away, so the memory use is bounded by the chunk
+    size and the number of trips rather than the number of stop times.
 
     Args:
-        gtfs_dir: the directory where the GTFS file is extracted
+        gtfs_dir: the directory where the GTFS file is extracted, or the GTFS
+            zip archive
+        max_memory: the approximate memory limit in MB
 
     Returns:
-        pandas.DataFrame: contains day counts by service_id
+        pandas.DataFrame: contains the first departure, last arrival and
+        duration of each trip in seconds (times after midnight of the service
+        day, so they may exceed 24 hours)
     """
 
-    gtfs_dir = pathlib.Path(gtfs_dir)
+    chunksize = max_memory * 2 ** 20 // STOP_TIME_ROW_BYTES
+    chunks = read_gtfs_file(
+        gtfs_dir, 'stop_times', ['trip_id', 'arrival_time', 'departure_time'],
+        chunksize=chunksize
+    )
 
-    calendar = pd.read_csv(gtfs_dir / 'calendar.txt', index_col=0)
-    calendar_dates = pd.read_csv(gtfs_dir / 'calendar_dates.txt')
+    # trips straddling a chunk boundary get a partial row in both chunks
+    partial_times = [
+        pd.DataFrame({
+            'trip_id': chunk.trip_id.values,
+            'departure': parse_gtfs_times(chunk.departure_time),
+            'arrival': parse_gtfs_times(chunk.arrival_time),
+        })
+        .groupby('trip_id', sort=False)
+        .agg({'departure': 'min', 'arrival': 'max'})
+        for chunk in chunks
+    ]
+
+    trip_times = pd.concat(partial_times) \
+        .groupby(level=0) \
+        .agg({'departure': 'min', 'arrival': 'max'}) \
+        .rename_axis('trip_id') \
+        .reset_index()
+    trip_times['duration'] = trip_times.arrival - trip_times.departure
 
-    validity_weeks = calculate_validity_weeks(calendar)
-    regular_number_of_days = calendar \
-        .loc[:, ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']] \
-        .sum(axis=1) \
-        * validity_weeks
+    return trip_times
 
-    exception_key = pd.DataFrame({
-        "exception_type": [1, 2],
-        "day_diff": [1, -1]
-    })
-    irregular_number_of_days = calendar_dates \
-        .merge(exception_key, on="exception_type", how="left") \
-        .groupby("service_id") \
-        .sum()
 
-    number_of_days = regular_number_of_days \
-        .to_frame(name="regular_days") \
-        .join(irregular_number_of_days[["day_diff"]], how="outer") \
-        .fillna(value=0) \
-        .assign(days=lambda df: df.regular_days + df.day_diff)
+def parse_gtfs_times(times):
+    """Converts GTFS times (HH:MM:SS after midnight of the service day, the
+    hours may exceed 24) to seconds.
+
+    Args:
+        times: a pandas.Series of GTFS time strings, missing times are NaN
+
+    Returns:
+        numpy.ndarray: the times in seconds, NaN where missing
+    """
+
+    return pd.to_timedelta(times).dt.total_seconds().values
 
-    if number_of_days.days.min() < 0:
-        raise ValueError("Number of days a service operates on cannot be negative.")
 
-    return number_of_days
+@instrument
+def summarize_service_hours(trips, trip_times, service_days):
+    """Calculates the service hours and headways of each shape:
 
+    - first_departure, last_departure: the departure of the earliest and
+      latest trip in hours after midnight
+    - mean_trip_duration: the mean duration of the trips in minutes
+    - vehicle_hours: the hours spent by vehicles travelling the shape over
+      all service days
+    - mean_headway, median_headway: the time between consecutive departures
+      in minutes. Trips are only compared with trips of the same service, as
+      these run on the same days.
 
-def calculate_validity_weeks(calendar):
-    """Calculate the validity of the calendar in weeks.
+    Trips that do not run on any of the counted days are ignored.
 
     Args:
-        calendar: a pandas.DataFrame containing the contents of calendar.txt
+        trips: a pandas.DataFrame with the trip_id, service_id and shape_id of
+            each trip
+        trip_times: the times of each trip, see `calculate_trip_times`
+        service_days: the number of active days of each service, see
+            `calculate_service_days`
 
     Returns:
-        int: the validity of the timetable in weeks
+        pandas.DataFrame: contains the `SERVICE_COLUMNS` of each shape
     """
 
-    if calendar.start_date.min() != calendar.start_date.max() or \
-            calendar.end_date.min() != calendar.end_date.max():
-        raise ValueError("Non-uniform timetable validities are not handled yet.")
-    start_date = datetime.datetime.strptime(
-        str(calendar.start_date[0]),
-        '%Y%m%d'
-    )
-    end_date = datetime.datetime.strptime(
-        str(calendar.end_date[0]),
-        '%Y%m%d'
-    )
+    trips = trips \
+        .merge(trip_times, on='trip_id') \
+        .join(service_days, on='service_id', how='left') \
+        .query('days > 0 and duration == duration') \
+        .sort_values(['shape_id', 'service_id', 'departure']) \
+        .reset_index(drop=True)
+    trips['vehicle_hours'] = trips.duration / 3600 * trips.days
+
+    service_hours = trips \
+        .groupby('shape_id', observed=True) \
+        .agg(
+            first_departure=('departure', 'min'),
+            last_departure=('departure', 'max'),
+            mean_trip_duration=('duration', 'mean'),
+            vehicle_hours=('vehicle_hours', 'sum')
+        )
+    service_hours[['first_departure', 'last_departure']] /= 3600
+    service_hours['mean_trip_duration'] /= 60
+
+    shape_ids = np.asarray(trips.shape_id)
+    service_ids = np.asarray(trips.service_id)
+    is_next_trip = (shape_ids[1:] == shape_ids[:-1]) & (service_ids[1:] == service_ids[:-1])
+    headways = pd.Series(np.diff(trips.departure.values)[is_next_trip] / 60, name='headway') \
+        .groupby(shape_ids[1:][is_next_trip]) \
+        .agg(['mean', 'median']) \
+        .rename(columns={'mean': 'mean_headway', 'median': 'median_headway'})
+
+    return service_hours \
+        .join(headways, how='left') \
+        .rename_axis('shape_id') \
+        .reset_index() \
+        .loc[:, ['shape_id', *SERVICE_COLUMNS]]
+
+
+@instrument
+def calculate_service_days(gtfs_dir, start_date=None, end_date=None):
+    """Calculate the number of active days for each service.
+
+    Args:
+        gtfs_dir: the directory where the GTFS file is extracted, or the GTFS
+            zip archive
+        start_date: only count days from this date on (inclusive)
+        end_date: only count days up to this date (inclusive)
+
+    Returns:
+        pandas.DataFrame: contains day counts by service_id
+    """
+
+    calendar = read_gtfs_file(gtfs_dir, 'calendar', index_col='service_id')
+    calendar_dates = read_gtfs_file(gtfs_dir, 'calendar_dates')
 
-    validity_days = (end_date - start_date).days + 1
-    if validity_days % 7 != 0:
-        raise ValueError("Non-integer weeks are not handled yet.")
+    service_calendar = ServiceCalendar.from_gtfs(calendar, calendar_dates)
 
-    return validity_days // 7
+    return service_calendar \
+        .active_days(start_date, end_date) \
+        .rename_axis('service_id') \
+        .to_frame()
 
 
-def generate_plot_data(gtfs_dir, shape_data):
+@instrument
+def generate_plot_data(gtfs_dir, shape_data, simplify_width=None):
     """Generates a dataset suitable for line plots using datashader.
 
     Args:
-        gtfs_dir: the directory where the GTFS file is extracted
+        gtfs_dir: the directory where the GTFS file is extracted, or the GTFS
+            zip archive
         shape_data: additional shape data that is needed for the plotting
+        simplify_width: if given, the shapes are simplified for images of this
+            width (in pixels)
 
     Returns:
         pandas.DataFrame: a DataFrame that is used for line plots
     """
 
-    gtfs_dir = pathlib.Path(gtfs_dir)
-    shapes = pd.read_csv(gtfs_dir / 'shapes.txt')
+    shapes = read_gtfs_file(gtfs_dir, 'shapes', SHAPE_COLUMNS)
+    tolerance = simplify_tolerance([shapes], simplify_width)
+
+    return combine_plot_data(shapes, shape_data, tolerance)
+
+
+@instrument
+def combine_plot_data(shapes, shape_data, tolerance=None):
+    """Separates the shapes by empty rows and appends the shape data used by
+    the figures (`PLOT_COLUMNS`) to them. The coordinates are stored as
+    `PLOT_COORDINATE_DTYPE`.
+
+    Args:
+        shapes: a pandas.DataFrame with the points of the shapes
+        shape_data: additional shape data that is needed for the plotting
+        tolerance: if given, the shapes are simplified, dropping points that
+            are closer than this (in degrees) to the simplified lines
+
+    Returns:
+        pandas.DataFrame: a DataFrame that is used for line plots
+    """
+
+    if tolerance is not None:
+        shapes = simplify_shapes(
+            shapes.sort_values('shape_id', kind='mergesort'), tolerance
+        )
 
     plotting_data = insert_empty_rows(shapes, 'shape_id') \
-        .merge(shape_data, on='shape_id', how='left')
+        .astype({
+            'shape_pt_lat': PLOT_COORDINATE_DTYPE,
+            'shape_pt_lon': PLOT_COORDINATE_DTYPE
+        }) \
+        .merge(shape_data[PLOT_COLUMNS], on='shape_id', how='left')
 
     return plotting_data
 
 
+def shapes_extent(shape_chunks):
+    """Finds the range of longitudes covered by the shapes.
+
+    Args:
+        shape_chunks: an iterable of pandas.DataFrames with the points of the
+            shapes
+
+    Returns:
+        Tuple[float, float]: the minimum and maximum longitude
+    """
+
+    extents = np.array([
+        (chunk.shape_pt_lon.min(), chunk.shape_pt_lon.max())
+        for chunk in shape_chunks
+    ])
+
+    return extents[:, 0].min(), extents[:, 1].max()
+
+
+def simplify_tolerance(shape_chunks, simplify_width):
+    """The tolerance used to simplify shapes for images of a given width. Points
+    closer than half a pixel to the simplified lines are dropped, so the
+    simplified shapes render almost exactly like the original ones.
+
+    Args:
+        shape_chunks: an iterable of pandas.DataFrames with the points of the
+            shapes, only consumed if `simplify_width` is given
+        simplify_width: the width of the images in pixels, or None
+
+    Returns:
+        float: the tolerance in degrees, or None if `simplify_width` is None
+    """
+
+    if simplify_width is None:
+        return None
+
+    return pixel_tolerance(shapes_extent(shape_chunks), simplify_width)
+
+
+@instrument
+def generate_plot_data_chunked(gtfs_dir, shape_data, out, max_memory, simplify_width=None):
+    """Generates the same dataset as `generate_plot_data`, but reads shapes.txt
+    in chunks and writes the result to `out` chunk by chunk. Shapes are ordered
+    by shape_id only within each chunk.
+
+    Args:
+        gtfs_dir: the directory where the GTFS file is extracted, or the GTFS
+            zip archive
+        shape_data: additional shape data that is needed for the plotting
+        out: the path of the file to be created, in one of `CHUNKED_FORMATS`
+        max_memory: the approximate memory limit in MB
+        simplify_width: if given, the shapes are simplified for images of this
+            width (in pixels)
+
+    Returns:
+        None
+    """
+
+    chunksize = max_memory * 2 ** 20 // SHAPE_ROW_BYTES
+    # the tolerance depends on the extent of all shapes, not just one chunk
+    tolerance = simplify_tolerance(
+        read_gtfs_file(gtfs_dir, 'shapes', ['shape_pt_lon'], chunksize=chunksize),
+        simplify_width
+    )
+
+    with ChunkedDataWriter(out) as writer:
+        for shapes in iter_complete_shapes(gtfs_dir, chunksize):
+            writer.write(combine_plot_data(shapes, shape_data, tolerance))
+
+
+def iter_complete_shapes(gtfs_dir, chunksize):
+    """Reads shapes.txt in chunks, making sure that every shape is contained
+    in a single chunk. The points of a shape that straddle a chunk boundary
+    are carried over to the next chunk. Requires the points of each shape to
+    be stored in consecutive rows.
+
+    Args:
+        gtfs_dir: the directory where the GTFS file is extracted, or the GTFS
+            zip archive
+        chunksize: the number of rows read at once
+
+    Yields:
+        pandas.DataFrame: the points of a set of complete shapes
+    """
+
+    chunks = read_gtfs_file(gtfs_dir, 'shapes', SHAPE_COLUMNS, chunksize=chunksize)
+    finished_shapes = set()
+    carry_over = None
+
+    for chunk in chunks:
+        if carry_over is not None:
+            chunk = pd.concat([carry_over, chunk], ignore_index=True)
+
+        is_last_shape = (chunk.shape_id == chunk.shape_id.iloc[-1]).values
+        complete_shapes, carry_over = chunk[~is_last_shape], chunk[is_last_shape]
+
+        if not complete_shapes.empty:
+            check_new_shapes(complete_shapes, finished_shapes)
+            yield complete_shapes
+
+    if carry_over is not None:
+        check_new_shapes(carry_over, finished_shapes)
+        yield carry_over
+
+
+def check_new_shapes(shapes, finished_shapes):
+    """Makes sure that none of the shapes have been seen in a previous chunk,
+    then marks them as finished.
+
+    Args:
+        shapes: a pandas.DataFrame with the points of some shapes
+        finished_shapes: the set of shape ids found in previous chunks
+
+    Returns:
+        None
+    """
+
+    shape_ids = set(shapes.shape_id.unique())
+    if not finished_shapes.isdisjoint(shape_ids):
+        raise ValueError("The points of each shape must be in consecutive rows of shapes.txt")
+    finished_shapes.update(shape_ids)
+
+
+@instrument
 def insert_empty_rows(df, by):
     """ Inserts a row filled with NaNs between each chunk of the dataframe
     separated by a variable. The resulting dataset is suitable for line plots.
@@ -163,67 +592,507 @@ def insert_empty_rows(df, by):
         by: a column of `df` that will be used for the grouping
 
     Returns:
-        pandas.DataFrame: the same as the input `df` with empty lines inserted
-        between groups
+        pandas.DataFrame: the same as the input `df` sorted by `by`, with empty
+        lines inserted between groups and a fresh index
     """
 
-    df_parts = []
+    df = df[df[by].notna()]
+    if df.empty:
+        return df.copy()
 
-    for level, df_part in df.groupby(by):
-        empty = pd.DataFrame(
-            [[level if colname == by else np.NaN for colname in df.columns]],
-            columns=df.columns
-        )
-        df_parts.append(df_part.append(empty))
+    sorted_df = df \
+        .sort_values(by, kind='mergesort') \
+        .reset_index(drop=True)
+    keys = sorted_df[by].values
+
+    # positions right after the last row of each group
+    group_ends = np.append(np.flatnonzero(keys[1:] != keys[:-1]) + 1, len(keys))
 
-    return pd.concat(df_parts)
+    # reindexing with a missing label (-1) yields a row filled with NaNs
+    positions = np.insert(np.arange(len(keys)), group_ends, -1)
+    key_positions = np.insert(np.arange(len(keys)), group_ends, group_ends - 1)
+    result = sorted_df.reindex(positions).reset_index(drop=True)
+    result[by] = sorted_df[by].take(key_positions).values
 
+    return result
 
-def calculate_shape_length(gtfs_dir):
-    """Contains the length of each shape in the GTFS file.
+
+@instrument
+def generate_segment_data(gtfs_dir, shape_data, snap_distance=5, method='planar',
+                          max_memory=None):
+    """Creates the network of street segments travelled by the shapes. Shape
+    points are snapped to a grid, so that shapes running along the same street
+    share their segments, and the trips of all shapes travelling a segment are
+    summed up. Segments are undirected and kept separately for each route
+    color.
 
     Args:
-        gtfs_dir: the directory where the GTFS file is extracted
-        shape_data: additional shape data that is needed for the plotting
+        gtfs_dir: the directory where the GTFS file is extracted, or the GTFS
+            zip archive
+        shape_data: additional shape data, with the number of trips of each
+            shape
+        snap_distance: the spacing of the grid in meters
+        method: either 'planar' or 'haversine', see `calculate_segment_lengths`
+        max_memory: if given, shapes.txt is processed in chunks using about
+            this much memory (in MB)
+
+    Returns:
+        pandas.DataFrame: one row per segment and route color, with the
+        coordinates of both ends, the number of trips, the number of distinct
+        shapes and the length of the segment in km
+    """
+
+    if max_memory is None:
+        shape_chunks = [read_gtfs_file(gtfs_dir, 'shapes', SHAPE_COLUMNS)]
+    else:
+        chunksize = max_memory * 2 ** 20 // SHAPE_ROW_BYTES
+        shape_chunks = iter_complete_shapes(gtfs_dir, chunksize)
+
+    # every shape is contained in a single chunk, so the counts of distinct
+    # shapes can be added up across chunks
+    segment_chunks = [
+        collect_segments(shapes, shape_data, snap_distance)
+        for shapes in shape_chunks
+    ]
+    segments = pd.concat(segment_chunks, ignore_index=True) \
+        .groupby(['node_a', 'node_b', 'route_color'], observed=True, sort=True) \
+        .aggregate({
+            'lat_a': 'first', 'lon_a': 'first', 'lat_b': 'first', 'lon_b': 'first',
+            'times_taken': 'sum', 'num_shapes': 'sum'
+        }) \
+        .reset_index()
+
+    segments.insert(
+        0, 'segment_id', segments.groupby(['node_a', 'node_b'], sort=True).ngroup()
+    )
+    segments['distance'] = calculate_segment_lengths(segment_points(segments), method)[1::2]
+
+    return segments.drop(columns=['node_a', 'node_b'])
+
+
+def collect_segments(shapes, shape_data, snap_distance):
+    """Snaps the points of the shapes to a grid and lists the segments between
+    consecutive grid points with their number of trips.
+
+    Args:
+        shapes: a pandas.DataFrame with the points of the shapes, the points of
+            each shape in consecutive rows
+        shape_data: additional shape data, with the number of trips of each
+            shape
+        snap_distance: the spacing of the grid in meters
+
+    Returns:
+        pandas.DataFrame: the grid nodes and coordinates of both ends, the
+        route color, the number of trips and the number of distinct shapes of
+        each segment
+    """
+
+    shapes = shapes.merge(
+        shape_data[['shape_id', 'route_color', 'times_taken']], on='shape_id', how='inner'
+    )
+    nodes, lat, lon = snap_points(
+        shapes.shape_pt_lat.values, shapes.shape_pt_lon.values, snap_distance
+    )
+    ids = shapes.shape_id.values
+
+    # segments within a shape that connect two different grid points
+    is_segment = (ids[1:] == ids[:-1]) & (nodes[1:] != nodes[:-1])
+    starts = np.flatnonzero(is_segment)
+    ends = starts + 1
+
+    # the same street travelled in the other direction is the same segment
+    swap = nodes[starts] > nodes[ends]
+    starts, ends = np.where(swap, ends, starts), np.where(swap, starts, ends)
+
+    segments = pd.DataFrame({
+        'node_a': nodes[starts],
+        'node_b': nodes[ends],
+        'route_color': shapes.route_color.values[starts],
+        'lat_a': lat[starts],
+        'lon_a': lon[starts],
+        'lat_b': lat[ends],
+        'lon_b': lon[ends],
+        'times_taken': shapes.times_taken.values[starts],
+        'shape_id': ids[starts],
+    })
+
+    return segments \
+        .groupby(['node_a', 'node_b', 'route_color'], observed=True) \
+        .aggregate({
+            'lat_a': 'first', 'lon_a': 'first', 'lat_b': 'first', 'lon_b': 'first',
+            'times_taken': 'sum', 'shape_id': 'nunique'
+        }) \
+        .rename(columns={'shape_id': 'num_shapes'}) \
+        .reset_index()
+
+
+def snap_points(lat, lon, snap_distance):
+    """Snaps points to a grid with a spacing of about `snap_distance` meters.
+    The longitude spacing depends on the latitude of the grid row, so the grid
+    does not depend on the extent of the data.
+
+    Args:
+        lat: a numpy.ndarray of latitudes
+        lon: a numpy.ndarray of longitudes
+        snap_distance: the spacing of the grid in meters
+
+    Returns:
+        Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]: an integer id of
+        the grid point of each point, and the latitudes and longitudes of the
+        grid points
+    """
+
+    lat_step = snap_distance / (1000 * EARTH_CIRCUMFERENCE_KM / 360)
+    lat_index = np.round(lat.astype(np.float64) / lat_step).astype(np.int64)
+    snapped_lat = lat_index * lat_step
+
+    lon_step = lat_step / np.cos(np.radians(snapped_lat))
+    lon_index = np.round(lon.astype(np.float64) / lon_step).astype(np.int64)
+    snapped_lon = lon_index * lon_step
+
+    nodes = (lat_index << 32) + (lon_index & 0xFFFFFFFF)
+
+    return nodes, snapped_lat, snapped_lon
+
+
+def segment_points(segments):
+    """Lists the two ends of each segment in the layout of shapes.txt. Each
+    row of `segments` becomes a shape of two points, identified by its row
+    number in the shape_id column.
+
+    Args:
+        segments: a pandas.DataFrame with the coordinates of both ends of the
+            segments, and a fresh index
+
+    Returns:
+        pandas.DataFrame: the points of the segments
+    """
+
+    return pd.DataFrame({
+        'shape_id': np.repeat(np.arange(len(segments)), 2),
+        'shape_pt_lat': np.column_stack([segments.lat_a, segments.lat_b]).ravel(),
+        'shape_pt_lon': np.column_stack([segments.lon_a, segments.lon_b]).ravel(),
+    })
+
+
+def segment_plot_data(segments):
+    """Converts the segment network to the layout of the plot data, so that
+    it can be used by the figure scripts. Consecutive segments with the same
+    route color and number of trips are joined into lines (see
+    `chain_segments`), so a street travelled by several shapes is drawn once
+    and a line costs one row per point plus one empty row.
+
+    Args:
+        segments: a pandas.DataFrame created by `generate_segment_data`
 
     Returns:
         pandas.DataFrame: a DataFrame that is used for line plots
     """
 
-    gtfs_dir = pathlib.Path(gtfs_dir)
-    shapes = pd.read_csv(gtfs_dir / 'shapes.txt')
+    if segments.empty:
+        return pd.DataFrame(columns=SHAPE_COLUMNS + ['route_color', 'times_taken'])
+
+    line_ids, states = chain_segments(segments)
+    rows = states // 2
+    forward = states % 2 == 0
+
+    # a line starts at the entry point of its first segment and continues
+    # with the exit point of each segment
+    line_starts = np.flatnonzero(np.append(True, line_ids[1:] != line_ids[:-1]))
+    entry_lat = np.where(forward, segments.lat_a.values[rows], segments.lat_b.values[rows])
+    entry_lon = np.where(forward, segments.lon_a.values[rows], segments.lon_b.values[rows])
+    exit_lat = np.where(forward, segments.lat_b.values[rows], segments.lat_a.values[rows])
+    exit_lon = np.where(forward, segments.lon_b.values[rows], segments.lon_a.values[rows])
+
+    line_points = pd.DataFrame({
+        'shape_id': np.insert(line_ids, line_starts, line_ids[line_starts]),
+        'shape_pt_lat': np.insert(exit_lat, line_starts, entry_lat[line_starts]),
+        'shape_pt_lon': np.insert(exit_lon, line_starts, entry_lon[line_starts]),
+    })
+    line_info = segments \
+        .iloc[rows[line_starts]] \
+        .loc[:, ['route_color', 'times_taken']] \
+        .assign(shape_id=line_ids[line_starts])
+
+    return insert_empty_rows(line_points, 'shape_id') \
+        .merge(line_info, on='shape_id', how='left')
 
-    shape_lengths = shapes \
-        .assign(
-            x_km=lambda df: 40075 / 360 * df.shape_pt_lon * np.cos(df.shape_pt_lat),
-            y_km=lambda df: 40075 / 360 * df.shape_pt_lat
-        ) \
-        .loc[:, ["shape_id", "x_km", "y_km"]] \
-        .groupby('shape_id') \
-        .apply(
-            lambda df_part: df_part
-            .diff()
-            .fillna(0)
-            .assign(distance=lambda df: np.sqrt(df.x_km ** 2 + df.y_km ** 2))
-            .sum()
-        ) \
-        .reset_index() \
-        .loc[:, ["shape_id", "distance"]]
+
+def chain_segments(segments):
+    """Joins the segments with the same route color and number of trips into
+    lines. The segments meeting at a grid point are joined in pairs, so a
+    line may continue through a junction, and a line only ends where an odd
+    number of segments meet (e.g. where the number of trips changes). This
+    keeps the number of lines close to the smallest possible one.
+
+    A segment traversed in one direction is a state (twice its row number,
+    plus one if it is traversed from the second to the first end), and each
+    state is followed by the state continuing the line, if any. The lines are
+    then ordered by pointer jumping (see `follow_states`), without a loop
+    over the segments. Each line is found in both directions, and only one
+    of them is kept.
+
+    Args:
+        segments: a pandas.DataFrame created by `generate_segment_data`, with
+            a fresh index
+
+    Returns:
+        Tuple[numpy.ndarray, numpy.ndarray]: the line of each segment
+        (numbered from 0) and its state, sorted by line and position on the
+        line
+    """
+
+    num_segments = len(segments)
+    group = pd.DataFrame({
+        'route_color': pd.factorize(segments.route_color)[0],
+        'times_taken': pd.factorize(segments.times_taken)[0],
+    }) \
+        .groupby(['route_color', 'times_taken'], sort=False) \
+        .ngroup() \
+        .values
+
+    # the grid points of each line group, for both ends of the segments
+    ends = pd.DataFrame({
+        'group': np.tile(group, 2),
+        'lat': np.concatenate([segments.lat_a.values, segments.lat_b.values]),
+        'lon': np.concatenate([segments.lon_a.values, segments.lon_b.values]),
+    })
+    vertices = ends.groupby(['group', 'lat', 'lon'], sort=False).ngroup().values
+
+    # the ends meeting at a grid point are paired up in the order of the
+    # segments, an odd end is left over; end i belongs to row i % num_segments
+    order = np.argsort(vertices, kind='mergesort')
+    sorted_vertices = vertices[order]
+    vertex_starts = np.flatnonzero(np.append(True, sorted_vertices[1:] != sorted_vertices[:-1]))
+    degrees = np.diff(np.append(vertex_starts, len(order)))
+    ranks = np.arange(len(order)) - np.repeat(vertex_starts, degrees)
+    pairs = np.flatnonzero((ranks % 2 == 0) & (ranks + 1 < np.repeat(degrees, degrees)))
+    partner = np.full(2 * num_segments, -1)
+    partner[order[pairs]] = order[pairs + 1]
+    partner[order[pairs + 1]] = order[pairs]
+
+    # state 2 * row leaves at the second end (2 * row + 1 at the first), and
+    # the next segment is entered at the paired end, which gives its direction
+    states = np.arange(2 * num_segments)
+    exit_ends = np.where(states % 2 == 0, num_segments, 0) + states // 2
+    next_ends = partner[exit_ends]
+    successors = np.where(
+        next_ends < 0, -1, 2 * (next_ends % num_segments) + next_ends // num_segments
+    )
+
+    # lines without an end are cut before their smallest state
+    last, _, smallest = follow_states(successors)
+    is_cycle = successors[last] >= 0
+    successors[is_cycle & (successors == smallest)] = -1
+
+    last, steps, _ = follow_states(successors)
+    reversed_last = last[states ^ 1]
+    keep = last < reversed_last
+
+    kept = states[keep][np.lexsort((-steps[keep], last[keep]))]
+    line_ids = np.unique(last[kept], return_inverse=True)[1]
+
+    return line_ids, kept
+
+
+def follow_states(successors):
+    """Follows the states of the lines to their ends by pointer jumping: in
+    each round, every state skips ahead twice as far as in the previous one.
+
+    Args:
+        successors: a numpy.ndarray with the next state of each state, or -1
+            at the end of a line
+
+    Returns:
+        Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]: the last state
+        reached from each state, the number of steps to it, and the smallest
+        state passed on the way; on a cycle, the last state and the number of
+        steps are arbitrary, but the smallest state is the smallest of the
+        cycle
+    """
+
+    states = np.arange(len(successors))
+    last = np.where(successors < 0, states, successors)
+    steps = (successors >= 0).astype(np.int64)
+    smallest = np.minimum(states, last)
+
+    for _ in range(int(np.ceil(np.log2(max(len(states), 2)))) + 1):
+        steps = steps + steps[last]
+        smallest = np.minimum(smallest, smallest[last])
+        last = last[last]
+
+    return last, steps, smallest
+
+
+@instrument
+def calculate_shape_length(gtfs_dir, method='planar'):
+    """Calculates the length of each shape in the GTFS file.
+
+    Args:
+        gtfs_dir: the directory where the GTFS file is extracted, or the GTFS
+            zip archive
+        method: either 'planar' or 'haversine', see `calculate_segment_lengths`
+
+    Returns:
+        pandas.DataFrame: contains the length of each shape in km
+    """
+
+    shapes = read_gtfs_file(gtfs_dir, 'shapes', SHAPE_COLUMNS)
+
+    return sum_segment_lengths(shapes, method)
+
+
+@instrument
+def calculate_shape_length_chunked(gtfs_dir, method='planar', max_memory=1024):
+    """Calculates the same dataset as `calculate_shape_length`, but reads
+    shapes.txt in chunks.
+
+    Args:
+        gtfs_dir: the directory where the GTFS file is extracted, or the GTFS
+            zip archive
+        method: either 'planar' or 'haversine', see `calculate_segment_lengths`
+        max_memory: the approximate memory limit in MB
+
+    Returns:
+        pandas.DataFrame: contains the length of each shape in km
+    """
+
+    chunksize = max_memory * 2 ** 20 // SHAPE_ROW_BYTES
+
+    shape_lengths = pd.concat(
+        [
+            sum_segment_lengths(shapes, method)
+            for shapes in iter_complete_shapes(gtfs_dir, chunksize)
+        ],
+        ignore_index=True
+    )
+
+    return shape_lengths \
+        .sort_values('shape_id') \
+        .reset_index(drop=True)
+
+
+@instrument
+def sum_segment_lengths(shapes, method='planar'):
+    """Sums up the segment lengths of each shape.
+
+    Args:
+        shapes: a pandas.DataFrame with the contents of shapes.txt
+        method: either 'planar' or 'haversine', see `calculate_segment_lengths`
+
+    Returns:
+        pandas.DataFrame: contains the length of each shape in km
+    """
+
+    shapes = shapes.sort_values('shape_id', kind='mergesort')
+    segment_lengths = calculate_segment_lengths(shapes, method)
+
+    shape_lengths = pd.Series(segment_lengths, name='distance') \
+        .groupby(shapes.shape_id.values, observed=True) \
+        .sum() \
+        .rename_axis('shape_id') \
+        .reset_index()
 
     return shape_lengths
 
 
+def calculate_segment_lengths(shapes, method='planar'):
+    """Calculates the distance between each point of a shape and the point
+    preceding it. The first point of each shape gets zero length.
+
+    The 'planar' method is the flat-earth approximation used originally, the
+    'haversine' method calculates great-circle distances on a spherical earth.
+
+    Args:
+        shapes: a pandas.DataFrame with the contents of shapes.txt, with the
+            points of each shape in consecutive rows
+        method: either 'planar' or 'haversine'
+
+    Returns:
+        numpy.ndarray: the segment lengths in km
+    """
+
+    lat = shapes.shape_pt_lat.values.astype(np.float64)
+    lon = shapes.shape_pt_lon.values.astype(np.float64)
+    ids = shapes.shape_id.values
+
+    if method == 'planar':
+        x_km = EARTH_CIRCUMFERENCE_KM / 360 * lon * np.cos(lat)
+        y_km = EARTH_CIRCUMFERENCE_KM / 360 * lat
+        segment_lengths = np.sqrt(np.diff(x_km) ** 2 + np.diff(y_km) ** 2)
+    elif method == 'haversine':
+        lat, lon = np.radians(lat), np.radians(lon)
+        hav = np.sin(np.diff(lat) / 2) ** 2 + \
+            np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(lon) / 2) ** 2
+        segment_lengths = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(hav))
+    else:
+        raise ValueError(f"Unknown distance method: {method}")
+
+    segment_lengths[ids[1:] != ids[:-1]] = 0
+    segment_lengths = np.nan_to_num(segment_lengths)
+
+    return np.append(np.zeros(min(len(ids), 1)), segment_lengths)
+
+
+@instrument
+def build_shape_index(gtfs_dir, out, cell_size=INDEX_CELL_SIZE):
+    """Builds a spatial index over the shapes and saves it, see `ShapeIndex`.
+
+    Args:
+        gtfs_dir: the directory where the GTFS file is extracted, or the GTFS
+            zip archive
+        out: the path of the index file to be created
+        cell_size: the size of the grid cells in meters
+
+    Returns:
+        None
+    """
+
+    shapes = read_gtfs_file(gtfs_dir, 'shapes', SHAPE_COLUMNS)
+    ShapeIndex.from_shapes(shapes, cell_size).save(out)
+
+
+def query_shapes(shape_index, bbox=None, point=None, radius=None, shape_data=None):
+    """Finds the shapes passing through a bounding box or near a point.
+
+    Args:
+        shape_index: a ShapeIndex
+        bbox: the minimum latitude, minimum longitude, maximum latitude and
+            maximum longitude of a bounding box
+        point: the latitude and longitude of a point, used with `radius`
+        radius: the distance from `point` in meters
+        shape_data: if given, the shape data is appended to the found shapes
+
+    Returns:
+        pandas.DataFrame: contains the ids of the found shapes, and their
+        shape data if `shape_data` is given
+    """
+
+    if bbox is not None:
+        shape_ids = shape_index.query_bbox(*bbox)
+    elif point is not None and radius is not None:
+        shape_ids = shape_index.query_radius(*point, radius)
+    else:
+        raise ValueError("Either a bounding box or a point and a radius are required")
+
+    shapes = pd.DataFrame({'shape_id': shape_ids})
+    if shape_data is not None:
+        shapes = shapes.merge(shape_data.astype({'shape_id': str}), on='shape_id', how='left')
+
+    return shapes
+
+
 def main():
 
     parser = argparse.ArgumentParser()
     subparsers = parser.add_subparsers(dest='command')
 
     parser_shape = subparsers.add_parser(
-        'shape', help="Create a csv file containing shape info"
+        'shape', help="Create a data file containing shape info"
     )
     parser_shape.add_argument(
         '-g', '--gtfs-dir',
-        help="The directory where the GTFS files are located",
+        help="The directory where the GTFS files are located, or the GTFS zip archive",
         type=str,
         required=True
     )
@@ -233,19 +1102,39 @@ def main():
         type=str,
         required=True
     )
+    parser_shape.add_argument(
+        '--start-date',
+        help="Only count trips from this date on (YYYY-MM-DD)",
+        type=str
+    )
+    parser_shape.add_argument(
+        '--end-date',
+        help="Only count trips up to this date (YYYY-MM-DD)",
+        type=str
+    )
+    parser_shape.add_argument(
+        '--stop-times',
+        help="Add the service hours and headways of each shape from stop_times.txt",
+        action='store_true'
+    )
+    parser_shape.add_argument(
+        '--max-memory',
+        help="Read stop_times.txt in chunks, using about this much memory (in MB)",
+        type=int
+    )
 
     parser_plot = subparsers.add_parser(
-        'plot', help="Create a csv file suitable for line plots"
+        'plot', help="Create a data file suitable for line plots"
     )
     parser_plot.add_argument(
         '-g', '--gtfs-dir',
-        help="The directory where the GTFS files are located",
+        help="The directory where the GTFS files are located, or the GTFS zip archive",
         type=str,
         required=True
     )
     parser_plot.add_argument(
         '-s', '--shape-data',
-        help="The path of the csv file containing shape data",
+        help="The path of the data file containing shape data",
         type=str,
         required=True
     )
@@ -255,13 +1144,23 @@ def main():
         type=str,
         required=True
     )
+    parser_plot.add_argument(
+        '--max-memory',
+        help="Process shapes.txt in chunks, using about this much memory (in MB)",
+        type=int
+    )
+    parser_plot.add_argument(
+        '--simplify-width',
+        help="Simplify the shapes for images of this width (in pixels)",
+        type=int
+    )
 
     distance_plot = subparsers.add_parser(
-        'distance', help="Create a csv file containing shape lengths"
+        'distance', help="Create a data file containing shape lengths"
     )
     distance_plot.add_argument(
         '-g', '--gtfs-dir',
-        help="The directory where the GTFS files are located",
+        help="The directory where the GTFS files are located, or the GTFS zip archive",
         type=str,
         required=True
     )
@@ -271,19 +1170,30 @@ def main():
         type=str,
         required=True
     )
+    distance_plot.add_argument(
+        '-m', '--method',
+        help="The method used to calculate distances between shape points",
+        choices=DISTANCE_METHODS,
+        default='planar'
+    )
+    distance_plot.add_argument(
+        '--max-memory',
+        help="Process shapes.txt in chunks, using about this much memory (in MB)",
+        type=int
+    )
 
     distance_plot = subparsers.add_parser(
-        'regression', help="Create a csv file containing data for regressions"
+        'regression', help="Create a data file containing data for regressions"
     )
     distance_plot.add_argument(
         '-s', '--shape-data',
-        help="The path of the csv file containing shape data",
+        help="The path of the data file containing shape data",
         type=str,
         required=True
     )
     distance_plot.add_argument(
         '-d', '--distance-data',
-        help="The path of the csv file containing distance data",
+        help="The path of the data file containing distance data",
         type=str,
         required=True
     )
@@ -294,21 +1204,246 @@ def main():
         required=True
     )
 
+    parser_segments = subparsers.add_parser(
+        'segments', help="Create a data file containing the segment network"
+    )
+    parser_segments.add_argument(
+        '-g', '--gtfs-dir',
+        help="The directory where the GTFS files are located, or the GTFS zip archive",
+        type=str,
+        required=True
+    )
+    parser_segments.add_argument(
+        '-s', '--shape-data',
+        help="The path of the data file containing shape data",
+        type=str,
+        required=True
+    )
+    parser_segments.add_argument(
+        '-o', '--out',
+        help="The path of the file to be created",
+        type=str,
+        required=True
+    )
+    parser_segments.add_argument(
+        '--plot-out',
+        help="The path of a plot data file of the segments to be created",
+        type=str
+    )
+    parser_segments.add_argument(
+        '--snap-distance',
+        help="Snap shape points to a grid with this spacing (in meters)",
+        type=float,
+        default=5
+    )
+    parser_segments.add_argument(
+        '-m', '--method',
+        help="The method used to calculate distances between shape points",
+        choices=DISTANCE_METHODS,
+        default='planar'
+    )
+    parser_segments.add_argument(
+        '--max-memory',
+        help="Process shapes.txt in chunks, using about this much memory (in MB)",
+        type=int
+    )
+
+    parser_compile = subparsers.add_parser(
+        'compile', help="Create the shape, plot, distance and regression data in one pass"
+    )
+    parser_compile.add_argument(
+        '-g', '--gtfs-dir',
+        help="The directory where the GTFS files are located, or the GTFS zip archive",
+        type=str,
+        required=True
+    )
+    parser_compile.add_argument(
+        '--shape-out',
+        help="The path of the shape data file to be created",
+        type=str,
+        required=True
+    )
+    parser_compile.add_argument(
+        '--plot-out',
+        help="The path of the plot data file to be created",
+        type=str,
+        required=True
+    )
+    parser_compile.add_argument(
+        '--distance-out',
+        help="The path of the distance data file to be created",
+        type=str,
+        required=True
+    )
+    parser_compile.add_argument(
+        '--regression-out',
+        help="The path of the regression data file to be created",
+        type=str,
+        required=True
+    )
+    parser_compile.add_argument(
+        '-m', '--method',
+        help="The method used to calculate distances between shape points",
+        choices=DISTANCE_METHODS,
+        default='planar'
+    )
+    parser_compile.add_argument(
+        '--max-memory',
+        help="Process shapes.txt in chunks, using about this much memory (in MB)",
+        type=int
+    )
+    parser_compile.add_argument(
+        '--start-date',
+        help="Only count trips from this date on (YYYY-MM-DD)",
+        type=str
+    )
+    parser_compile.add_argument(
+        '--end-date',
+        help="Only count trips up to this date (YYYY-MM-DD)",
+        type=str
+    )
+    parser_compile.add_argument(
+        '--simplify-width',
+        help="Simplify the shapes in the plot data for images of this width (in pixels)",
+        type=int
+    )
+    parser_compile.add_argument(
+        '--stop-times',
+        help="Add the service hours and headways of each shape from stop_times.txt",
+        action='store_true'
+    )
+    parser_compile.add_argument(
+        '--shape-cache',
+        help="Cache the results of each shape here and only recompute changed shapes",
+        type=str
+    )
+
+    parser_index = subparsers.add_parser(
+        'index', help="Create a spatial index over the shapes"
+    )
+    parser_index.add_argument(
+        '-g', '--gtfs-dir',
+        help="The directory where the GTFS files are located, or the GTFS zip archive",
+        type=str,
+        required=True
+    )
+    parser_index.add_argument(
+        '-o', '--out',
+        help="The path of the index file to be created",
+        type=str,
+        required=True
+    )
+    parser_index.add_argument(
+        '--cell-size',
+        help="The size of the grid cells in meters",
+        type=float,
+        default=INDEX_CELL_SIZE
+    )
+
+    parser_query = subparsers.add_parser(
+        'query', help="Find the shapes passing through a bounding box or near a point"
+    )
+    parser_query.add_argument(
+        '-i', '--index',
+        help="The path of the spatial index",
+        type=str,
+        required=True
+    )
+    area = parser_query.add_mutually_exclusive_group(required=True)
+    area.add_argument(
+        '--bbox',
+        help="A bounding box (minimum and maximum latitude and longitude)",
+        nargs=4,
+        type=float,
+        metavar=('MIN_LAT', 'MIN_LON', 'MAX_LAT', 'MAX_LON')
+    )
+    area.add_argument(
+        '--point',
+        help="A point, used with --radius",
+        nargs=2,
+        type=float,
+        metavar=('LAT', 'LON')
+    )
+    parser_query.add_argument(
+        '-r', '--radius',
+        help="The distance from --point in meters",
+        type=float,
+        default=300
+    )
+    parser_query.add_argument(
+        '-s', '--shape-data',
+        help="The path of the data file containing shape data, appended to the results",
+        type=str
+    )
+    parser_query.add_argument(
+        '-o', '--out',
+        help="Save the results to this data file instead of printing them",
+        type=str
+    )
+
     args = parser.parse_args()
 
+    # the plot data is written in chunks, which fails for some formats
+    if args.command in ['plot', 'compile'] and args.max_memory is not None:
+        try:
+            check_chunked_format(args.out if args.command == 'plot' else args.plot_out)
+        except ValueError as error:
+            parser.error(str(error))
+
     if args.command == 'shape':
-        shape_data = collect_shape_data(args.gtfs_dir)
-        shape_data.to_csv(args.out, index=False)
+        shape_data = collect_shape_data(
+            args.gtfs_dir, args.start_date, args.end_date, args.stop_times, args.max_memory
+        )
+        write_data(shape_data, args.out)
     elif args.command == 'plot':
-        shape_data = pd.read_csv(args.shape_data)
-        plot_data = generate_plot_data(args.gtfs_dir, shape_data)
-        plot_data.to_csv(args.out, index=False)
+        shape_data = read_data(args.shape_data)
+        if args.max_memory is None:
+            plot_data = generate_plot_data(args.gtfs_dir, shape_data, args.simplify_width)
+            write_data(plot_data, args.out)
+        else:
+            generate_plot_data_chunked(
+                args.gtfs_dir, shape_data, args.out, args.max_memory, args.simplify_width
+            )
     elif args.command == 'distance':
-        distance_data = calculate_shape_length(args.gtfs_dir)
-        distance_data.to_csv(args.out, index=False)
+        if args.max_memory is None:
+            distance_data = calculate_shape_length(args.gtfs_dir, args.method)
+        else:
+            distance_data = calculate_shape_length_chunked(
+                args.gtfs_dir, args.method, args.max_memory
+            )
+        write_data(distance_data, args.out)
     elif args.command == 'regression':
         regression_data = create_regression_data(args.shape_data, args.distance_data)
-        regression_data.to_csv(args.out, index=False)
+        write_data(regression_data, args.out)
+    elif args.command == 'segments':
+        shape_data = read_data(args.shape_data)
+        segment_data = generate_segment_data(
+            args.gtfs_dir, shape_data, args.snap_distance, args.method, args.max_memory
+        )
+        write_data(segment_data, args.out)
+        if args.plot_out is not None:
+            write_data(segment_plot_data(segment_data), args.plot_out)
+    elif args.command == 'compile':
+        compile_datasets(
+            args.gtfs_dir,
+            args.shape_out, args.plot_out, args.distance_out, args.regression_out,
+            args.method, args.max_memory, args.start_date, args.end_date,
+            args.simplify_width, args.shape_cache, args.stop_times
+        )
+    elif args.command == 'index':
+        build_shape_index(args.gtfs_dir, args.out, args.cell_size)
+    elif args.command == 'query':
+        shape_index = ShapeIndex.load(args.index)
+        shape_data = None if args.shape_data is None else read_data(args.shape_data)
+        start = time.perf_counter()
+        shapes = query_shapes(shape_index, args.bbox, args.point, args.radius, shape_data)
+        print(f"Found {len(shapes)} shapes in {1000 * (time.perf_counter() - start):.1f} ms")
+        if 'times_taken' in shapes.columns:
+            print(f"Trips through the area: {shapes.times_taken.sum()}")
+        if args.out is not None:
+            write_data(shapes, args.out)
+        else:
+            print(shapes.to_string(index=False))
 
 
 if __name__ == "__main__":
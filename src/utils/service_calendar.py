@@ -0,0 +1,163 @@
+import numpy as np
+import pandas as pd
+from src.utils.gtfs import WEEKDAYS
+
+
+class ServiceCalendar:
+    """The days on which each service of a GTFS feed operates, stored as a
+    boolean array with one row per service and one column per date. Services
+    may have different validity periods, and exceptions are applied date by
+    date, so the calendar is exact for any feed.
+
+    Args:
+        service_ids: a pandas.Index of the service ids (rows of `active`)
+        first_date: the date of the first column of `active`, a numpy.datetime64
+        active: a 2D boolean numpy.ndarray, True if the service operates on the
+            given date
+    """
+
+    def __init__(self, service_ids, first_date, active):
+        self.service_ids = service_ids
+        self.first_date = np.datetime64(first_date, 'D')
+        self.active = active
+
+    @classmethod
+    def from_gtfs(cls, calendar, calendar_dates):
+        """Creates the calendar from the contents of calendar.txt and
+        calendar_dates.txt.
+
+        Args:
+            calendar: a pandas.DataFrame with the contents of calendar.txt,
+                indexed by service_id
+            calendar_dates: a pandas.DataFrame with the contents of
+                calendar_dates.txt
+
+        Returns:
+            ServiceCalendar: the calendar of all services in either file
+        """
+
+        service_ids = calendar.index.append(pd.Index(calendar_dates.service_id)).unique()
+
+        start_dates = parse_dates(calendar.start_date)
+        end_dates = parse_dates(calendar.end_date)
+        exception_dates = parse_dates(calendar_dates.date)
+
+        all_dates = np.concatenate([start_dates, end_dates, exception_dates])
+        first_date, last_date = all_dates.min(), all_dates.max()
+        num_days = (last_date - first_date).astype(int) + 1
+
+        # regular service: weekday pattern within the validity period
+        days = np.arange(num_days)
+        weekdays = date_weekdays(first_date + days)
+        start_days = (start_dates - first_date).astype(int)
+        end_days = (end_dates - first_date).astype(int)
+        weekly_pattern = calendar.loc[:, WEEKDAYS].values.astype(bool)
+        regular = weekly_pattern[:, weekdays] \
+            & (days >= start_days[:, np.newaxis]) \
+            & (days <= end_days[:, np.newaxis])
+
+        active = np.zeros((len(service_ids), num_days), dtype=bool)
+        active[service_ids.get_indexer(calendar.index)] = regular
+
+        # exceptions: 1 adds a date, 2 removes it
+        rows = service_ids.get_indexer(calendar_dates.service_id)
+        columns = (exception_dates - first_date).astype(int)
+        exception_types = calendar_dates.exception_type.values
+        active[rows[exception_types == 1], columns[exception_types == 1]] = True
+        active[rows[exception_types == 2], columns[exception_types == 2]] = False
+
+        return cls(service_ids, first_date, active)
+
+    def date_columns(self, start_date=None, end_date=None):
+        """Selects the columns of `active` that fall into a date window.
+
+        Args:
+            start_date: the first date of the window (inclusive), the start of
+                the calendar if None
+            end_date: the last date of the window (inclusive), the end of the
+                calendar if None
+
+        Returns:
+            slice: the columns of the window
+        """
+
+        num_days = self.active.shape[1]
+        start = 0 if start_date is None else \
+            (np.datetime64(start_date, 'D') - self.first_date).astype(int)
+        end = num_days if end_date is None else \
+            (np.datetime64(end_date, 'D') - self.first_date).astype(int) + 1
+
+        return slice(int(np.clip(start, 0, num_days)), int(np.clip(end, 0, num_days)))
+
+    def active_days(self, start_date=None, end_date=None):
+        """Counts the days on which each service operates within a window.
+
+        Args:
+            start_date: the first date of the window (inclusive)
+            end_date: the last date of the window (inclusive)
+
+        Returns:
+            pandas.Series: the number of active days by service_id
+        """
+
+        columns = self.date_columns(start_date, end_date)
+
+        return pd.Series(
+            self.active[:, columns].sum(axis=1),
+            index=self.service_ids,
+            name='days'
+        )
+
+    def active_weekdays(self, weekday, start_date=None, end_date=None):
+        """Counts the days falling on a given weekday on which each service
+        operates within a window.
+
+        Args:
+            weekday: the day of the week, either a name from `WEEKDAYS` or an
+                integer (0 is Monday)
+            start_date: the first date of the window (inclusive)
+            end_date: the last date of the window (inclusive)
+
+        Returns:
+            pandas.Series: the number of active days by service_id
+        """
+
+        if isinstance(weekday, str):
+            weekday = WEEKDAYS.index(weekday)
+
+        columns = self.date_columns(start_date, end_date)
+        dates = self.first_date + np.arange(self.active.shape[1])[columns]
+        on_weekday = date_weekdays(dates) == weekday
+
+        return pd.Series(
+            self.active[:, columns][:, on_weekday].sum(axis=1),
+            index=self.service_ids,
+            name='days'
+        )
+
+
+def parse_dates(dates):
+    """Converts GTFS dates (integers of the form YYYYMMDD) to numpy dates.
+
+    Args:
+        dates: a pandas.Series of GTFS dates
+
+    Returns:
+        numpy.ndarray: the dates as numpy.datetime64[D]
+    """
+
+    return pd.to_datetime(dates.astype(str), format='%Y%m%d').values.astype('datetime64[D]')
+
+
+def date_weekdays(dates):
+    """Calculates the day of the week of numpy dates.
+
+    Args:
+        dates: a numpy.ndarray of numpy.datetime64[D]
+
+    Returns:
+        numpy.ndarray: the day of the week (0 is Monday)
+    """
+
+    # 1970-01-01 was a Thursday
+    return (dates.astype('datetime64[D]').astype(int) + 3) % 7
@@ -0,0 +1,265 @@
+import os
+import json
+import time
+import contextlib
+import numpy as np
+import pandas as pd
+from src.utils.data_io import read_data, write_data
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+CACHE_FORMAT_VERSION = 3
+MAX_ENTRY_AGE_DAYS = 90  # entries unused for longer are dropped
+LOCK_FILE = '.lock'
+INDEX_FILE = 'shapes.parquet'
+POINTS_FILE = 'points.parquet'
+SETTINGS_FILE = 'settings.json'
+
+
+def hash_shapes(shapes):
+    """Calculates a content hash of each shape over its point sequence. The
+    hash changes if a point is moved, added, removed or reordered, but not if
+    other shapes change or the shapes are stored in a different order.
+
+    Args:
+        shapes: a pandas.DataFrame with the points of the shapes, sorted by
+            shape_id (keeping the order of the points within each shape)
+
+    Returns:
+        pandas.DataFrame: contains the hash of each shape (as uint64)
+    """
+
+    keys = shapes.shape_id.values
+    group_starts = np.flatnonzero(np.append(True, keys[1:] != keys[:-1]))
+    group_sizes = np.diff(np.append(group_starts, len(keys)))
+    positions = np.arange(len(keys)) - np.repeat(group_starts, group_sizes)
+
+    # the position makes the hash of a point depend on its place in the shape
+    point_hashes = pd.util.hash_pandas_object(
+        pd.DataFrame({
+            'shape_pt_lat': shapes.shape_pt_lat.values,
+            'shape_pt_lon': shapes.shape_pt_lon.values,
+            'position': positions,
+        }),
+        index=False
+    ).values
+
+    return pd.DataFrame({
+        'shape_id': np.asarray(keys[group_starts]).astype(str),
+        'shape_hash': np.add.reduceat(point_hashes, group_starts),
+    })
+
+
+def load_shape_cache(cache_dir, method, tolerance):
+    """Loads the derived data of the shapes of earlier runs with the same
+    settings. The data of each combination of settings is kept in its own
+    subdirectory (see `settings_dir`), so that e.g. simplified points are
+    only reused with exactly the same tolerance. A cache may be shared by
+    several feeds, so a shape id can have several entries with different
+    hashes.
+
+    Args:
+        cache_dir: the directory of the cache
+        method: the method used to calculate the distances
+        tolerance: the tolerance used to simplify the shapes, or None
+
+    Returns:
+        Tuple[pandas.DataFrame, pandas.DataFrame]: the hash and distance of each
+        cached shape, and the points of the plotted shapes (with the hash of
+        their shape); both are empty if there is no usable cache
+    """
+
+    directory = settings_dir(cache_dir, method, tolerance)
+    with cache_lock(directory, exclusive=False):
+        cached = read_entries(directory, method, tolerance)
+
+    if cached is None:
+        if os.path.isdir(cache_dir) and os.listdir(cache_dir):
+            print(
+                f"The shape cache in {cache_dir} has no entries for the method {method} and "
+                f"the tolerance {tolerance}, all shapes are computed"
+            )
+        return empty_entries()
+
+    return cached
+
+
+def save_shape_cache(cache_dir, shape_index, points, method, tolerance):
+    """Adds the derived data of the shapes of a run to the cache. Entries of
+    other shapes (e.g. of other feeds sharing the cache) are kept, unless they
+    have not been used for `MAX_ENTRY_AGE_DAYS`. The cache is locked while it
+    is updated, so several processes can share it. The settings are written
+    last, so an interrupted run leaves no usable but broken cache behind.
+
+    Args:
+        cache_dir: the directory of the cache
+        shape_index: a pandas.DataFrame with the hash and distance of each
+            shape of the run
+        points: a pandas.DataFrame with the points of the plotted shapes of
+            the run, with the hash of their shape
+        method: the method used to calculate the distances
+        tolerance: the tolerance used to simplify the shapes, or None
+
+    Returns:
+        None
+    """
+
+    directory = settings_dir(cache_dir, method, tolerance)
+    os.makedirs(directory, exist_ok=True)
+
+    with cache_lock(directory, exclusive=True):
+        cached_index, cached_points = read_entries(directory, method, tolerance) \
+            or empty_entries()
+
+        now = time.time()
+        shape_index = shape_index.assign(last_used=now)
+        kept_index = cached_index[
+            ~entry_keys(cached_index).isin(entry_keys(shape_index))
+            & (cached_index.last_used.values >= now - MAX_ENTRY_AGE_DAYS * 86400)
+        ]
+        shape_index = pd.concat([kept_index, shape_index], ignore_index=True)
+        points = pd.concat(
+            [cached_points[entry_keys(cached_points).isin(entry_keys(kept_index))], points],
+            ignore_index=True
+        )
+
+        settings_file = os.path.join(directory, SETTINGS_FILE)
+        if os.path.exists(settings_file):
+            os.remove(settings_file)
+
+        write_data(shape_index, os.path.join(directory, INDEX_FILE))
+        write_data(points, os.path.join(directory, POINTS_FILE))
+
+        with open(settings_file, 'w') as file:
+            json.dump(cache_settings(method, tolerance), file)
+
+
+def read_entries(directory, method, tolerance):
+    """Reads the cached data of a combination of settings, see
+    `load_shape_cache`. The cache must be locked by the caller.
+
+    Args:
+        directory: the subdirectory of the settings, see `settings_dir`
+        method: the method used to calculate the distances
+        tolerance: the tolerance used to simplify the shapes, or None
+
+    Returns:
+        Tuple[pandas.DataFrame, pandas.DataFrame]: the cached shapes and
+        points, or None if there is no usable cache
+    """
+
+    settings_file = os.path.join(directory, SETTINGS_FILE)
+    if not os.path.exists(settings_file):
+        return None
+    with open(settings_file, 'r') as file:
+        if json.load(file) != cache_settings(method, tolerance):
+            return None
+
+    return (
+        read_data(os.path.join(directory, INDEX_FILE)).astype({'shape_id': str}),
+        read_data(os.path.join(directory, POINTS_FILE)).astype({'shape_id': str})
+    )
+
+
+def empty_entries():
+    """An empty cache, see `load_shape_cache`.
+
+    Returns:
+        Tuple[pandas.DataFrame, pandas.DataFrame]: no shapes and no points
+    """
+
+    return (
+        pd.DataFrame({
+            'shape_id': pd.Series([], dtype=str),
+            'shape_hash': pd.Series([], dtype=np.uint64),
+            'distance': pd.Series([], dtype=float),
+            'last_used': pd.Series([], dtype=float),
+        }),
+        pd.DataFrame({
+            'shape_id': pd.Series([], dtype=str),
+            'shape_hash': pd.Series([], dtype=np.uint64),
+            'shape_pt_lat': pd.Series([], dtype=float),
+            'shape_pt_lon': pd.Series([], dtype=float),
+        })
+    )
+
+
+def entry_keys(df):
+    """The keys identifying cache entries, the shape id and its hash.
+
+    Args:
+        df: a pandas.DataFrame with shape_id and shape_hash columns
+
+    Returns:
+        pandas.MultiIndex: the key of each row
+    """
+
+    return pd.MultiIndex.from_arrays([
+        np.asarray(df.shape_id).astype(str), np.asarray(df.shape_hash, dtype=np.uint64)
+    ])
+
+
+@contextlib.contextmanager
+def cache_lock(directory, exclusive):
+    """Locks a directory of the cache against concurrent updates by other
+    processes. Without `fcntl` (on Windows), nothing is locked.
+
+    Args:
+        directory: the directory to lock
+        exclusive: if True, an exclusive lock for writing, otherwise a shared
+            lock for reading
+
+    Yields:
+        None
+    """
+
+    if fcntl is None or not os.path.isdir(directory):
+        yield
+        return
+
+    with open(os.path.join(directory, LOCK_FILE), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def settings_dir(cache_dir, method, tolerance):
+    """The subdirectory of the cache holding the data created with the given
+    settings. Its name contains the exact tolerance, so a tolerance derived
+    from a changed extent of the data uses a new subdirectory.
+
+    Args:
+        cache_dir: the directory of the cache
+        method: the method used to calculate the distances
+        tolerance: the tolerance used to simplify the shapes, or None
+
+    Returns:
+        str: the path of the subdirectory
+    """
+
+    simplification = 'full' if tolerance is None else f"tolerance-{float(tolerance)!r}"
+
+    return os.path.join(cache_dir, f"{method}-{simplification}")
+
+
+def cache_settings(method, tolerance):
+    """The settings the cached data depends on.
+
+    Args:
+        method: the method used to calculate the distances
+        tolerance: the tolerance used to simplify the shapes, or None
+
+    Returns:
+        dict: the settings
+    """
+
+    return {
+        "format_version": CACHE_FORMAT_VERSION,
+        "method": method,
+        "tolerance": None if tolerance is None else float(tolerance),
+    }
@@ -0,0 +1,121 @@
+import numpy as np
+
+SIMPLIFY_TOLERANCE_PIXELS = 0.5
+
+
+def pixel_tolerance(x_range, width, pixels=SIMPLIFY_TOLERANCE_PIXELS):
+    """Converts a tolerance in pixels to coordinate units. The figures keep
+    the aspect ratio of the coordinates, so pixels have the same size in both
+    directions.
+
+    Args:
+        x_range: the range of x coordinates covered by the image
+        width: the width of the image in pixels
+        pixels: the tolerance in pixels
+
+    Returns:
+        float: the tolerance in coordinate units
+    """
+
+    return pixels * (x_range[1] - x_range[0]) / width
+
+
+def simplify_shapes(shapes, tolerance, by='shape_id', x='shape_pt_lon', y='shape_pt_lat'):
+    """Simplifies the polylines of all shapes at once using the
+    Douglas-Peucker algorithm. Each iteration splits all segments of all shapes
+    whose farthest point deviates more than `tolerance` from the segment, so
+    the number of iterations only depends on the depth of the recursion. The
+    first and last point of each shape are always kept, as are the points
+    defining the extent of the data.
+
+    Args:
+        shapes: a pandas.DataFrame with the points of the shapes, the points of
+            each shape in consecutive rows
+        tolerance: the maximum distance of a removed point from the simplified
+            line, in coordinate units
+        by: the column identifying the shapes
+        x: the column containing the x coordinates
+        y: the column containing the y coordinates
+
+    Returns:
+        pandas.DataFrame: the rows of `shapes` that are kept
+    """
+
+    if shapes.empty:
+        return shapes
+
+    keys = shapes[by].values
+    xs = shapes[x].values.astype(np.float64)
+    ys = shapes[y].values.astype(np.float64)
+
+    group_starts = np.flatnonzero(np.append(True, keys[1:] != keys[:-1]))
+    group_ends = np.append(group_starts[1:], len(keys)) - 1
+
+    keep = np.zeros(len(keys), dtype=bool)
+    keep[group_starts] = True
+    keep[group_ends] = True
+    keep[[np.nanargmin(xs), np.nanargmax(xs), np.nanargmin(ys), np.nanargmax(ys)]] = True
+
+    segment_starts, segment_ends = group_starts, group_ends
+    while True:
+        has_interior = segment_ends - segment_starts > 1
+        segment_starts = segment_starts[has_interior]
+        segment_ends = segment_ends[has_interior]
+        if len(segment_starts) == 0:
+            break
+
+        # the interior points of all segments, segment by segment
+        num_interior = segment_ends - segment_starts - 1
+        segments = np.repeat(np.arange(len(segment_starts)), num_interior)
+        offsets = np.cumsum(num_interior) - num_interior
+        points = segment_starts[segments] + 1 + np.arange(len(segments)) - offsets[segments]
+
+        distances = segment_distances(
+            xs[points], ys[points],
+            xs[segment_starts][segments], ys[segment_starts][segments],
+            xs[segment_ends][segments], ys[segment_ends][segments]
+        )
+
+        # the first point with the largest distance in each segment
+        max_distances = np.maximum.reduceat(distances, offsets)
+        is_farthest = np.flatnonzero(distances == max_distances[segments])
+        is_first = np.append(True, segments[is_farthest][1:] != segments[is_farthest][:-1])
+        farthest = points[is_farthest[is_first]]
+
+        split = max_distances > tolerance
+        keep[farthest[split]] = True
+
+        segment_starts, segment_ends = \
+            np.concatenate([segment_starts[split], farthest[split]]), \
+            np.concatenate([farthest[split], segment_ends[split]])
+
+    return shapes[keep]
+
+
+def segment_distances(px, py, x0, y0, x1, y1):
+    """Calculates the distances of points from line segments.
+
+    Args:
+        px: the x coordinates of the points
+        py: the y coordinates of the points
+        x0: the x coordinates of the starts of the segments
+        y0: the y coordinates of the starts of the segments
+        x1: the x coordinates of the ends of the segments
+        y1: the y coordinates of the ends of the segments
+
+    Returns:
+        numpy.ndarray: the distance of each point from its segment
+    """
+
+    dx = x1 - x0
+    dy = y1 - y0
+    squared_lengths = dx ** 2 + dy ** 2
+
+    # the position of the closest point on the segment (0 is the start)
+    projections = np.divide(
+        (px - x0) * dx + (py - y0) * dy, squared_lengths,
+        out=np.zeros_like(squared_lengths), where=squared_lengths > 0
+    )
+    projections = np.clip(projections, 0, 1)
+
+    return np.hypot(px - x0 - projections * dx, py - y0 - projections * dy)
@@ -0,0 +1,291 @@
+import numpy as np
+from src.utils.simplify import segment_distances
+
+METERS_PER_DEGREE = 40075000 / 360
+INDEX_CELL_SIZE = 250  # default size of the grid cells in meters
+INDEX_FORMAT_VERSION = 3
+
+
+class ShapeIndex:
+    """A grid index over the segments of all shapes, answering which shapes
+    pass through a bounding box or near a point without scanning all points.
+
+    The coordinates are projected to meters on a plane touching the earth at
+    the mean latitude of the shapes, which is accurate at the scale of a city
+    network. Each segment (two consecutive points of a shape) is registered in
+    the grid cells it passes through: it is split into pieces no longer than a
+    cell, and each piece is registered in the (at most 2 x 2) cells covered by
+    its bounding box. The registrations are sorted by cell, so the
+    registrations of a row of cells form a contiguous slice. Queries look up
+    the cells covering the query area, and then test the segments registered
+    there exactly. A long segment only adds registrations along its path, and
+    does not widen other queries.
+
+    Args:
+        shape_ids: a numpy.ndarray of the shape ids
+        shape_codes: the position in `shape_ids` of the shape of each segment
+        segments: a 2D numpy.ndarray with the projected x and y coordinates of
+            the start and end of each segment (columns x0, y0, x1, y1)
+        cells: the sorted cell numbers of the registrations
+        entries: the segment of each registration
+        grid: a dict with the parameters of the grid (`cell_size`, `lat0`,
+            `origin_x`, `origin_y`, `num_columns` and `num_rows`)
+    """
+
+    def __init__(self, shape_ids, shape_codes, segments, cells, entries, grid):
+        self.shape_ids = shape_ids
+        self.shape_codes = shape_codes
+        self.segments = segments
+        self.cells = cells
+        self.entries = entries
+        self.grid = grid
+
+    @classmethod
+    def from_shapes(cls, shapes, cell_size=INDEX_CELL_SIZE):
+        """Builds the index from the points of the shapes.
+
+        Args:
+            shapes: a pandas.DataFrame with the points of the shapes
+            cell_size: the size of the grid cells in meters
+
+        Returns:
+            ShapeIndex: the index of all shapes
+        """
+
+        shapes = shapes[shapes.shape_pt_lat.notna() & shapes.shape_pt_lon.notna()] \
+            .sort_values('shape_id', kind='mergesort')
+        shape_ids, shape_codes = np.unique(
+            np.asarray(shapes.shape_id).astype(str), return_inverse=True
+        )
+        lat0 = float(shapes.shape_pt_lat.mean()) if len(shapes) else 0.0
+        x, y = project(shapes.shape_pt_lat.values, shapes.shape_pt_lon.values, lat0)
+
+        # each point starts a segment to the next point of its shape, the last
+        # point of a shape a segment of zero length
+        is_last = np.append(shape_codes[1:] != shape_codes[:-1], True)
+        next_point = np.arange(len(x)) + ~is_last
+        segments = np.column_stack([x, y, x[next_point], y[next_point]])
+
+        # long segments are split into pieces no longer than a cell, so the
+        # bounding box of a piece only covers cells close to the segment
+        lengths = np.hypot(segments[:, 2] - segments[:, 0], segments[:, 3] - segments[:, 1])
+        num_pieces = np.maximum(np.ceil(lengths / cell_size), 1).astype(np.int64)
+        pieces = np.repeat(np.arange(len(x)), num_pieces)
+        piece_numbers = np.arange(len(pieces)) \
+            - np.repeat(np.cumsum(num_pieces) - num_pieces, num_pieces)
+        t0 = (piece_numbers / num_pieces[pieces])[:, None]
+        t1 = ((piece_numbers + 1) / num_pieces[pieces])[:, None]
+        starts = segments[pieces, :2] * (1 - t0) + segments[pieces, 2:] * t0
+        ends = segments[pieces, :2] * (1 - t1) + segments[pieces, 2:] * t1
+
+        # the range of cells covered by the bounding box of each piece
+        first_column, first_row = np.floor(np.minimum(starts, ends) / cell_size) \
+            .astype(np.int64).T
+        last_column, last_row = np.floor(np.maximum(starts, ends) / cell_size) \
+            .astype(np.int64).T
+        origin_x, origin_y = (first_column.min(), first_row.min()) if len(x) else (0, 0)
+        num_columns = int(last_column.max() - origin_x + 1) if len(x) else 1
+        num_rows = int(last_row.max() - origin_y + 1) if len(x) else 1
+
+        # one registration for each covered cell: its offset within the
+        # bounding box of the piece gives its column and row
+        box_columns = last_column - first_column + 1
+        box_sizes = box_columns * (last_row - first_row + 1)
+        piece_entries = np.repeat(np.arange(len(pieces)), box_sizes)
+        offsets = np.arange(len(piece_entries)) \
+            - np.repeat(np.cumsum(box_sizes) - box_sizes, box_sizes)
+        columns = first_column[piece_entries] + offsets % box_columns[piece_entries] - origin_x
+        rows = first_row[piece_entries] + offsets // box_columns[piece_entries] - origin_y
+
+        # neighbouring pieces of a segment share cells, which are registered
+        # once; sorting the registrations sorts them by cell
+        registrations = np.unique(
+            (rows * num_columns + columns) * max(len(x), 1) + pieces[piece_entries]
+        )
+        cells, entries = np.divmod(registrations, max(len(x), 1))
+
+        grid = {
+            'cell_size': float(cell_size),
+            'lat0': lat0,
+            'origin_x': int(origin_x),
+            'origin_y': int(origin_y),
+            'num_columns': num_columns,
+            'num_rows': num_rows,
+        }
+
+        return cls(shape_ids, shape_codes, segments, cells, entries, grid)
+
+    def save(self, path):
+        """Saves the index as a numpy archive.
+
+        Args:
+            path: the path of the file to be created
+
+        Returns:
+            None
+        """
+
+        with open(path, 'wb') as file:
+            np.savez(
+                file,
+                format_version=INDEX_FORMAT_VERSION,
+                shape_ids=self.shape_ids,
+                shape_codes=self.shape_codes,
+                segments=self.segments,
+                cells=self.cells,
+                entries=self.entries,
+                **{f"grid_{name}": value for name, value in self.grid.items()}
+            )
+
+    @classmethod
+    def load(cls, path):
+        """Loads an index saved by `save`.
+
+        Args:
+            path: the path of the index
+
+        Returns:
+            ShapeIndex: the index
+        """
+
+        with np.load(path) as saved:
+            version = saved['format_version'] if 'format_version' in saved.files else None
+            if version != INDEX_FORMAT_VERSION:
+                raise ValueError(f"Unsupported index format in {path}, please build it again")
+            grid = {
+                name[len('grid_'):]: saved[name].item()
+                for name in saved.files if name.startswith('grid_')
+            }
+            return cls(
+                saved['shape_ids'], saved['shape_codes'], saved['segments'],
+                saved['cells'], saved['entries'], grid
+            )
+
+    def query_bbox(self, min_lat, min_lon, max_lat, max_lon):
+        """Finds the shapes passing through a bounding box.
+
+        Args:
+            min_lat: the southern edge of the box
+            min_lon: the western edge of the box
+            max_lat: the northern edge of the box
+            max_lon: the eastern edge of the box
+
+        Returns:
+            numpy.ndarray: the ids of the shapes, sorted
+        """
+
+        (x_min, x_max), (y_min, y_max) = project(
+            np.array([min_lat, max_lat]), np.array([min_lon, max_lon]), self.grid['lat0']
+        )
+        candidates = self.candidates(x_min, y_min, x_max, y_max)
+        segments = self.segments[candidates]
+        hits = segments_intersect_box(*segments.T, x_min, y_min, x_max, y_max)
+
+        return self.shape_ids[np.unique(self.shape_codes[candidates[hits]])]
+
+    def query_radius(self, lat, lon, radius):
+        """Finds the shapes passing within a distance of a point.
+
+        Args:
+            lat: the latitude of the point
+            lon: the longitude of the point
+            radius: the distance in meters
+
+        Returns:
+            numpy.ndarray: the ids of the shapes, sorted
+        """
+
+        x, y = project(np.array([lat]), np.array([lon]), self.grid['lat0'])
+        candidates = self.candidates(x[0] - radius, y[0] - radius, x[0] + radius, y[0] + radius)
+        segments = self.segments[candidates]
+        hits = segment_distances(x[0], y[0], *segments.T) <= radius
+
+        return self.shape_ids[np.unique(self.shape_codes[candidates[hits]])]
+
+    def candidates(self, x_min, y_min, x_max, y_max):
+        """Finds the segments that may intersect a rectangle, i.e. that are
+        registered in a cell overlapping it.
+
+        Args:
+            x_min: the left edge of the rectangle in projected meters
+            y_min: the bottom edge of the rectangle in projected meters
+            x_max: the right edge of the rectangle in projected meters
+            y_max: the top edge of the rectangle in projected meters
+
+        Returns:
+            numpy.ndarray: the positions of the candidate segments, sorted
+        """
+
+        grid = self.grid
+        first_column, last_column = np.clip(
+            np.floor(np.array([x_min, x_max]) / grid['cell_size']) - grid['origin_x'],
+            0, grid['num_columns'] - 1
+        ).astype(np.int64)
+        first_row, last_row = np.clip(
+            np.floor(np.array([y_min, y_max]) / grid['cell_size']) - grid['origin_y'],
+            0, grid['num_rows'] - 1
+        ).astype(np.int64)
+
+        rows = np.arange(first_row, last_row + 1)
+        starts = np.searchsorted(self.cells, rows * grid['num_columns'] + first_column, side='left')
+        ends = np.searchsorted(self.cells, rows * grid['num_columns'] + last_column, side='right')
+
+        # a segment covering several of the cells is registered in each
+        return np.unique(np.concatenate(
+            [self.entries[start:end] for start, end in zip(starts, ends)]
+            or [np.array([], dtype=int)]
+        ))
+
+
+def project(lat, lon, lat0):
+    """Projects coordinates to meters on a plane touching the earth at a
+    given latitude (equirectangular projection).
+
+    Args:
+        lat: a numpy.ndarray of latitudes
+        lon: a numpy.ndarray of longitudes
+        lat0: the latitude where the scale is exact
+
+    Returns:
+        Tuple[numpy.ndarray, numpy.ndarray]: the x and y coordinates in meters
+    """
+
+    x = lon.astype(np.float64) * METERS_PER_DEGREE * np.cos(np.radians(lat0))
+    y = lat.astype(np.float64) * METERS_PER_DEGREE
+
+    return x, y
+
+
+def segments_intersect_box(x0, y0, x1, y1, x_min, y_min, x_max, y_max):
+    """Checks which line segments intersect a rectangle, by clipping them to
+    the rectangle (Liang-Barsky).
+
+    Args:
+        x0: the x coordinates of the starts of the segments
+        y0: the y coordinates of the starts of the segments
+        x1: the x coordinates of the ends of the segments
+        y1: the y coordinates of the ends of the segments
+        x_min: the left edge of the rectangle
+        y_min: the bottom edge of the rectangle
+        x_max: the right edge of the rectangle
+        y_max: the top edge of the rectangle
+
+    Returns:
+        numpy.ndarray: True for the segments intersecting the rectangle
+    """
+
+    dx = x1 - x0
+    dy = y1 - y0
+    t_start = np.zeros(len(x0))
+    t_end = np.ones(len(x0))
+    intersects = np.ones(len(x0), dtype=bool)
+
+    # the segment is inside the edge where p * t <= q
+    for p, q in [(-dx, x0 - x_min), (dx, x_max - x0), (-dy, y0 - y_min), (dy, y_max - y0)]:
+        intersects &= (p != 0) | (q >= 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = q / p
+        t_start = np.where(p < 0, np.maximum(t_start, t), t_start)
+        t_end = np.where(p > 0, np.minimum(t_end, t), t_end)
+
+    return intersects & (t_start <= t_end)
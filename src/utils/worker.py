@@ -0,0 +1,328 @@
+import os
+import sys
+import glob
+import runpy
+import signal
+import secrets
+import argparse
+import tempfile
+import importlib
+import traceback
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+WORKER_ADDRESS = '.cache/worker.sock'
+SOURCE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKER_MODULES = [
+    'src.utils.obtain_data',
+    'src.utils.reshape_data',
+    'src.utils.build_panel',
+    'src.models.estimate_model',
+    'src.figures.plot_fire',
+    'src.figures.plot_colored',
+    'src.figures.render_figures',
+    'src.figures.export_tiles',
+    'src.tables.table_longest_routes',
+    'src.tables.table_vehicle_distribution',
+    'src.tables.table_regressions',
+]
+
+
+def serve(address=WORKER_ADDRESS, warm_up=True):
+    """Runs a fork server executing the scripts of the pipeline. The scripts
+    (`WORKER_MODULES`) and the libraries they use are imported once, and the
+    numba functions of the figures are compiled once, before any request is
+    served. Each request is then run in a forked child process, which starts
+    with all of this already in memory and is isolated from other requests.
+
+    As the scripts are only imported once, the server restarts itself when a
+    source file of the pipeline changes. The request that noticed the change
+    is refused, so the client runs it itself with the new code.
+
+    The server listens on a Unix socket, and only accepts clients that know
+    the key stored next to it (readable only by the current user). Fork
+    servers are not available on Windows.
+
+    Args:
+        address: the path of the socket
+        warm_up: if True, the figures are rendered once on a tiny dataset, so
+            that their numba functions are compiled before forking
+
+    Returns:
+        None
+    """
+
+    if not hasattr(os, 'fork'):
+        raise OSError("The worker needs os.fork, which is not available on this platform")
+
+    sources = source_mtimes()
+    for module in WORKER_MODULES:
+        importlib.import_module(module)
+    if warm_up:
+        compile_figures()
+
+    directory = os.path.dirname(address)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if os.path.exists(address):
+        os.remove(address)
+
+    authkey = secrets.token_bytes(32)
+    key_file = address + '.key'
+    with open(os.open(key_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as file:
+        file.write(authkey)
+
+    # finished children are reaped automatically
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+
+    restart = False
+    with Listener(address, family='AF_UNIX', authkey=authkey) as listener:
+        print(f"Worker listening on {address}", flush=True)
+        try:
+            while True:
+                try:
+                    connection = listener.accept()
+                    request = connection.recv()
+                except (OSError, EOFError, AuthenticationError):
+                    # e.g. a client with the wrong key, or one that left
+                    continue
+                if request.get('stop'):
+                    connection.send({'returncode': 0, 'output': "Worker stopped\n"})
+                    connection.close()
+                    break
+                if source_mtimes() != sources:
+                    connection.send({'stale': True})
+                    connection.close()
+                    restart = True
+                    break
+                if os.fork() == 0:
+                    listener.close()
+                    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                    try:
+                        connection.send(handle_request(request))
+                    finally:
+                        os._exit(0)
+                connection.close()
+        finally:
+            # the listener removes its socket itself
+            if os.path.exists(key_file):
+                os.remove(key_file)
+
+    if restart:
+        print("The source files changed, restarting the worker", flush=True)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        args = [sys.executable, '-m', 'src.utils.worker', '--address', address, 'serve']
+        os.execv(sys.executable, args + ([] if warm_up else ['--no-warm-up']))
+
+
+def source_mtimes():
+    """Finds the modification times of the source files of the pipeline.
+
+    Returns:
+        dict: the modification time of each Python file in `src`
+    """
+
+    return {
+        path: os.stat(path).st_mtime_ns
+        for path in glob.glob(os.path.join(SOURCE_DIR, '**', '*.py'), recursive=True)
+    }
+
+
+def handle_request(request):
+    """Runs the `main()` of a script with the working directory, environment
+    and arguments of the client, capturing its output. Called in a forked
+    child of the server.
+
+    Args:
+        request: a dict with the `module` to run, its `args`, and the `cwd`
+            and `env` of the client
+
+    Returns:
+        dict: the `returncode` and the combined `output` of the script
+    """
+
+    with tempfile.TemporaryFile('w+b') as output:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(output.fileno(), 1)
+        os.dup2(output.fileno(), 2)
+
+        returncode = run_module(request['module'], request['args'], request['cwd'], request['env'])
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+        output.seek(0)
+        return {'returncode': returncode, 'output': output.read().decode(errors='replace')}
+
+
+def run_module(module, args, cwd=None, env=None):
+    """Runs the `main()` of a script as if it was called with
+    `python -m <module> <args>`.
+
+    Args:
+        module: the name of the module, one of `WORKER_MODULES`
+        args: the command line arguments
+        cwd: if given, the working directory
+        env: if given, the environment variables
+
+    Returns:
+        int: the exit code
+    """
+
+    if module not in WORKER_MODULES:
+        print(f"Unknown module: {module}", file=sys.stderr)
+        return 2
+
+    if cwd is not None:
+        os.chdir(cwd)
+    if env is not None:
+        os.environ.clear()
+        os.environ.update(env)
+    sys.argv = [module, *args]
+
+    try:
+        importlib.import_module(module).main()
+    except SystemExit as exit:
+        if exit.code is None or isinstance(exit.code, int):
+            return exit.code or 0
+        print(exit.code, file=sys.stderr)
+        return 1
+    except Exception:
+        traceback.print_exc()
+        return 1
+
+    return 0
+
+
+def compile_figures():
+    """Renders the figures on a tiny dataset, with the coordinate dtypes of
+    both the csv and the columnar data formats, so that the numba functions
+    used by datashader are compiled.
+
+    Returns:
+        None
+    """
+
+    import numpy as np
+    import pandas as pd
+    import datashader as ds
+    from src.figures import plot_colored, plot_fire
+
+    # the ranges must be floats, as in the figures, or other code is compiled
+    cvs = ds.Canvas(plot_width=4, plot_height=4, x_range=(0.0, 1.0), y_range=(0.0, 1.0))
+    for dtype in [np.float32, np.float64]:
+        plot_data = pd.DataFrame({
+            'shape_pt_lon': np.array([0, 1, np.nan], dtype=dtype),
+            'shape_pt_lat': np.array([0, 1, np.nan], dtype=dtype),
+            'times_taken': np.array([1, 1, 1]),
+            'route_color': pd.Categorical(['000000'] * 3),
+        })
+        plot_fire.shade(plot_fire.aggregate(cvs, plot_data))
+        for mode in plot_colored.RENDER_MODES:
+            plot_colored.shade(plot_colored.aggregate(cvs, plot_data, mode))
+
+
+def request(address, message):
+    """Sends a request to a running worker.
+
+    Args:
+        address: the path of the socket of the worker
+        message: the request, see `handle_request`
+
+    Returns:
+        dict: the response, or None if no worker is running at `address` or
+        the worker refused the request because its code is outdated
+    """
+
+    try:
+        with open(address + '.key', 'rb') as file:
+            authkey = file.read()
+        connection = Client(address, family='AF_UNIX', authkey=authkey)
+    except (OSError, AuthenticationError):
+        return None
+
+    with connection:
+        connection.send(message)
+        response = connection.recv()
+
+    return None if response.get('stale') else response
+
+
+def run(module, args, address=WORKER_ADDRESS):
+    """Runs a script in the worker, or in this process if no worker is
+    running or its code is outdated. Scripts are also run in this process if instrumentation is
+    requested, as the worker imported them without it.
+
+    Args:
+        module: the name of the module, one of `WORKER_MODULES`
+        args: the command line arguments
+        address: the path of the socket of the worker
+
+    Returns:
+        int: the exit code
+    """
+
+    response = None
+    if not os.environ.get('PIPELINE_PROFILE'):
+        response = request(address, {
+            'module': module, 'args': args, 'cwd': os.getcwd(), 'env': dict(os.environ)
+        })
+
+    if response is None:
+        sys.argv = [module, *args]
+        runpy.run_module(module, run_name='__main__', alter_sys=True)
+        return 0
+
+    sys.stdout.write(response['output'])
+    return response['returncode']
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-a', '--address',
+        help="The path of the socket of the worker",
+        type=str,
+        default=WORKER_ADDRESS
+    )
+    subparsers = parser.add_subparsers(dest='command')
+
+    parser_serve = subparsers.add_parser(
+        'serve', help="Start a worker that keeps the libraries loaded"
+    )
+    parser_serve.add_argument(
+        '--no-warm-up',
+        help="Do not compile the numba functions of the figures at startup",
+        action='store_true'
+    )
+
+    parser_run = subparsers.add_parser(
+        'run', help="Run a script in the worker (or here if no worker is running)"
+    )
+    parser_run.add_argument(
+        'module',
+        help="The module of the script, e.g. src.utils.reshape_data",
+        choices=WORKER_MODULES
+    )
+    parser_run.add_argument(
+        'args',
+        help="The arguments of the script",
+        nargs=argparse.REMAINDER
+    )
+
+    subparsers.add_parser('stop', help="Stop the running worker")
+
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        serve(args.address, not args.no_warm_up)
+    elif args.command == 'run':
+        raise SystemExit(run(args.module, args.args, args.address))
+    elif args.command == 'stop':
+        response = request(args.address, {'stop': True})
+        print("No worker is running" if response is None else response['output'], end='')
+
+
+if __name__ == "__main__":
+    main()
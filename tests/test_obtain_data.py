@@ -0,0 +1,152 @@
+import os
+import hashlib
+import threading
+import http.server
+import pytest
+import requests
+import urllib3
+from src.utils.obtain_data import download_cached
+
+CONTENT = bytes(range(256)) * 64
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    """Serves `server.content` like a file server with ETag and range support.
+    If `server.truncate` is set, the next response is cut off halfway."""
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        etag = f'"{server.version}"' if server.validators else None
+
+        if etag is not None and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        body = server.content
+        byte_range = self.headers.get('Range')
+        if byte_range is not None and self.headers.get('If-Range', etag) == etag:
+            start = int(byte_range[len('bytes='):].rstrip('-'))
+            self.send_response(206)
+            self.send_header('Content-Range', f"bytes {start}-{len(body) - 1}/{len(body)}")
+            body = body[start:]
+        else:
+            self.send_response(200)
+
+        self.send_header('Content-Length', str(len(body)))
+        if etag is not None:
+            self.send_header('ETag', etag)
+        self.end_headers()
+
+        if server.truncate:
+            server.truncate = False
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+        else:
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    server.content = CONTENT
+    server.version = 1
+    server.validators = True
+    server.truncate = False
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def url_of(server):
+    return f"http://127.0.0.1:{server.server_address[1]}/feed.zip"
+
+
+def read(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+def download_truncated(server, cache_dir):
+    server.truncate = True
+    with pytest.raises((IOError, requests.RequestException, urllib3.exceptions.HTTPError)):
+        download_cached(url_of(server), cache_dir)
+
+
+def test_unchanged_file_is_not_downloaded_again(server, tmp_path):
+    cached_file = download_cached(url_of(server), str(tmp_path))
+    assert read(cached_file) == CONTENT
+
+    assert download_cached(url_of(server), str(tmp_path)) == cached_file
+    assert server.requests[-1].get('If-None-Match') == '"1"'
+    assert read(cached_file) == CONTENT
+
+
+def test_truncated_download_is_resumed(server, tmp_path):
+    download_truncated(server, str(tmp_path))
+    # only the partial download is kept, nothing is cached
+    assert all(name.endswith(('.part', '.part.json')) for name in os.listdir(tmp_path))
+
+    cached_file = download_cached(url_of(server), str(tmp_path))
+    assert 'Range' in server.requests[-1]
+    assert read(cached_file) == CONTENT
+
+
+def test_changed_file_is_not_spliced(server, tmp_path):
+    download_truncated(server, str(tmp_path))
+    server.content = CONTENT[::-1]
+    server.version = 2
+
+    cached_file = download_cached(url_of(server), str(tmp_path))
+    assert read(cached_file) == CONTENT[::-1]
+
+
+def test_download_without_validators_restarts(server, tmp_path):
+    server.validators = False
+    download_truncated(server, str(tmp_path))
+    server.content = CONTENT[::-1]
+
+    cached_file = download_cached(url_of(server), str(tmp_path))
+    assert 'Range' not in server.requests[-1]
+    assert read(cached_file) == CONTENT[::-1]
+
+
+def test_corrupt_cached_copy_is_downloaded_again(server, tmp_path):
+    cached_file = download_cached(url_of(server), str(tmp_path))
+    with open(cached_file, 'wb') as file:
+        file.write(b'corrupt')
+
+    assert download_cached(url_of(server), str(tmp_path)) == cached_file
+    assert 'If-None-Match' not in server.requests[-1]
+    assert read(cached_file) == CONTENT
+
+
+def test_checksum_mismatch_is_not_cached(server, tmp_path):
+    with pytest.raises(ValueError):
+        download_cached(url_of(server), str(tmp_path), sha256=hashlib.sha256(b'other').hexdigest())
+    assert os.listdir(tmp_path) == []
+
+    cached_file = download_cached(
+        url_of(server), str(tmp_path), sha256=hashlib.sha256(CONTENT).hexdigest()
+    )
+    assert 'If-None-Match' not in server.requests[-1]
+    assert read(cached_file) == CONTENT
+
+
+def test_cached_copy_with_other_checksum_is_downloaded_again(server, tmp_path):
+    download_cached(url_of(server), str(tmp_path))
+    server.content = CONTENT[::-1]
+
+    # the server still sends the old ETag, but the expected checksum changed
+    cached_file = download_cached(
+        url_of(server), str(tmp_path), sha256=hashlib.sha256(CONTENT[::-1]).hexdigest()
+    )
+    assert 'If-None-Match' not in server.requests[-1]
+    assert read(cached_file) == CONTENT[::-1]
@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+import pytest
+from src.benchmarks.synthetic_gtfs import generate_shapes
+from src.utils.reshape_data import combine_plot_data, generate_segment_data, segment_plot_data
+
+
+def write_shapes(shapes, gtfs_dir):
+    shapes.assign(shape_pt_sequence=shapes.groupby('shape_id').cumcount() + 1) \
+        .to_csv(gtfs_dir / 'shapes.txt', index=False)
+
+
+def line_segments(plot_data):
+    """The undirected segments drawn by the plot data, with their color and
+    number of trips."""
+
+    start = plot_data.iloc[:-1].reset_index(drop=True)
+    end = plot_data.iloc[1:].reset_index(drop=True)
+    drawn = start.shape_pt_lat.notna() & end.shape_pt_lat.notna()
+    assert (start.shape_id[drawn] == end.shape_id[drawn]).all()
+
+    return sorted(
+        (min(a, b), max(a, b), color, trips)
+        for a, b, color, trips in zip(
+            zip(start.shape_pt_lat[drawn], start.shape_pt_lon[drawn]),
+            zip(end.shape_pt_lat[drawn], end.shape_pt_lon[drawn]),
+            start.route_color[drawn], start.times_taken[drawn]
+        )
+    )
+
+
+def network_segments(segments):
+    return sorted(
+        (min(a, b), max(a, b), color, trips)
+        for a, b, color, trips in zip(
+            zip(segments.lat_a, segments.lon_a), zip(segments.lat_b, segments.lon_b),
+            segments.route_color, segments.times_taken
+        )
+    )
+
+
+@pytest.fixture
+def shared_streets(tmp_path):
+    """Shapes in both directions of two routes, and a variant that shares
+    the first half of a shape and then branches off."""
+
+    walks = generate_shapes(2, 100, np.random.RandomState(0))
+    first, second = [walk for _, walk in walks.groupby('shape_id')]
+    branch = generate_shapes(1, 50, np.random.RandomState(1))
+    branch = branch.assign(
+        shape_pt_lat=branch.shape_pt_lat - branch.shape_pt_lat.iloc[0] + first.shape_pt_lat.iloc[49],
+        shape_pt_lon=branch.shape_pt_lon - branch.shape_pt_lon.iloc[0] + first.shape_pt_lon.iloc[49],
+    )
+
+    shapes = pd.concat([
+        first.assign(shape_id='a_out'),
+        first.iloc[::-1].assign(shape_id='a_back'),
+        pd.concat([first.iloc[:49], branch]).assign(shape_id='a_variant'),
+        second.assign(shape_id='b_out'),
+        second.iloc[::-1].assign(shape_id='b_back'),
+    ], ignore_index=True)[['shape_id', 'shape_pt_lat', 'shape_pt_lon']]
+    shape_data = pd.DataFrame({
+        'shape_id': ['a_out', 'a_back', 'a_variant', 'b_out', 'b_back'],
+        'route_color': ['E3000F', 'E3000F', 'E3000F', '0069B4', '0069B4'],
+        'times_taken': [20, 20, 5, 10, 10],
+    })
+    write_shapes(shapes, tmp_path)
+
+    return tmp_path, shapes, shape_data
+
+
+def test_segment_lines_draw_every_segment_once(shared_streets):
+    gtfs_dir, _, shape_data = shared_streets
+    segments = generate_segment_data(str(gtfs_dir), shape_data)
+
+    assert line_segments(segment_plot_data(segments)) == network_segments(segments)
+
+
+def test_segment_plot_data_is_smaller_than_shape_plot_data(shared_streets):
+    gtfs_dir, shapes, shape_data = shared_streets
+    segments = generate_segment_data(str(gtfs_dir), shape_data)
+
+    # each route is a single line, apart from the branch of the variant, so
+    # the streets travelled in both directions are only drawn once
+    plot_data = segment_plot_data(segments)
+    assert plot_data.shape_id.nunique() <= 4
+    assert len(plot_data) < 0.6 * len(combine_plot_data(shapes, shape_data))
+
+
+def test_separate_shapes_are_not_split(tmp_path):
+    shapes = generate_shapes(50, 100, np.random.RandomState(0)) \
+        .loc[:, ['shape_id', 'shape_pt_lat', 'shape_pt_lon']]
+    shape_data = pd.DataFrame({
+        'shape_id': shapes.shape_id.unique(), 'route_color': 'E3000F', 'times_taken': 1
+    })
+    write_shapes(shapes, tmp_path)
+    segments = generate_segment_data(str(tmp_path), shape_data)
+
+    plot_data = segment_plot_data(segments)
+    assert line_segments(plot_data) == network_segments(segments)
+    assert len(plot_data) <= len(combine_plot_data(shapes, shape_data))